@@ -2,6 +2,9 @@ try:
   import librosa
 except ImportError:
   pass
+import os
+import struct
+
 import numpy as np
 from scipy.io.wavfile import read as spwavread, write as spwavwrite
 
@@ -91,3 +94,52 @@ def save_as_wav(fp, fs, x):
   x = np.clip(x, -32768., 32767.)
   x = x.astype(np.int16)
   spwavwrite(fp, fs, x)
+
+
+def _probe_wav(f, file_size):
+  # Walks the RIFF chunks after the 12 byte RIFF/WAVE header
+  fmt = None
+  offset = 12
+  while offset + 8 <= file_size:
+    f.seek(offset)
+    chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+    offset += 8
+    if chunk_id == b'fmt ':
+      fmt = struct.unpack('<HHIIHH', f.read(16))
+    elif chunk_id == b'data':
+      if fmt is None:
+        raise ValueError('WAV data chunk precedes format chunk')
+      _, nch, fs, _, block_align, _ = fmt
+      # Streamed or truncated files have an incorrect data chunk size
+      nbytes = min(chunk_size, file_size - offset)
+      return fs, nbytes // block_align, nch
+    offset += chunk_size + (chunk_size & 1)
+  raise ValueError('WAV file has no data chunk')
+
+
+def probe_audio(fp):
+  """Reads the sample rate, length and number of channels of an audio file.
+
+  WAV files are probed by reading their headers only. Other formats are probed
+  with soundfile if available, and otherwise decoded in full.
+
+  Args:
+    fp: Audio file path.
+
+  Returns:
+    (sample rate, number of samples, number of channels).
+  """
+  with open(fp, 'rb') as f:
+    header = f.read(12)
+    if len(header) == 12 and header[:4] == b'RIFF' and header[8:] == b'WAVE':
+      return _probe_wav(f, os.fstat(f.fileno()).st_size)
+
+  try:
+    import soundfile
+    info = soundfile.info(fp)
+    return info.samplerate, info.frames, info.channels
+  except Exception:
+    pass
+
+  fs, x = decode_audio(fp)
+  return fs, x.shape[0], x.shape[2]
@@ -0,0 +1,261 @@
+import errno
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+# ioctl to share (copy-on-write) the extents of another file
+_FICLONE = 0x40049409
+
+_MANIFEST_EXT = '.manifest.json'
+
+
+def reflink(src_fp, dst_fp):
+  """Clones a file without copying its data (btrfs, XFS and others).
+
+  Raises:
+    OSError: If the filesystem does not support cloning.
+  """
+  with open(src_fp, 'rb') as src, open(dst_fp, 'wb') as dst:
+    try:
+      fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except (IOError, OSError):
+      dst.close()
+      os.remove(dst_fp)
+      raise
+
+
+def _atomic_write(fp, data):
+  tmp_fp = fp + '.tmp'
+  with open(tmp_fp, 'wb') as f:
+    f.write(data)
+  os.rename(tmp_fp, fp)
+
+
+class CheckpointBackup(object):
+  """Incremental store of checkpoint backups.
+
+  Each backed up checkpoint is described by a manifest which is written last,
+  so interrupted backups are redone. Checkpoints that already have a manifest
+  are skipped. Files are stored according to mode:
+
+    link: Reflinked if the filesystem supports it, else hardlinked (TensorFlow
+      never modifies checkpoint files in place), else copied.
+    dedup: Split into fixed-size chunks stored once per content hash, so that
+      data shards sharing unchanged variables share storage.
+    copy: Copied in full.
+  """
+
+  def __init__(self, backup_dir, mode='link', keep=None, chunk_size=4 * (1 << 20)):
+    """Creates (or opens) a backup store.
+
+    Args:
+      backup_dir: Backup directory.
+      mode: One of 'link', 'dedup' or 'copy'.
+      keep: If set, number of most recent backups to retain.
+      chunk_size: Chunk size in bytes for dedup mode.
+    """
+    if mode not in ['link', 'dedup', 'copy']:
+      raise ValueError('Unknown backup mode {}'.format(mode))
+    if keep is not None and keep < 1:
+      raise ValueError('Must keep at least one backup')
+
+    self.backup_dir = backup_dir
+    self.mode = mode
+    self.keep = keep
+    self.chunk_size = chunk_size
+    self.chunks_dir = os.path.join(backup_dir, 'chunks')
+
+    self.nbytes_read = 0
+    self.nbytes_written = 0
+    self.nbytes_linked = 0
+
+    if not os.path.isdir(self.chunks_dir):
+      os.makedirs(self.chunks_dir)
+
+
+  def _manifest_fp(self, name):
+    return os.path.join(self.backup_dir, name + _MANIFEST_EXT)
+
+
+  def _read_manifest(self, name):
+    with open(self._manifest_fp(name), 'r') as f:
+      return json.load(f)
+
+
+  def held(self):
+    """Names of backed up checkpoints, oldest first."""
+    manifests = [self._read_manifest(os.path.basename(fp)[:-len(_MANIFEST_EXT)])
+        for fp in glob.glob(os.path.join(glob.escape(self.backup_dir), '*' + _MANIFEST_EXT))]
+    return [m['name'] for m in sorted(manifests, key=lambda m: m['time'])]
+
+
+  def _chunk_fp(self, digest):
+    return os.path.join(self.chunks_dir, digest[:2], digest)
+
+
+  def _store_chunks(self, fp):
+    digests = []
+    with open(fp, 'rb') as f:
+      while True:
+        chunk = f.read(self.chunk_size)
+        if len(chunk) == 0:
+          break
+        self.nbytes_read += len(chunk)
+
+        digest = hashlib.sha256(chunk).hexdigest()
+        chunk_fp = self._chunk_fp(digest)
+        if not os.path.exists(chunk_fp):
+          if not os.path.isdir(os.path.dirname(chunk_fp)):
+            os.makedirs(os.path.dirname(chunk_fp))
+          _atomic_write(chunk_fp, chunk)
+          self.nbytes_written += len(chunk)
+        digests.append(digest)
+    return digests
+
+
+  def _link(self, fp, backup_fp):
+    if os.path.exists(backup_fp):
+      os.remove(backup_fp)
+    try:
+      reflink(fp, backup_fp)
+      self.nbytes_linked += os.path.getsize(fp)
+      return
+    except (IOError, OSError):
+      pass
+    try:
+      os.link(fp, backup_fp)
+      self.nbytes_linked += os.path.getsize(fp)
+      return
+    except OSError as e:
+      if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+        raise
+    self._copy(fp, backup_fp)
+
+
+  def _copy(self, fp, backup_fp):
+    shutil.copyfile(fp, backup_fp)
+    nbytes = os.path.getsize(fp)
+    self.nbytes_read += nbytes
+    self.nbytes_written += nbytes
+
+
+  def backup(self, prefix):
+    """Backs up a checkpoint unless it is already held.
+
+    Args:
+      prefix: Checkpoint prefix (e.g. train_dir/model.ckpt-1000).
+
+    Returns:
+      True if the checkpoint was backed up, False if it was already held.
+    """
+    name = os.path.basename(prefix)
+    if os.path.exists(self._manifest_fp(name)):
+      return False
+
+    files = {}
+    for fp in sorted(glob.glob(glob.escape(prefix) + '.*')):
+      fn = os.path.basename(fp)
+      entry = {'size': os.path.getsize(fp)}
+      if self.mode == 'dedup':
+        entry['chunks'] = self._store_chunks(fp)
+      elif self.mode == 'link':
+        self._link(fp, os.path.join(self.backup_dir, fn))
+      else:
+        self._copy(fp, os.path.join(self.backup_dir, fn))
+      files[fn] = entry
+
+    if len(files) == 0:
+      raise ValueError('No files found for checkpoint {}'.format(prefix))
+
+    manifest = {
+      'name': name,
+      'time': time.time(),
+      'mode': self.mode,
+      'chunk_size': self.chunk_size,
+      'files': files
+    }
+    _atomic_write(self._manifest_fp(name), json.dumps(manifest, indent=2).encode('utf-8'))
+
+    self.prune()
+    return True
+
+
+  def prune(self):
+    """Deletes backups beyond the retention limit and unreferenced chunks.
+
+    Returns:
+      Names of deleted backups.
+    """
+    held = self.held()
+    if self.keep is None or len(held) <= self.keep:
+      return []
+
+    deleted = held[:-self.keep]
+    for name in deleted:
+      manifest = self._read_manifest(name)
+      # Manifest first, so that a partially deleted backup is not held
+      os.remove(self._manifest_fp(name))
+      if manifest['mode'] != 'dedup':
+        for fn in manifest['files']:
+          fp = os.path.join(self.backup_dir, fn)
+          if os.path.exists(fp):
+            os.remove(fp)
+
+    referenced = set()
+    for name in held[-self.keep:]:
+      for entry in self._read_manifest(name)['files'].values():
+        referenced.update(entry.get('chunks', []))
+    for fp in glob.glob(os.path.join(glob.escape(self.chunks_dir), '*', '*')):
+      if os.path.basename(fp) not in referenced:
+        os.remove(fp)
+
+    return deleted
+
+
+  def restore(self, name, out_dir):
+    """Restores a backed up checkpoint.
+
+    Also writes a checkpoint state file so that out_dir can be passed to
+    tf.train.latest_checkpoint.
+
+    Args:
+      name: Checkpoint name (e.g. model.ckpt-1000).
+      out_dir: Output directory.
+
+    Returns:
+      Restored checkpoint prefix.
+    """
+    manifest = self._read_manifest(name)
+    if not os.path.isdir(out_dir):
+      os.makedirs(out_dir)
+
+    for fn, entry in manifest['files'].items():
+      out_fp = os.path.join(out_dir, fn)
+      if manifest['mode'] == 'dedup':
+        with open(out_fp, 'wb') as f:
+          for digest in entry['chunks']:
+            with open(self._chunk_fp(digest), 'rb') as chunk_f:
+              f.write(chunk_f.read())
+      else:
+        shutil.copyfile(os.path.join(self.backup_dir, fn), out_fp)
+
+      if os.path.getsize(out_fp) != entry['size']:
+        raise IOError('Restored {} has the wrong size'.format(out_fp))
+
+    with open(os.path.join(out_dir, 'checkpoint'), 'w') as f:
+      f.write('model_checkpoint_path: "{}"\n'.format(name))
+      f.write('all_model_checkpoint_paths: "{}"\n'.format(name))
+
+    return os.path.join(out_dir, name)
+
+
+  def summary(self):
+    return 'Read {:.1f} MB, wrote {:.1f} MB, linked {:.1f} MB'.format(
+      self.nbytes_read / float(1 << 20),
+      self.nbytes_written / float(1 << 20),
+      self.nbytes_linked / float(1 << 20))
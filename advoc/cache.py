@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+class ExampleCache(object):
+  """LRU cache of decoded (and optionally featurized) examples.
+
+  Examples are tuples of np arrays keyed by file path. The most recently used
+  examples are held in RAM up to a byte budget. If a spill directory is
+  specified, examples evicted from RAM are written there (subject to a second
+  byte budget) and promoted back to RAM when requested again.
+
+  The cache is safe to use from the parallel threads of a tf.data map.
+  """
+
+  def __init__(self, max_nbytes, spill_dir=None, spill_max_nbytes=None):
+    """Creates an empty cache.
+
+    Args:
+      max_nbytes: Byte budget for examples held in RAM.
+      spill_dir: If specified, spill examples evicted from RAM to this directory.
+      spill_max_nbytes: Byte budget for the spill directory (None is unbounded).
+    """
+    if max_nbytes < 0:
+      raise ValueError('Cache byte budget must be nonnegative')
+    self.max_nbytes = max_nbytes
+    self.spill_dir = spill_dir
+    self.spill_max_nbytes = spill_max_nbytes
+
+    if spill_dir is not None and not os.path.isdir(spill_dir):
+      os.makedirs(spill_dir)
+
+    self._lock = threading.Lock()
+    self._mem = OrderedDict()
+    self._mem_nbytes = 0
+    self._spill = OrderedDict()
+    self._spill_nbytes = 0
+
+    self.hits = 0
+    self.spill_hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @property
+  def nbytes(self):
+    return self._mem_nbytes
+
+  @property
+  def spill_nbytes(self):
+    return self._spill_nbytes
+
+  @property
+  def hit_rate(self):
+    nrequests = self.hits + self.spill_hits + self.misses
+    if nrequests == 0:
+      return 0.
+    return float(self.hits + self.spill_hits) / nrequests
+
+  def __len__(self):
+    return len(self._mem) + len(self._spill)
+
+  def __contains__(self, key):
+    with self._lock:
+      return key in self._mem or key in self._spill
+
+  def get(self, key):
+    """Retrieves an example, returning None (and counting a miss) if absent."""
+    with self._lock:
+      if key in self._mem:
+        self._mem.move_to_end(key)
+        self.hits += 1
+        return self._mem[key]
+
+      if key in self._spill:
+        spill_fp, _ = self._spill.pop(key)
+        with np.load(spill_fp) as f:
+          value = tuple(f['arr_{}'.format(i)] for i in range(len(f.files)))
+        os.remove(spill_fp)
+        self._spill_nbytes -= _nbytes(value)
+        self.spill_hits += 1
+        self._put(key, value)
+        return value
+
+      self.misses += 1
+      return None
+
+  def put(self, key, value):
+    """Inserts an example (tuple of np arrays), evicting as necessary."""
+    with self._lock:
+      self._put(key, tuple(value))
+
+  def get_or_compute(self, key, compute_fn):
+    """Retrieves an example or computes and caches it on a miss."""
+    value = self.get(key)
+    if value is None:
+      value = tuple(compute_fn())
+      self.put(key, value)
+    return value
+
+  def summary(self):
+    return 'Cache: {} examples, {:.1f} MB in RAM, {:.1f} MB spilled, hit rate {:.3f} ({} hits, {} spill hits, {} misses)'.format(
+        len(self),
+        self._mem_nbytes / float(1 << 20),
+        self._spill_nbytes / float(1 << 20),
+        self.hit_rate,
+        self.hits,
+        self.spill_hits,
+        self.misses)
+
+  def _put(self, key, value):
+    if key in self._mem:
+      self._mem_nbytes -= _nbytes(self._mem.pop(key))
+
+    value_nbytes = _nbytes(value)
+    if value_nbytes > self.max_nbytes:
+      self._spill_put(key, value)
+      return
+
+    self._mem[key] = value
+    self._mem_nbytes += value_nbytes
+
+    while self._mem_nbytes > self.max_nbytes:
+      evict_key, evict_value = self._mem.popitem(last=False)
+      self._mem_nbytes -= _nbytes(evict_value)
+      self.evictions += 1
+      self._spill_put(evict_key, evict_value)
+
+  def _spill_put(self, key, value):
+    if self.spill_dir is None:
+      return
+
+    value_nbytes = _nbytes(value)
+    if self.spill_max_nbytes is not None and value_nbytes > self.spill_max_nbytes:
+      return
+
+    if key in self._spill:
+      spill_fp, spill_nbytes = self._spill.pop(key)
+      os.remove(spill_fp)
+      self._spill_nbytes -= spill_nbytes
+
+    if isinstance(key, str):
+      key_bytes = key.encode('utf-8')
+    else:
+      key_bytes = bytes(key)
+    spill_fp = os.path.join(
+        self.spill_dir, hashlib.sha1(key_bytes).hexdigest() + '.npz')
+    np.savez(spill_fp, *value)
+    self._spill[key] = (spill_fp, value_nbytes)
+    self._spill_nbytes += value_nbytes
+
+    while self.spill_max_nbytes is not None and self._spill_nbytes > self.spill_max_nbytes:
+      _, (evict_fp, evict_nbytes) = self._spill.popitem(last=False)
+      os.remove(evict_fp)
+      self._spill_nbytes -= evict_nbytes
+
+
+def _nbytes(value):
+  return sum(x.nbytes for x in value)
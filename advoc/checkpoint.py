@@ -0,0 +1,216 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import re
+import select
+import struct
+import time
+
+
+# Footer magic number of the SSTable holding a (V2) checkpoint's index
+_INDEX_MAGIC = struct.pack('<Q', 0xdb4775248b80fb57)
+_INDEX_FOOTER_NBYTES = 48
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+
+
+def read_checkpoint_paths(train_dir):
+  """Lists checkpoint prefixes in a training directory, oldest first.
+
+  Reads the "checkpoint" state file written by tf.train.Saver without
+  importing TensorFlow.
+
+  Args:
+    train_dir: Training directory.
+
+  Returns:
+    List of checkpoint prefixes (empty if there is no state file).
+  """
+  try:
+    with open(os.path.join(train_dir, 'checkpoint'), 'r') as f:
+      state = f.read()
+  except (IOError, OSError):
+    return []
+
+  latest = re.findall(r'^model_checkpoint_path:\s*"(.*)"\s*$', state, re.M)
+  paths = re.findall(r'^all_model_checkpoint_paths:\s*"(.*)"\s*$', state, re.M)
+  if len(latest) > 0 and latest[0] not in paths:
+    paths.append(latest[0])
+
+  return [p if os.path.isabs(p) else os.path.join(train_dir, p) for p in paths]
+
+
+def is_checkpoint_complete(prefix):
+  """True if a checkpoint's index and every data shard have been written.
+
+  The index is complete once its footer (ending with the table magic number)
+  has been written. The data shards are named <prefix>.data-<i>-of-<n>.
+
+  Args:
+    prefix: Checkpoint prefix (e.g. train_dir/model.ckpt-1000).
+  """
+  try:
+    with open(prefix + '.index', 'rb') as f:
+      f.seek(0, os.SEEK_END)
+      if f.tell() < _INDEX_FOOTER_NBYTES:
+        return False
+      f.seek(-len(_INDEX_MAGIC), os.SEEK_END)
+      if f.read() != _INDEX_MAGIC:
+        return False
+  except (IOError, OSError):
+    return False
+
+  data_fps = glob.glob(glob.escape(prefix) + '.data-[0-9][0-9][0-9][0-9][0-9]-of-[0-9][0-9][0-9][0-9][0-9]')
+  if len(data_fps) == 0:
+    return False
+  nshards = int(data_fps[0][-5:])
+  expected = set(['{}.data-{:05d}-of-{:05d}'.format(prefix, i, nshards) for i in range(nshards)])
+  return expected.issubset(set(data_fps))
+
+
+def _inotify_init(train_dir):
+  # Returns a non-blocking inotify file descriptor watching train_dir, or None
+  # if inotify is unavailable
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+  except (OSError, AttributeError):
+    return None
+  if fd < 0:
+    return None
+
+  mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+  if libc.inotify_add_watch(fd, train_dir.encode('utf-8'), mask) < 0:
+    os.close(fd)
+    return None
+
+  return fd
+
+
+class CheckpointWatcher(object):
+  """Dispatches new complete checkpoints in a training directory.
+
+  Changes to the directory are detected with inotify where available, and by
+  polling otherwise. A checkpoint is dispatched once it is listed in the
+  checkpoint state file and is complete (see is_checkpoint_complete).
+
+  If checkpoints arrive faster than they are handled, only the newest
+  backlog of them are dispatched and the rest are skipped.
+  """
+
+  def __init__(
+      self,
+      train_dir,
+      backlog=1,
+      poll_interval=1.,
+      use_inotify=True):
+    """Creates a watcher.
+
+    Args:
+      train_dir: Training directory (need not exist yet).
+      backlog: Maximum number of pending checkpoints to dispatch.
+      poll_interval: Seconds between scans without inotify. With inotify,
+        the directory is still scanned at ten times this interval in case
+        events are missed (e.g. on network filesystems).
+      use_inotify: If false, always poll.
+    """
+    if backlog < 1:
+      raise ValueError('Backlog must be positive')
+
+    self.train_dir = train_dir
+    self.backlog = backlog
+    self.poll_interval = poll_interval
+    self.use_inotify = use_inotify
+
+    self.handlers = []
+    self.ndispatched = 0
+    self.nskipped = 0
+
+    self._last = None
+    self._inotify_fd = None
+
+
+  def add_handler(self, fn):
+    """Registers a function called with each new checkpoint prefix."""
+    self.handlers.append(fn)
+
+
+  def _pending(self):
+    paths = read_checkpoint_paths(self.train_dir)
+    if self._last in paths:
+      paths = paths[paths.index(self._last) + 1:]
+    return [p for p in paths if is_checkpoint_complete(p)]
+
+
+  def _wait(self, timeout):
+    if self.use_inotify and self._inotify_fd is None and os.path.isdir(self.train_dir):
+      self._inotify_fd = _inotify_init(self.train_dir)
+      if self._inotify_fd is None:
+        self.use_inotify = False
+
+    if self._inotify_fd is None:
+      time.sleep(timeout)
+      return
+
+    readable, _, _ = select.select([self._inotify_fd], [], [], timeout)
+    if len(readable) > 0:
+      # Drain events, rescanning the directory covers all of them
+      try:
+        while len(os.read(self._inotify_fd, 65536)) > 0:
+          pass
+      except BlockingIOError:
+        pass
+
+
+  def checkpoints(self, timeout=None):
+    """Yields new complete checkpoint prefixes as they appear.
+
+    Args:
+      timeout: If set, stop after this many seconds without a new checkpoint.
+
+    Yields:
+      Checkpoint prefixes, oldest first.
+    """
+    last_time = time.time()
+    while True:
+      pending = self._pending()
+      if len(pending) > self.backlog:
+        nskipped = len(pending) - self.backlog
+        print('Skipping {} checkpoints to catch up'.format(nskipped))
+        self.nskipped += nskipped
+        pending = pending[-self.backlog:]
+
+      if len(pending) > 0:
+        # Only dispatch the oldest so that later arrivals count towards the
+        # backlog
+        self._last = pending[0]
+        self.ndispatched += 1
+        yield pending[0]
+        last_time = time.time()
+        continue
+
+      wait = self.poll_interval if self._inotify_fd is None else 10. * self.poll_interval
+      if timeout is not None:
+        remaining = timeout - (time.time() - last_time)
+        if remaining <= 0:
+          return
+        wait = min(wait, remaining)
+      self._wait(wait)
+
+
+  def run(self, timeout=None):
+    """Calls every handler with each new checkpoint (see checkpoints)."""
+    for ckpt_fp in self.checkpoints(timeout=timeout):
+      for fn in self.handlers:
+        fn(ckpt_fp)
+
+
+  def close(self):
+    if self._inotify_fd is not None:
+      os.close(self._inotify_fd)
+      self._inotify_fd = None
@@ -2,7 +2,8 @@ import numpy as np
 import tensorflow as tf
 
 from advoc.audioio import decode_audio
-from advoc.spectral import waveform_to_melspec_tf, stft_tf
+from advoc.spectral import waveform_to_melspec, waveform_to_melspec_tf
+from advoc.spectral import stft, stft_tf
 
 
 def decode_extract_and_batch(
@@ -12,8 +13,11 @@ def decode_extract_and_batch(
     audio_fs=22050,
     audio_mono=True,
     audio_normalize=False,
+    audio_return=True,
     decode_fastwav=False,
     decode_parallel_calls=1,
+    cache=None,
+    cache_features=False,
     extract_type=None,
     extract_nfft=1024,
     extract_nhop=256,
@@ -21,12 +25,18 @@ def decode_extract_and_batch(
     repeat=False,
     shuffle=False,
     shuffle_buffer_size=None,
+    shuffle_compact_dtype=None,
+    num_shards=1,
+    shard_index=0,
+    shard_seed=0,
     slice_first_only=False,
     slice_randomize_offset=False,
     slice_overlap_ratio=0,
     slice_pad_end=False,
+    drop_remainder=True,
     prefetch_size=None,
-    prefetch_gpu_num=None):
+    prefetch_gpu_num=None,
+    stats_aggregator=None):
   """Decodes audio files directly into [b, slice_len, nfeats, nch] batches.
 
   This is a monstrous function signature. However, this method needs to do a 
@@ -41,8 +51,11 @@ def decode_extract_and_batch(
     audio_fs: Sample rate for decoded audio files.
     audio_mono: If false, preserves multichannel (all files must have same).
     audio_normalize: If true, normalize audio waveforms.
+    audio_return: If false, skips slicing audio and returns None in its place.
     decode_fastwav: If true, uses scipy to quickly decode standard wav files.
     decode_parallel_calls: Number of parallel decoding threads.
+    cache: If specified, an advoc.cache.ExampleCache to hold decoded audio.
+    cache_features: If true, also extract features in numpy and cache them.
     extract_type: Type of spectral features to extract: None, magspec, melspec.
     extract_nfft: STFT window size for feature extraction.
     extract_nhop: STFT hop size for feature extraction.
@@ -50,28 +63,58 @@ def decode_extract_and_batch(
     repeat: If true (for training), continuously iterate through the dataset.
     shuffle: If true (for training), buffer and shuffle the slices.
     shuffle_buffer_size: Size of buffer for shuffling.
+    shuffle_compact_dtype: If 'int16' or 'float16', shuffle compact audio
+      slices and extract features after shuffling (reduces buffer memory).
+    num_shards: Number of data-parallel workers splitting the file list.
+    shard_index: Index of this worker in [0, num_shards).
+    shard_seed: Seed for per-epoch file shuffling (must match across workers).
     slice_first_only: If true, only use first slice from each audio file.
     slice_randomize_offset: If true, randomize starting position for slice.
     slice_overlap_ratio: Ratio of overlap between feature slices.
     slice_pad_end: If true, zero pad features.
+    drop_remainder: If true, drop the final partial batch so that all batches
+      have batch_size items (set False to keep every slice, e.g. for eval).
     prefetch_size: If a number, prefetch this many batches.
     prefetch_gpu_num: If a number, prefetch to this GPU num.
+    stats_aggregator: If specified, a tf.data.experimental.StatsAggregator to
+      record per-stage latencies (decode, extract, slice, batch, prefetch),
+      bytes produced and prefetch queue depth.
 
   Returns:
-    A tuple of np.float32 tensors representing audio and feature slices.
-      audio: [batch_size, ?, 1, nch]
+    A tuple of np.float32 tensors representing feature and audio slices.
       features: [batch_size, ? // nhop, nfeats, nch]
+      audio: [batch_size, ?, 1, nch] (None if audio_return is false)
   """
+  if num_shards < 1 or shard_index < 0 or shard_index >= num_shards:
+    raise ValueError('Shard index must be in [0, num_shards)')
+  if len(fps) < num_shards:
+    raise ValueError('Fewer audio files than shards')
+
   # Create dataset of filepaths
   dataset = tf.data.Dataset.from_tensor_slices(fps)
 
-  # Shuffle all filepaths every epoch
-  if shuffle:
-    dataset = dataset.shuffle(buffer_size=len(fps))
-
-  # Repeat
-  if repeat:
+  if num_shards > 1 and shuffle and repeat:
+    # Every worker shuffles the full list identically (shared seed) each
+    # epoch and takes a disjoint subset before decoding. Hence workers see
+    # different files every epoch while never overlapping within an epoch.
+    dataset = dataset.shuffle(
+        buffer_size=len(fps),
+        seed=shard_seed,
+        reshuffle_each_iteration=True)
     dataset = dataset.repeat()
+    dataset = dataset.shard(num_shards, shard_index)
+  else:
+    # Take a fixed subset of files before decoding
+    if num_shards > 1:
+      dataset = dataset.shard(num_shards, shard_index)
+
+    # Shuffle all filepaths every epoch
+    if shuffle:
+      dataset = dataset.shuffle(buffer_size=len(fps))
+
+    # Repeat
+    if repeat:
+      dataset = dataset.repeat()
 
   def _decode_audio_shaped(fp):
     _decode_audio_closure = lambda _fp: decode_audio(
@@ -90,13 +133,107 @@ def decode_extract_and_batch(
 
     return audio
 
-  # Decode audio
+  def _decode_audio_cached_shaped(fp):
+    _decode_audio_closure = lambda _fp: decode_audio(
+      _fp,
+      fs=audio_fs,
+      mono=audio_mono,
+      normalize=audio_normalize,
+      fastwav=decode_fastwav)[1]
+
+    _cached_closure = lambda _fp: cache.get_or_compute(
+        _fp, lambda: (_decode_audio_closure(_fp),))[0]
+
+    audio = tf.py_func(
+        _cached_closure,
+        [fp],
+        tf.float32,
+        stateful=False)
+    audio.set_shape([None, 1, 1 if audio_mono else None])
+
+    return audio
+
+  def _decode_and_extract_cached_shaped(fp):
+    def _decode_and_extract(_fp):
+      _, audio = decode_audio(
+          _fp,
+          fs=audio_fs,
+          mono=audio_mono,
+          normalize=audio_normalize,
+          fastwav=decode_fastwav)
+      if extract_type == 'melspec':
+        features = waveform_to_melspec(
+            audio,
+            fs=audio_fs,
+            nfft=extract_nfft,
+            nhop=extract_nhop)
+      else:
+        features = np.abs(stft(audio, nfft=extract_nfft, nhop=extract_nhop))
+      return features.astype(np.float32), audio
+
+    _cached_closure = lambda _fp: cache.get_or_compute(
+        _fp, lambda: _decode_and_extract(_fp))
+
+    features, audio = tf.py_func(
+        _cached_closure,
+        [fp],
+        [tf.float32, tf.float32],
+        stateful=False)
+    features.set_shape([None, _num_features(extract_type, extract_nfft), 1])
+    audio.set_shape([None, 1, 1])
+
+    return features, audio
+
+  if cache_features:
+    if cache is None:
+      raise ValueError('Caching features requires a cache')
+    if extract_type not in ['melspec', 'magspec']:
+      raise ValueError('Caching features requires spectral features')
+    if not audio_mono:
+      raise NotImplementedError('Can only cache features of monaural audio')
+    if shuffle_compact_dtype is not None:
+      raise ValueError('Compact shuffling extracts features after shuffling')
+
+  # Decode audio (and extract features if caching them)
+  if cache is None:
+    _decode_fn = _decode_audio_shaped
+  elif cache_features:
+    _decode_fn = _decode_and_extract_cached_shaped
+  else:
+    _decode_fn = _decode_audio_cached_shaped
   dataset = dataset.map(
-      _decode_audio_shaped,
+      _decode_fn,
       num_parallel_calls=decode_parallel_calls)
+  dataset = _record_latency(dataset, stats_aggregator, 'decode')
+
+  if shuffle_compact_dtype is not None:
+    return _slice_compact_shuffle_and_extract(
+        dataset,
+        batch_size,
+        slice_len,
+        audio_fs=audio_fs,
+        audio_return=audio_return,
+        compact_dtype=shuffle_compact_dtype,
+        extract_type=extract_type,
+        extract_nfft=extract_nfft,
+        extract_nhop=extract_nhop,
+        extract_parallel_calls=extract_parallel_calls,
+        shuffle=shuffle,
+        shuffle_buffer_size=shuffle_buffer_size,
+        slice_first_only=slice_first_only,
+        slice_randomize_offset=slice_randomize_offset,
+        slice_overlap_ratio=slice_overlap_ratio,
+        slice_pad_end=slice_pad_end,
+        drop_remainder=drop_remainder,
+        prefetch_size=prefetch_size,
+        prefetch_gpu_num=prefetch_gpu_num,
+        stats_aggregator=stats_aggregator)
 
   # Extract features
-  if extract_type is None:
+  if cache_features:
+    feature_fs = audio_fs / extract_nhop
+    slice_pad_val = 0.
+  elif extract_type is None:
     feature_fs = audio_fs
     slice_pad_val = 0.
     dataset = dataset.map(lambda x: (x, x))
@@ -128,6 +265,8 @@ def decode_extract_and_batch(
         num_parallel_calls=extract_parallel_calls)
   else:
     raise ValueError()
+  if not cache_features:
+    dataset = _record_latency(dataset, stats_aggregator, 'extract')
 
   # Extract paired audio and features
   def _parallel_slice(features, audio):
@@ -169,6 +308,13 @@ def decode_extract_and_batch(
         pad_end=slice_pad_end,
         pad_value=slice_pad_val,
         axis=0)
+    if slice_first_only:
+      feature_slices = feature_slices[:1]
+
+    # Skip audio framing entirely if audio is not needed downstream
+    if not audio_return:
+      return feature_slices, None
+
     audio_slices = tf.contrib.signal.frame(
         audio,
         audio_slice_len,
@@ -178,7 +324,6 @@ def decode_extract_and_batch(
         axis=0)
 
     if slice_first_only:
-      feature_slices = feature_slices[:1]
       audio_slices = audio_slices[:1]
 
     # TODO: Make sure first dim is equal (same number of slices)
@@ -187,6 +332,8 @@ def decode_extract_and_batch(
 
   def _parallel_slice_dataset_wrapper(features, audio):
     feature_slices, audio_slices = _parallel_slice(features, audio)
+    if audio_slices is None:
+      return tf.data.Dataset.from_tensor_slices(feature_slices)
     return tf.data.Dataset.zip((
       tf.data.Dataset.from_tensor_slices(feature_slices),
       tf.data.Dataset.from_tensor_slices(audio_slices),
@@ -194,17 +341,76 @@ def decode_extract_and_batch(
 
   # Extract parallel slices from both audio and features
   dataset = dataset.flat_map(_parallel_slice_dataset_wrapper)
+  dataset = _record_latency(dataset, stats_aggregator, 'slice')
 
   # Shuffle examples
   if shuffle:
+    audio_nbytes = slice_len * int(round(float(audio_fs) / feature_fs)) * 4
+    _log_shuffle_buffer_nbytes(
+        shuffle_buffer_size,
+        slice_len * _num_features(extract_type, extract_nfft) * 4,
+        audio_nbytes if audio_return else 0)
     dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
 
   # Make batches
-  dataset = dataset.batch(batch_size, drop_remainder=True)
+  dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+  dataset = _record_latency(dataset, stats_aggregator, 'batch')
+
+  return _prefetch_and_get_next(
+      dataset, prefetch_size, prefetch_gpu_num, stats_aggregator)
+
+
+def _num_features(extract_type, extract_nfft):
+  """Number of feature bins per timestep for an extraction type."""
+  if extract_type is None:
+    return 1
+  elif extract_type == 'melspec':
+    return 80
+  elif extract_type == 'magspec':
+    return (extract_nfft // 2) + 1
+  else:
+    raise ValueError()
+
+
+def _log_shuffle_buffer_nbytes(shuffle_buffer_size, *example_nbytes):
+  """Logs the (per channel) host memory held by the shuffle buffer."""
+  nbytes = shuffle_buffer_size * sum(example_nbytes)
+  tf.logging.info(
+      'Shuffle buffer: {} examples x {} bytes = {:.1f} MB per channel'.format(
+        shuffle_buffer_size, sum(example_nbytes), nbytes / float(1 << 20)))
+  return nbytes
+
+
+def _record_latency(dataset, stats_aggregator, stage):
+  """Records per-element latency of a loader stage if aggregating stats."""
+  if stats_aggregator is None:
+    return dataset
+  return dataset.apply(
+      tf.data.experimental.latency_stats('loader_{}_latency'.format(stage)))
+
+
+def _prefetch_and_get_next(
+    dataset,
+    prefetch_size,
+    prefetch_gpu_num,
+    stats_aggregator=None):
+  """Prefetches batches of features (and audio) and returns output tensors."""
+  if stats_aggregator is not None:
+    dataset = dataset.apply(
+        tf.data.experimental.bytes_produced_stats('loader_batch_bytes'))
 
   # Queue up a number of batches on the CPU side
   if prefetch_size is not None:
     dataset = dataset.prefetch(prefetch_size)
+    dataset = _record_latency(dataset, stats_aggregator, 'prefetch')
+
+  # Stats must be attached before prefetching to device (final transformation)
+  if stats_aggregator is not None:
+    dataset = dataset.apply(
+        tf.data.experimental.set_stats_aggregator(stats_aggregator))
+
+  # Queue up a number of batches on the GPU side
+  if prefetch_size is not None:
     if prefetch_gpu_num is not None and prefetch_gpu_num >= 0:
       dataset = dataset.apply(
           tf.data.experimental.prefetch_to_device(
@@ -213,6 +419,148 @@ def decode_extract_and_batch(
   # Get tensors
   iterator = dataset.make_one_shot_iterator()
 
-  x_feats, x_audio = iterator.get_next()
+  x = iterator.get_next()
+  if not isinstance(x, tuple):
+    return tf.stop_gradient(x), None
+
+  x_feats, x_audio = x
 
   return tf.stop_gradient(x_feats), tf.stop_gradient(x_audio)
+
+
+def _slice_compact_shuffle_and_extract(
+    dataset,
+    batch_size,
+    slice_len,
+    audio_fs,
+    audio_return,
+    compact_dtype,
+    extract_type,
+    extract_nfft,
+    extract_nhop,
+    extract_parallel_calls,
+    shuffle,
+    shuffle_buffer_size,
+    slice_first_only,
+    slice_randomize_offset,
+    slice_overlap_ratio,
+    slice_pad_end,
+    drop_remainder,
+    prefetch_size,
+    prefetch_gpu_num,
+    stats_aggregator):
+  """Slices compact audio, shuffles it, and extracts features per batch.
+
+  Audio slices carry (nfft - nhop) samples of extra context so that features
+  extracted from each slice match those sliced from whole-file features. Audio
+  is quantized to compact_dtype for buffering; features are extracted from the
+  dequantized audio (lossless for 16-bit WAV files without normalization).
+
+  Args:
+    dataset: Dataset of decoded np.float32 waveforms [nsamps, 1, nch].
+    compact_dtype: One of 'int16' or 'float16'.
+    (See decode_extract_and_batch for remaining arguments.)
+
+  Returns:
+    A tuple of np.float32 tensors (see decode_extract_and_batch).
+  """
+  if compact_dtype == 'int16':
+    tf_compact_dtype = tf.int16
+  elif compact_dtype == 'float16':
+    tf_compact_dtype = tf.float16
+  else:
+    raise ValueError('Compact dtype must be int16 or float16')
+
+  if slice_overlap_ratio < 0:
+    raise ValueError('Slice overlap must be nonnegative')
+  slice_hop = int(round(slice_len * (1. - slice_overlap_ratio)))
+  if slice_hop < 1:
+    raise ValueError('Overlap ratio too high')
+
+  if extract_type is None:
+    nsamps_per_tstep = 1
+    audio_context_len = 0
+  elif extract_type in ['melspec', 'magspec']:
+    nsamps_per_tstep = extract_nhop
+    audio_context_len = extract_nfft - extract_nhop
+  else:
+    raise ValueError()
+  audio_slice_len = slice_len * nsamps_per_tstep
+  audio_slice_hop = slice_hop * nsamps_per_tstep
+
+  def _compact_slice_dataset(audio):
+    # Randomize starting phase (in units of feature timesteps)
+    if slice_randomize_offset:
+      start = tf.random_uniform([], maxval=slice_len, dtype=tf.int32)
+      audio = audio[start * nsamps_per_tstep:]
+
+    # Whole-file STFT zero pads the end to cover all frames. When we are not
+    # padding slices, mimic that so the number of slices is the same.
+    if audio_context_len > 0 and not slice_pad_end:
+      nsamps = tf.shape(audio)[0]
+      ntsteps = (nsamps + nsamps_per_tstep - 1) // nsamps_per_tstep
+      npad = (ntsteps - 1) * nsamps_per_tstep + extract_nfft - nsamps
+      audio = tf.pad(audio, [[0, tf.maximum(npad, 0)], [0, 0], [0, 0]])
+
+    if compact_dtype == 'int16':
+      audio = tf.clip_by_value(tf.round(audio * 32768.), -32768., 32767.)
+    audio = tf.cast(audio, tf_compact_dtype)
+
+    audio_slices = tf.contrib.signal.frame(
+        audio,
+        audio_slice_len + audio_context_len,
+        audio_slice_hop,
+        pad_end=slice_pad_end,
+        pad_value=0,
+        axis=0)
+
+    if slice_first_only:
+      audio_slices = audio_slices[:1]
+
+    return tf.data.Dataset.from_tensor_slices(audio_slices)
+
+  def _extract_feats_batch(audio_slices):
+    audio_slices = tf.cast(audio_slices, tf.float32)
+    if compact_dtype == 'int16':
+      audio_slices /= 32768.
+
+    if extract_type is None:
+      features = audio_slices
+    elif extract_type == 'melspec':
+      features = waveform_to_melspec_tf(
+          audio_slices,
+          fs=audio_fs,
+          nfft=extract_nfft,
+          nhop=extract_nhop)
+    elif extract_type == 'magspec':
+      features = tf.abs(stft_tf(
+          audio_slices,
+          nfft=extract_nfft,
+          nhop=extract_nhop))
+    features = features[:, :slice_len]
+
+    if not audio_return:
+      return features
+    return features, audio_slices[:, :audio_slice_len]
+
+  # Extract compact audio slices (with context for feature extraction)
+  dataset = dataset.flat_map(_compact_slice_dataset)
+  dataset = _record_latency(dataset, stats_aggregator, 'slice')
+
+  # Shuffle compact examples
+  if shuffle:
+    _log_shuffle_buffer_nbytes(
+        shuffle_buffer_size,
+        (audio_slice_len + audio_context_len) * tf_compact_dtype.size)
+    dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
+
+  # Make batches and extract features for the entire batch
+  dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+  dataset = _record_latency(dataset, stats_aggregator, 'batch')
+  dataset = dataset.map(
+      _extract_feats_batch,
+      num_parallel_calls=extract_parallel_calls)
+  dataset = _record_latency(dataset, stats_aggregator, 'extract')
+
+  return _prefetch_and_get_next(
+      dataset, prefetch_size, prefetch_gpu_num, stats_aggregator)
@@ -0,0 +1,62 @@
+# Dataset manifests list audio files with their duration (seconds), sample
+# rate and number of channels, one tab-separated line per file after a header
+# line. Relative paths are relative to the manifest's directory.
+
+import os
+
+from advoc.audioio import probe_audio
+
+
+FIELDS = ['path', 'duration', 'fs', 'nch']
+_FIELD_TYPES = [str, float, int, int]
+
+
+def probe_manifest_entry(fp):
+  """Creates the manifest entry for an audio file by probing its header."""
+  fs, nsamps, nch = probe_audio(fp)
+  return {
+    'path': fp,
+    'duration': nsamps / float(fs),
+    'fs': fs,
+    'nch': nch
+  }
+
+
+def write_manifest(manifest_fp, entries):
+  """Writes manifest entries (dicts with keys FIELDS), replacing any existing manifest."""
+  tmp_fp = manifest_fp + '.tmp'
+  with open(tmp_fp, 'w') as f:
+    f.write('\t'.join(FIELDS) + '\n')
+    for entry in entries:
+      if '\t' in entry['path'] or '\n' in entry['path']:
+        raise ValueError('Cannot write path {!r} to manifest'.format(entry['path']))
+      f.write('\t'.join([str(entry[k]) for k in FIELDS]) + '\n')
+  os.rename(tmp_fp, manifest_fp)
+
+
+def read_manifest(manifest_fp):
+  """Reads manifest entries.
+
+  Returns:
+    List of dicts with keys FIELDS. Paths are resolved against the manifest's
+    directory.
+  """
+  manifest_dir = os.path.dirname(os.path.abspath(manifest_fp))
+  with open(manifest_fp, 'r') as f:
+    lines = f.read().splitlines()
+  if len(lines) == 0 or lines[0].split('\t') != FIELDS:
+    raise ValueError('{} is not a manifest'.format(manifest_fp))
+
+  entries = []
+  for line in lines[1:]:
+    if len(line) == 0:
+      continue
+    entry = {k: t(v) for k, t, v in zip(FIELDS, _FIELD_TYPES, line.split('\t'))}
+    entry['path'] = os.path.join(manifest_dir, entry['path'])
+    entries.append(entry)
+  return entries
+
+
+def read_manifest_fps(manifest_fp):
+  """Reads the (resolved) audio file paths of a manifest."""
+  return [entry['path'] for entry in read_manifest(manifest_fp)]
@@ -0,0 +1,126 @@
+# Objective quality metrics between batches of magnitude spectrograms. Each
+# metric compares a reference X and an estimate Y of shape [b, t, f] and
+# returns one value per example (shape [b]), averaged over the frames selected
+# by an optional [b, t] mask (e.g. to exclude padding). NumPy and TensorFlow
+# (*_tf) versions are equivalent.
+
+import numpy as np
+
+
+EPS = 1e-8
+_DB_PER_NEPER = 10. / np.log(10.)
+
+
+def lengths_to_mask(lengths, nframes):
+  """Converts valid lengths of shape [b] to a float mask of shape [b, nframes]."""
+  return (np.arange(nframes)[np.newaxis] < np.asarray(lengths)[:, np.newaxis]).astype(np.float32)
+
+
+def nonsilent_mask(X):
+  """Mask of frames with any nonzero bin (zero-padded frames are exactly 0)."""
+  return (np.max(X, axis=2) > 0).astype(np.float32)
+
+
+def dct_matrix(n, ncoeffs=None):
+  """Orthonormal DCT-II matrix of shape [n, ncoeffs]."""
+  if ncoeffs is None:
+    ncoeffs = n
+  k = np.arange(ncoeffs)[np.newaxis]
+  i = np.arange(n)[:, np.newaxis]
+  D = np.cos(np.pi / n * (i + 0.5) * k) * np.sqrt(2. / n)
+  D[:, 0] /= np.sqrt(2.)
+  return D
+
+
+def _masked_frame_mean(frame_values, mask):
+  # Averages [b, t] values over valid frames
+  if mask is None:
+    return np.mean(frame_values, axis=1)
+  nvalid = np.sum(mask, axis=1)
+  return np.sum(frame_values * mask, axis=1) / np.maximum(nvalid, 1.)
+
+
+def spectral_convergence(X, Y, mask=None):
+  """Frobenius norm of the error relative to that of the reference."""
+  X = X.astype(np.float64)
+  Y = Y.astype(np.float64)
+  if mask is None:
+    mask = np.ones(X.shape[:2])
+  mask = mask[:, :, np.newaxis]
+  num = np.sqrt(np.sum(np.square(X - Y) * mask, axis=(1, 2)))
+  den = np.sqrt(np.sum(np.square(X) * mask, axis=(1, 2)))
+  return num / np.maximum(den, EPS)
+
+
+def log_spectral_distance(X, Y, mask=None):
+  """RMS difference (over frequency) of log power spectra in dB, averaged over frames."""
+  X = X.astype(np.float64)
+  Y = Y.astype(np.float64)
+  diff = 2. * _DB_PER_NEPER * (np.log(X + EPS) - np.log(Y + EPS))
+  return _masked_frame_mean(np.sqrt(np.mean(np.square(diff), axis=2)), mask)
+
+
+def mel_cepstral_distortion(X, Y, mel_filterbank, ncoeffs=13, mask=None):
+  """Mel-cepstral distortion in dB, excluding the energy (0th) coefficient.
+
+  Args:
+    X: Reference magnitude spectrograms of shape [b, t, f].
+    Y: Estimated magnitude spectrograms of shape [b, t, f].
+    mel_filterbank: nd-array of shape [n_mels, f] (e.g. from
+      advoc.spectral.create_mel_filterbank).
+    ncoeffs: Number of cepstral coefficients (including the 0th).
+    mask: Optional [b, t] frame mask.
+
+  Returns:
+    nd-array of shape [b].
+  """
+  W = mel_filterbank.T.astype(np.float64)
+  D = dct_matrix(W.shape[1], ncoeffs)[:, 1:]
+  C_X = np.dot(np.log(np.dot(X.astype(np.float64), W) + EPS), D)
+  C_Y = np.dot(np.log(np.dot(Y.astype(np.float64), W) + EPS), D)
+  frame_mcd = _DB_PER_NEPER * np.sqrt(2. * np.sum(np.square(C_X - C_Y), axis=2))
+  return _masked_frame_mean(frame_mcd, mask)
+
+
+def nonsilent_mask_tf(X):
+  import tensorflow as tf
+
+  return tf.cast(tf.reduce_max(X, axis=2) > 0, tf.float32)
+
+
+def _masked_frame_mean_tf(frame_values, mask):
+  import tensorflow as tf
+
+  if mask is None:
+    return tf.reduce_mean(frame_values, axis=1)
+  nvalid = tf.reduce_sum(mask, axis=1)
+  return tf.reduce_sum(frame_values * mask, axis=1) / tf.maximum(nvalid, 1.)
+
+
+def spectral_convergence_tf(X, Y, mask=None):
+  import tensorflow as tf
+
+  if mask is None:
+    mask = tf.ones_like(X[:, :, 0])
+  mask = mask[:, :, tf.newaxis]
+  num = tf.sqrt(tf.reduce_sum(tf.square(X - Y) * mask, axis=[1, 2]))
+  den = tf.sqrt(tf.reduce_sum(tf.square(X) * mask, axis=[1, 2]))
+  return num / tf.maximum(den, EPS)
+
+
+def log_spectral_distance_tf(X, Y, mask=None):
+  import tensorflow as tf
+
+  diff = 2. * _DB_PER_NEPER * (tf.log(X + EPS) - tf.log(Y + EPS))
+  return _masked_frame_mean_tf(tf.sqrt(tf.reduce_mean(tf.square(diff), axis=2)), mask)
+
+
+def mel_cepstral_distortion_tf(X, Y, mel_filterbank, ncoeffs=13, mask=None):
+  import tensorflow as tf
+
+  W = tf.constant(mel_filterbank.T, dtype=X.dtype)
+  D = tf.constant(dct_matrix(mel_filterbank.shape[0], ncoeffs)[:, 1:], dtype=X.dtype)
+  C_X = tf.tensordot(tf.log(tf.tensordot(X, W, axes=1) + EPS), D, axes=1)
+  C_Y = tf.tensordot(tf.log(tf.tensordot(Y, W, axes=1) + EPS), D, axes=1)
+  frame_mcd = _DB_PER_NEPER * tf.sqrt(2. * tf.reduce_sum(tf.square(C_X - C_Y), axis=2))
+  return _masked_frame_mean_tf(frame_mcd, mask)
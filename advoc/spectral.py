@@ -326,6 +326,28 @@ def magspec_to_waveform_lws(X_mag, nfft, nhop):
   return x_lws
 
 
+def tacotron_mel_to_mag(
+    X_mel_dbnorm,
+    invmeltrans,
+    norm_min_level_db=-100,
+    norm_ref_level_db=20):
+  """Approximately inverts normalized mel spectrogram to magnitude spectrogram.
+
+  Args:
+    X_mel_dbnorm: nd-array of shape [?, mel_num_bins] in [0, 1].
+    invmeltrans: Inverse mel filterbank of shape [nfft // 2 + 1, mel_num_bins]
+      (e.g. from create_inverse_mel_filterbank).
+    norm_min_level_db: Minimum dB level.
+    norm_ref_level_db: Maximum dB level.
+
+  Returns:
+    nd-array of shape [?, nfft // 2 + 1].
+  """
+  X_mel_db = (X_mel_dbnorm * -norm_min_level_db) + norm_min_level_db
+  X_mel = np.power(10, (X_mel_db + norm_ref_level_db) / 20)
+  return np.dot(X_mel, invmeltrans.T)
+
+
 # NOTE: nfft and hop are configured for fs=20480
 def melspec_to_waveform(
     X_mel_dbnorm,
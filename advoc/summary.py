@@ -0,0 +1,204 @@
+import io
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import tensorflow as tf
+
+from advoc.audioio import save_as_wav
+
+
+def image_to_uint8(x):
+  """Scales a float image to uint8 the same way as tf.summary.image.
+
+  Args:
+    x: nd-array of shape [height, width].
+
+  Returns:
+    nd-array dtype uint8 of shape [height, width].
+  """
+  x = x.astype(np.float64)
+  if np.all(x >= 0):
+    peak = np.max(x)
+    scale = 255. / peak if peak > 0 else 0.
+    offset = 0.
+  else:
+    peak = np.max(np.abs(x))
+    scale = 127. / peak if peak > 0 else 0.
+    offset = 128.
+  return np.clip(np.round(x * scale + offset), 0, 255).astype(np.uint8)
+
+
+def encode_png(x):
+  """Encodes a grayscale uint8 image of shape [height, width] as PNG."""
+  height, width = x.shape
+
+  def chunk(tag, data):
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+  # Each row is prefixed by filter type 0 (none)
+  raw = b''.join([b'\x00' + row.tobytes() for row in np.ascontiguousarray(x)])
+  return b''.join([
+    b'\x89PNG\r\n\x1a\n',
+    chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)),
+    chunk(b'IDAT', zlib.compress(raw)),
+    chunk(b'IEND', b'')])
+
+
+def encode_wav(x, fs):
+  """Encodes a waveform of shape [nsamps, 1, 1] as 16-bit PCM WAV."""
+  f = io.BytesIO()
+  save_as_wav(f, fs, np.clip(x.astype(np.float32), -1., 1.))
+  return f.getvalue()
+
+
+def _tag(name, kind, i, n):
+  # Matches the tags of tf.summary.audio and tf.summary.image
+  if n == 1:
+    return '{}/{}'.format(name, kind)
+  return '{}/{}/{}'.format(name, kind, i)
+
+
+def _serialize_summary(audio, images, audio_fs):
+  # Runs in a worker process
+  values = []
+  for name, batch, invert_fn in audio:
+    for i, example in enumerate(batch):
+      wave = example if invert_fn is None else invert_fn(example)
+      values.append(tf.Summary.Value(
+        tag=_tag(name, 'audio', i, len(batch)),
+        audio=tf.Summary.Audio(
+          sample_rate=float(audio_fs),
+          num_channels=1,
+          length_frames=wave.shape[0],
+          encoded_audio_string=encode_wav(wave, audio_fs),
+          content_type='audio/wav')))
+  for name, batch in images:
+    for i, example in enumerate(batch):
+      img = image_to_uint8(np.rot90(example[:, :, 0]))
+      values.append(tf.Summary.Value(
+        tag=_tag(name, 'image', i, len(batch)),
+        image=tf.Summary.Image(
+          height=img.shape[0],
+          width=img.shape[1],
+          colorspace=1,
+          encoded_image_string=encode_png(img))))
+  return tf.Summary(value=values).SerializeToString()
+
+
+class AsyncSummaryHook(tf.train.SessionRunHook):
+  """Writes audio and image summaries from a background process.
+
+  Every every_n_secs, the hook fetches the first examples of the requested
+  tensors alongside a training step, which computes them anyway. A worker
+  process then inverts spectrograms to audio, encodes audio and images and
+  hands the serialized summary back to be written. A snapshot is skipped
+  while the previous one is still being processed, so slow phase estimation
+  never stalls training.
+  """
+
+  def __init__(
+      self,
+      output_dir,
+      audio=None,
+      images=None,
+      audio_fs=22050,
+      every_n_secs=300,
+      max_outputs=3,
+      start_method='spawn'):
+    """Creates a hook.
+
+    Args:
+      output_dir: Summary directory. The writer is shared with other
+        summaries written to this directory.
+      audio: List of (name, tensor, invert_fn). Each example of tensor is
+        mapped to a waveform of shape [nsamps, 1, 1] by invert_fn, a picklable
+        function (e.g. a functools.partial of
+        advoc.spectral.magspec_to_waveform_lws). If invert_fn is None, tensor
+        is a batch of waveforms.
+      images: List of (name, tensor) with tensor of shape
+        [batch, height, width, 1]. Images are rotated by 90 degrees so that
+        spectrogram time runs along the horizontal axis.
+      audio_fs: Audio sample rate.
+      every_n_secs: Minimum time between summaries.
+      max_outputs: Maximum number of examples to summarize per tensor.
+      start_method: Multiprocessing start method for the worker.
+    """
+    self.output_dir = output_dir
+    self.audio = [] if audio is None else audio
+    self.images = [] if images is None else images
+    self.audio_fs = audio_fs
+    self.every_n_secs = every_n_secs
+    self.max_outputs = max_outputs
+    self.start_method = start_method
+
+    self.nwritten = 0
+    self.nskipped = 0
+
+  def begin(self):
+    self._step = tf.train.get_or_create_global_step()
+    with tf.name_scope('async_summary'):
+      self._audio_fetches = [t[:self.max_outputs] for _, t, _ in self.audio]
+      self._image_fetches = [t[:self.max_outputs] for _, t in self.images]
+    self._last_time = None
+    self._pending = False
+    self._lock = threading.Lock()
+    self._errors = []
+    self._writer = tf.summary.FileWriterCache.get(self.output_dir)
+    self._pool = multiprocessing.get_context(self.start_method).Pool(1)
+
+  def before_run(self, run_context):
+    if len(self._errors) > 0:
+      raise self._errors[0]
+
+    self._requested = False
+    if self._last_time is not None and time.time() - self._last_time < self.every_n_secs:
+      return None
+    with self._lock:
+      if self._pending:
+        self.nskipped += 1
+        return None
+
+    self._requested = True
+    return tf.train.SessionRunArgs(
+        [self._step, self._audio_fetches, self._image_fetches])
+
+  def after_run(self, run_context, run_values):
+    if not self._requested:
+      return
+
+    _step, _audio, _images = run_values.results
+    audio = [(name, _x, invert_fn) for (name, _, invert_fn), _x in zip(self.audio, _audio)]
+    images = [(name, _x) for (name, _), _x in zip(self.images, _images)]
+
+    def write(summary):
+      self._writer.add_summary(summary, _step)
+      with self._lock:
+        self._pending = False
+        self.nwritten += 1
+
+    def error(e):
+      self._errors.append(e)
+      with self._lock:
+        self._pending = False
+
+    self._last_time = time.time()
+    with self._lock:
+      self._pending = True
+    self._pool.apply_async(
+        _serialize_summary,
+        (audio, images, self.audio_fs),
+        callback=write,
+        error_callback=error)
+
+  def end(self, session):
+    # Wait for the last snapshot
+    self._pool.close()
+    self._pool.join()
+    self._writer.flush()
+    if len(self._errors) > 0:
+      raise self._errors[0]
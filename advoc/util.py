@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import numpy as np
 import tensorflow as tf
 
@@ -34,6 +36,72 @@ def best_shape(t, axis=None):
     return dim
 
 
+def float32_master_weights_getter(getter, name, shape=None, dtype=None, *args, **kwargs):
+  """Custom getter storing float16 trainable variables as float32 master weights.
+
+  Layers which request float16 variables receive a float16 cast of a float32
+  variable (of the same name), so optimizers update float32 weights.
+  """
+  trainable = kwargs.get('trainable', True)
+  if dtype is not None and tf.as_dtype(dtype) == tf.float16 and trainable:
+    var = getter(name, shape, tf.float32, *args, **kwargs)
+    return tf.cast(var, tf.float16)
+  return getter(name, shape, dtype, *args, **kwargs)
+
+
+@contextmanager
+def compute_scope(name, precision='float32', xla=False, reuse=None):
+  """Variable scope for a subnetwork with optional float16 compute and XLA.
+
+  Args:
+    name: Variable scope name.
+    precision: 'float32' or 'float16' (with float32 master weights). Inputs
+      must be cast to this precision by the caller.
+    xla: If true, compile ops (and their gradients) in the scope with XLA.
+    reuse: Variable scope reuse.
+
+  Yields:
+    The variable scope.
+  """
+  if precision == 'float32':
+    custom_getter = None
+  elif precision == 'float16':
+    custom_getter = float32_master_weights_getter
+  else:
+    raise ValueError('Unknown precision {}'.format(precision))
+
+  with tf.variable_scope(name, reuse=reuse, custom_getter=custom_getter) as vs:
+    if xla:
+      from tensorflow.contrib.compiler import jit
+      with jit.experimental_jit_scope():
+        yield vs
+    else:
+      yield vs
+
+
+def loss_scale_optimizer(opt, loss_scale):
+  """Wraps an optimizer with loss scaling for float16 gradients.
+
+  Args:
+    opt: tf.train.Optimizer.
+    loss_scale: None (no scaling), 'dynamic' or a fixed scale.
+
+  Returns:
+    A tuple (opt, loss_scale) where loss_scale is a scalar tensor (None if
+    unscaled) suitable for summaries.
+  """
+  if loss_scale is None:
+    return opt, None
+
+  from tensorflow.contrib import mixed_precision
+  if loss_scale == 'dynamic':
+    manager = mixed_precision.ExponentialUpdateLossScaleManager(
+        init_loss_scale=2 ** 15, incr_every_n_steps=2000)
+  else:
+    manager = mixed_precision.FixedLossScaleManager(float(loss_scale))
+  return mixed_precision.LossScaleOptimizer(opt, manager), manager.get_loss_scale()
+
+
 def r9y9_melspec_norm(x):
   return (x * 2.) - 1.
 
@@ -0,0 +1,880 @@
+from collections import deque
+from concurrent.futures import Future
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+INPUT_TENSOR_NAME = 'x_magspec:0'
+MEL_INPUT_TENSOR_NAME = 'x_melspec:0'
+OUTPUT_TENSOR_NAME = 'gen_magspec:0'
+LEGACY_INPUT_TENSOR_NAME = 'ExpandDims_1:0'
+LEGACY_OUTPUT_TENSOR_NAME = 'generator/decoder_1/strided_slice_1:0'
+
+_SENTINEL = object()
+
+
+def is_frozen_graph(fp):
+  return fp is not None and fp.endswith('.pb')
+
+
+def _read_graph_def(fp):
+  import tensorflow as tf
+
+  if is_frozen_graph(fp):
+    graph_def = tf.GraphDef()
+    with open(fp, 'rb') as f:
+      graph_def.ParseFromString(f.read())
+    return graph_def, None
+
+  meta_graph_def = tf.MetaGraphDef()
+  with open(fp, 'rb') as f:
+    meta_graph_def.ParseFromString(f.read())
+  return meta_graph_def.graph_def, meta_graph_def
+
+
+def _has_tensor(graph_def, tensor_name):
+  node_names = set([n.name for n in graph_def.node])
+  return tensor_name.split(':')[0] in node_names
+
+
+def generator_accepts_melspec(fp):
+  """True if an exported generator converts normalized mel spectrograms in-graph."""
+  return _has_tensor(_read_graph_def(fp)[0], MEL_INPUT_TENSOR_NAME)
+
+
+def load_frozen_generator(pb_fp, melspec=False):
+  """Loads a frozen generator written by "train_evaluate.py export".
+
+  Args:
+    pb_fp: Frozen GraphDef filepath.
+    melspec: If true, feed normalized mel spectrograms instead.
+
+  Returns:
+    Function mapping [b, ntsteps, 513, 1] (or [b, ntsteps, n_mels, 1] if
+    melspec) nd-arrays to generated magnitude spectrograms.
+  """
+  import tensorflow as tf
+
+  graph_def, _ = _read_graph_def(pb_fp)
+  if melspec and not _has_tensor(graph_def, MEL_INPUT_TENSOR_NAME):
+    raise ValueError('Generator does not accept mel spectrograms')
+
+  gen_graph = tf.Graph()
+  with gen_graph.as_default():
+    tf.import_graph_def(graph_def, name='')
+  x = gen_graph.get_tensor_by_name(
+      MEL_INPUT_TENSOR_NAME if melspec else INPUT_TENSOR_NAME)
+  y = gen_graph.get_tensor_by_name(OUTPUT_TENSOR_NAME)
+
+  gen_sess = tf.Session(graph=gen_graph)
+
+  return lambda _X: gen_sess.run(y, {x: _X})
+
+
+def load_generator(meta_fp, ckpt_fp, chunk_len=256, melspec=False):
+  """Restores an adversarial vocoder generator as a numpy function.
+
+  Supports frozen graphs and meta graphs exported with "train_evaluate.py
+  export" (any number of timesteps) as well as legacy training/eval graphs
+  (chunk_len timesteps), whose fixed-size input is replaced with a placeholder
+  of dynamic batch size.
+
+  Args:
+    meta_fp: Meta graph or frozen graph (.pb) filepath.
+    ckpt_fp: Checkpoint filepath (ignored for frozen graphs).
+    chunk_len: Number of timesteps per chunk for legacy graphs.
+    melspec: If true, feed normalized mel spectrograms which are converted to
+      magnitude spectrograms in-graph (see generator_accepts_melspec).
+
+  Returns:
+    A tuple (gen_fn, exported) where gen_fn maps [b, ntsteps, 513, 1] (or
+    [b, ntsteps, n_mels, 1] if melspec) nd-arrays to generated magnitude
+    spectrograms and exported is true for exported (variable length)
+    generators.
+  """
+  if is_frozen_graph(meta_fp):
+    return load_frozen_generator(meta_fp, melspec=melspec), True
+
+  # Deferred so the chunking engine is usable without TensorFlow
+  import tensorflow as tf
+
+  _, meta_graph_def = _read_graph_def(meta_fp)
+  exported = _has_tensor(meta_graph_def.graph_def, OUTPUT_TENSOR_NAME)
+  if melspec and not _has_tensor(meta_graph_def.graph_def, MEL_INPUT_TENSOR_NAME):
+    raise ValueError('Generator does not accept mel spectrograms')
+
+  gen_graph = tf.Graph()
+  with gen_graph.as_default():
+    if exported:
+      saver = tf.train.import_meta_graph(meta_graph_def)
+      x = gen_graph.get_tensor_by_name(
+          MEL_INPUT_TENSOR_NAME if melspec else INPUT_TENSOR_NAME)
+      y = gen_graph.get_tensor_by_name(OUTPUT_TENSOR_NAME)
+    else:
+      # Replace the (static batch size) input from the training graph so that
+      # chunks from many files can be batched together.
+      x = tf.placeholder(tf.float32, [None, chunk_len, 513, 1], name='x_mag_batched')
+      saver = tf.train.import_meta_graph(
+          meta_graph_def, input_map={LEGACY_INPUT_TENSOR_NAME: x})
+      y = gen_graph.get_tensor_by_name(LEGACY_OUTPUT_TENSOR_NAME)
+
+  gen_sess = tf.Session(graph=gen_graph)
+  saver.restore(gen_sess, ckpt_fp)
+
+  return (lambda _X: gen_sess.run(y, {x: _X})), exported
+
+
+def _num_chunks(ntsteps, chunk_len, overlap):
+  if overlap < 0 or overlap >= chunk_len:
+    raise ValueError('Overlap must be in [0, chunk_len)')
+  chunk_hop = chunk_len - overlap
+  return max(1, int(np.ceil(float(ntsteps - overlap) / chunk_hop)))
+
+
+def crossfade_window(chunk_len, overlap):
+  """Window which crossfades overlapping chunks.
+
+  Raised cosine ramps of length overlap at both ends are complementary, so
+  overlapping windows sum to one. Ramps never reach zero so the window can be
+  used for weighted overlap-add with normalization.
+
+  Args:
+    chunk_len: Number of timesteps per chunk.
+    overlap: Number of timesteps shared by adjacent chunks.
+
+  Returns:
+    nd-array dtype float64 of shape [chunk_len].
+  """
+  window = np.ones(chunk_len, dtype=np.float64)
+  if overlap > 0:
+    ramp = 0.5 - 0.5 * np.cos(np.pi * (np.arange(overlap) + 0.5) / overlap)
+    window[:overlap] = ramp
+    window[-overlap:] = ramp[::-1]
+  return window
+
+
+def chunk_spectrogram(X, chunk_len, overlap=0):
+  """Splits a spectrogram into fixed-length (overlapping) chunks.
+
+  Only pads as much as needed for the final chunk to be complete (i.e. no
+  padding if the chunks exactly cover the spectrogram).
+
+  Args:
+    X: nd-array of shape [ntsteps, nfeats, nch].
+    chunk_len: Number of timesteps per chunk.
+    overlap: Number of timesteps shared by adjacent chunks.
+
+  Returns:
+    nd-array of shape [nchunks, chunk_len, nfeats, nch] (zero padded at end).
+  """
+  ntsteps, nfeats, nch = X.shape
+  nchunks = _num_chunks(ntsteps, chunk_len, overlap)
+  chunk_hop = chunk_len - overlap
+  target_len = (nchunks - 1) * chunk_hop + chunk_len
+  X = np.pad(X, [[0, target_len - ntsteps], [0, 0], [0, 0]], 'constant')
+  if overlap == 0:
+    return np.reshape(X, [nchunks, chunk_len, nfeats, nch])
+  return np.stack(
+      [X[i * chunk_hop:i * chunk_hop + chunk_len] for i in range(nchunks)],
+      axis=0)
+
+
+def unchunk_spectrogram(chunks, ntsteps, overlap=0):
+  """Stitches chunks back together with windowed overlap-add.
+
+  Args:
+    chunks: nd-array of shape [nchunks, chunk_len, nfeats, nch].
+    ntsteps: Original number of timesteps.
+    overlap: Number of timesteps shared by adjacent chunks.
+
+  Returns:
+    nd-array of shape [ntsteps, nfeats, nch].
+  """
+  nchunks, chunk_len, nfeats, nch = chunks.shape
+  if overlap == 0:
+    X = np.reshape(chunks, [nchunks * chunk_len, nfeats, nch])
+    return X[:ntsteps]
+
+  chunk_hop = chunk_len - overlap
+  target_len = (nchunks - 1) * chunk_hop + chunk_len
+  window = crossfade_window(chunk_len, overlap)
+  X = np.zeros([target_len, nfeats, nch], dtype=np.float64)
+  norm = np.zeros([target_len], dtype=np.float64)
+  for i, chunk in enumerate(chunks):
+    X[i * chunk_hop:i * chunk_hop + chunk_len] += window[:, np.newaxis, np.newaxis] * chunk
+    norm[i * chunk_hop:i * chunk_hop + chunk_len] += window
+  X /= norm[:, np.newaxis, np.newaxis]
+  return X[:ntsteps].astype(chunks.dtype)
+
+
+class BatchedGenerator(object):
+  """Runs a spectrogram generator on chunks pooled across many utterances.
+
+  Utterances are split into (overlapping) chunks which are pooled into
+  fixed-size batches (the final batch is zero padded). The generator is called
+  once per batch and its outputs are scattered back to their utterances and
+  stitched together with crossfades.
+  """
+
+  def __init__(self, gen_fn, chunk_len, batch_size=16, overlap=0):
+    """Creates a batched generator.
+
+    Args:
+      gen_fn: Function mapping [batch_size, chunk_len, nfeats, nch] nd-arrays
+        to [batch_size, chunk_len, nfeats_out, nch] nd-arrays.
+      chunk_len: Number of timesteps per chunk. If None, each utterance is
+        generated whole in its own call (requires a generator which accepts
+        any number of timesteps and batch_size of 1).
+      batch_size: Number of chunks per generator call.
+      overlap: Number of timesteps shared by adjacent chunks (crossfaded).
+    """
+    if batch_size < 1:
+      raise ValueError('Batch size must be positive')
+    if chunk_len is None:
+      if batch_size != 1 or overlap != 0:
+        raise ValueError('Whole utterances must be generated one at a time')
+    elif overlap < 0 or overlap >= chunk_len:
+      raise ValueError('Overlap must be in [0, chunk_len)')
+    self.gen_fn = gen_fn
+    self.chunk_len = chunk_len
+    self.batch_size = batch_size
+    self.overlap = overlap
+    self.ncalls = 0
+    self.nchunks = 0
+
+  def __call__(self, Xs):
+    """Generates spectrograms for a list of [ntsteps, nfeats, nch] nd-arrays."""
+    return [X_gen for _, X_gen in self.iter(enumerate(Xs))]
+
+  def iter(self, items):
+    """Generates spectrograms for a stream of utterances.
+
+    Args:
+      items: Iterable of (key, X) pairs with X of shape [ntsteps, nfeats, nch].
+
+    Yields:
+      (key, X_gen) pairs in input order as soon as all chunks are generated.
+    """
+    pending = deque()
+    chunk_buffer = []
+
+    for key, X in items:
+      if self.chunk_len is None:
+        chunks = X[np.newaxis]
+      else:
+        chunks = chunk_spectrogram(X, self.chunk_len, self.overlap)
+      utterance = [key, X.shape[0], len(chunks), []]
+      pending.append(utterance)
+      chunk_buffer.extend([(utterance, chunk) for chunk in chunks])
+
+      while len(chunk_buffer) >= self.batch_size:
+        self._run(chunk_buffer[:self.batch_size])
+        chunk_buffer = chunk_buffer[self.batch_size:]
+        for result in self._pop_complete(pending):
+          yield result
+
+    if len(chunk_buffer) > 0:
+      self._run(chunk_buffer)
+    for result in self._pop_complete(pending):
+      yield result
+
+  def _run(self, batch):
+    nvalid = len(batch)
+    chunks = np.stack([chunk for _, chunk in batch], axis=0)
+    if nvalid < self.batch_size:
+      chunks = np.pad(
+          chunks,
+          [[0, self.batch_size - nvalid], [0, 0], [0, 0], [0, 0]],
+          'constant')
+
+    gen_chunks = self.gen_fn(chunks)
+    self.ncalls += 1
+    self.nchunks += nvalid
+
+    for (utterance, _), gen_chunk in zip(batch, gen_chunks[:nvalid]):
+      utterance[3].append(gen_chunk)
+
+  def _pop_complete(self, pending):
+    while len(pending) > 0 and len(pending[0][3]) == pending[0][2]:
+      key, ntsteps, _, gen_chunks = pending.popleft()
+      yield key, unchunk_spectrogram(
+          np.stack(gen_chunks, axis=0), ntsteps, self.overlap)
+
+
+def _timed_call(fn, X):
+  start = time.time()
+  result = fn(X)
+  return result, time.time() - start
+
+
+class _Stage(object):
+
+  def __init__(self, name, nworkers=1):
+    self.name = name
+    self.nworkers = nworkers
+    self.busy = 0.
+    self.count = 0
+
+
+class VocodingPipeline(object):
+  """Overlaps spectrogram loading, generation, phase reconstruction and writing.
+
+  Stages are connected by bounded queues so that throughput scales to the
+  slowest stage without buffering unbounded amounts of audio:
+
+    loader thread -> generator (calling thread, batched) -> inversion worker
+    processes -> writer thread
+
+  The generator stage runs in the calling thread so that it owns the
+  TensorFlow session. Phase reconstruction (e.g. LWS) runs in a process pool
+  as it is CPU bound and holds the GIL.
+  """
+
+  def __init__(
+      self,
+      gen,
+      invert_fn,
+      write_fn,
+      num_workers=4,
+      queue_size=8,
+      start_method='spawn'):
+    """Creates a pipeline.
+
+    Args:
+      gen: BatchedGenerator.
+      invert_fn: Picklable function mapping a generated spectrogram to a
+        waveform (e.g. a functools.partial of advoc.spectral.magspec_to_waveform_lws).
+      write_fn: Function called with (key, waveform) in input order.
+      num_workers: Number of inversion processes. If 0, inverts in the writer
+        thread.
+      queue_size: Capacity of the queues between stages.
+      start_method: Multiprocessing start method for inversion processes
+        ("spawn" avoids forking a process which holds a TensorFlow session).
+    """
+    if num_workers < 0:
+      raise ValueError('Number of workers must be nonnegative')
+    if queue_size < 1:
+      raise ValueError('Queue size must be positive')
+    self.gen = gen
+    self.invert_fn = invert_fn
+    self.write_fn = write_fn
+    self.num_workers = num_workers
+    self.queue_size = queue_size
+    self.start_method = start_method
+
+    self.elapsed = 0.
+    self.stages = [
+        _Stage('load'),
+        _Stage('generate'),
+        _Stage('invert', max(1, num_workers)),
+        _Stage('write')]
+    self._load, self._generate, self._invert, self._write = self.stages
+
+  def run(self, items):
+    """Vocodes a stream of utterances.
+
+    Args:
+      items: Iterable of (key, X) pairs with X of shape [ntsteps, nfeats, nch].
+        Iterated on the loader thread (so may lazily load from disk).
+
+    Returns:
+      Number of utterances written.
+    """
+    load_queue = queue.Queue(self.queue_size)
+    write_queue = queue.Queue(self.queue_size)
+    errors = []
+
+    def loader():
+      try:
+        items_iter = iter(items)
+        while True:
+          start = time.time()
+          try:
+            item = next(items_iter)
+          except StopIteration:
+            break
+          self._load.busy += time.time() - start
+          self._load.count += 1
+          load_queue.put(item)
+      except Exception as e:
+        errors.append(e)
+      finally:
+        load_queue.put(_SENTINEL)
+
+    def writer():
+      while True:
+        item = write_queue.get()
+        if item is _SENTINEL:
+          break
+        if len(errors) > 0:
+          # Keep draining so that upstream stages never block
+          continue
+        key, result = item
+        try:
+          if self.num_workers == 0:
+            wave, elapsed = _timed_call(self.invert_fn, result)
+          else:
+            wave, elapsed = result.get()
+          self._invert.busy += elapsed
+          self._invert.count += 1
+
+          start = time.time()
+          self.write_fn(key, wave)
+          self._write.busy += time.time() - start
+          self._write.count += 1
+        except Exception as e:
+          errors.append(e)
+
+    waits = [0.]
+    def loaded():
+      while True:
+        start = time.time()
+        item = load_queue.get()
+        waits[0] += time.time() - start
+        if item is _SENTINEL:
+          break
+        yield item
+
+    pool = None
+    if self.num_workers > 0:
+      pool = multiprocessing.get_context(self.start_method).Pool(self.num_workers)
+    loader_thread = threading.Thread(target=loader)
+    writer_thread = threading.Thread(target=writer)
+    loader_thread.daemon = True
+    writer_thread.daemon = True
+
+    start = time.time()
+    loader_thread.start()
+    writer_thread.start()
+    try:
+      for key, X_gen in self.gen.iter(loaded()):
+        self._generate.count += 1
+        if len(errors) > 0:
+          break
+        if pool is None:
+          result = X_gen
+        else:
+          result = pool.apply_async(_timed_call, (self.invert_fn, X_gen))
+        put_start = time.time()
+        write_queue.put((key, result))
+        waits[0] += time.time() - put_start
+    finally:
+      self._generate.busy += time.time() - start - waits[0]
+
+      # Unblock the loader if generation stopped early
+      while loader_thread.is_alive():
+        try:
+          load_queue.get(timeout=0.1)
+        except queue.Empty:
+          pass
+      write_queue.put(_SENTINEL)
+      writer_thread.join()
+      if pool is not None:
+        pool.close()
+        pool.join()
+      self.elapsed += time.time() - start
+
+    if len(errors) > 0:
+      raise errors[0]
+
+    return self._write.count
+
+  def utilization(self):
+    """Fraction of wall time each stage (per worker) spent working."""
+    if self.elapsed <= 0:
+      return dict([(s.name, 0.) for s in self.stages])
+    return dict([
+      (s.name, s.busy / (self.elapsed * s.nworkers)) for s in self.stages])
+
+  def summary(self):
+    utilization = self.utilization()
+    return 'Pipeline: {} utterances in {:.1f}s ({:.2f}/s), utilization {}'.format(
+        self._write.count,
+        self.elapsed,
+        self._write.count / max(self.elapsed, 1e-8),
+        ', '.join(['{} {:.2f}'.format(s.name, utilization[s.name]) for s in self.stages]))
+
+
+class DynamicBatcher(object):
+  """Batches spectrograms submitted concurrently from many threads.
+
+  A worker thread waits for the first pending request, then keeps collecting
+  requests until their chunks fill a batch or max_latency seconds have passed.
+  The collected requests are generated together with a BatchedGenerator and
+  each caller is handed back its own spectrogram.
+  """
+
+  def __init__(
+      self,
+      gen_fn,
+      chunk_len,
+      batch_size=16,
+      overlap=0,
+      max_latency=0.01,
+      latency_history=1000):
+    """Creates a batcher and starts its worker thread.
+
+    Args:
+      gen_fn: Function mapping [batch_size, chunk_len, nfeats, nch] nd-arrays
+        to [batch_size, chunk_len, nfeats_out, nch] nd-arrays.
+      chunk_len: Number of timesteps per chunk.
+      batch_size: Number of chunks per generator call.
+      overlap: Number of timesteps shared by adjacent chunks (crossfaded).
+      max_latency: Maximum time in seconds to wait for a batch to fill.
+      latency_history: Number of recent requests used for latency percentiles.
+    """
+    if chunk_len is None:
+      raise ValueError('Dynamic batching requires fixed-length chunks')
+    if max_latency < 0:
+      raise ValueError('Maximum latency must be nonnegative')
+    self.gen = BatchedGenerator(
+        gen_fn, chunk_len, batch_size=batch_size, overlap=overlap)
+    self.max_latency = max_latency
+    self.nrequests = 0
+    self.nbatches = 0
+    self._latencies = deque(maxlen=latency_history)
+    self._stats_lock = threading.Lock()
+    self._queue = queue.Queue()
+    self._worker = threading.Thread(target=self._work)
+    self._worker.daemon = True
+    self._worker.start()
+
+  def warmup(self, nfeats, nch=1):
+    """Runs the generator once so that the first request is not slow."""
+    self.gen.gen_fn(np.zeros(
+        [self.gen.batch_size, self.gen.chunk_len, nfeats, nch], dtype=np.float32))
+
+  def submit(self, X):
+    """Queues a [ntsteps, nfeats, nch] spectrogram and returns a Future."""
+    future = Future()
+    self._queue.put((X, future, time.time()))
+    return future
+
+  def __call__(self, X):
+    """Generates a [ntsteps, nfeats, nch] spectrogram (blocks until done)."""
+    return self.submit(X).result()
+
+  def close(self):
+    self._queue.put(_SENTINEL)
+    self._worker.join()
+
+  @property
+  def queue_depth(self):
+    return self._queue.qsize()
+
+  def latency_percentiles(self, percentiles=(50, 90, 99)):
+    """Latency in seconds from submission to result for recent requests."""
+    with self._stats_lock:
+      latencies = list(self._latencies)
+    if len(latencies) == 0:
+      return [0.] * len(percentiles)
+    return [float(p) for p in np.percentile(latencies, percentiles)]
+
+  def stats(self):
+    p50, p90, p99 = self.latency_percentiles([50, 90, 99])
+    return {
+        'queue_depth': self.queue_depth,
+        'requests': self.nrequests,
+        'batches': self.nbatches,
+        'generator_calls': self.gen.ncalls,
+        'chunks': self.gen.nchunks,
+        'latency_p50': p50,
+        'latency_p90': p90,
+        'latency_p99': p99,
+    }
+
+  def _collect(self):
+    request = self._queue.get()
+    if request is _SENTINEL:
+      return None, True
+    requests = [request]
+    nchunks = _num_chunks(request[0].shape[0], self.gen.chunk_len, self.gen.overlap)
+    deadline = time.time() + self.max_latency
+    while nchunks < self.gen.batch_size:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        request = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        break
+      if request is _SENTINEL:
+        return requests, True
+      requests.append(request)
+      nchunks += _num_chunks(request[0].shape[0], self.gen.chunk_len, self.gen.overlap)
+    return requests, False
+
+  def _work(self):
+    done = False
+    while not done:
+      requests, done = self._collect()
+      if requests is None:
+        break
+      try:
+        results = self.gen.iter([((future, submitted), X) for X, future, submitted in requests])
+        for (future, submitted), X_gen in results:
+          future.set_result(X_gen)
+          with self._stats_lock:
+            self._latencies.append(time.time() - submitted)
+            self.nrequests += 1
+      except Exception as e:
+        for _, future, _ in requests:
+          if not future.done():
+            future.set_exception(e)
+      self.nbatches += 1
+
+
+class StreamingGenerator(object):
+  """Runs a spectrogram generator on a stream of frames with bounded lookahead.
+
+  Each generated frame sees at most context past frames and lookahead future
+  frames, so it is final as soon as lookahead more frames have arrived. The
+  generator is called on windows of chunk_len frames (zero padded at the end)
+  covering the newly final frames and their context.
+  """
+
+  def __init__(self, gen_fn, chunk_len, lookahead=16, context=32):
+    """Creates a streaming generator.
+
+    Args:
+      gen_fn: Function mapping [1, chunk_len, nfeats, nch] nd-arrays to
+        [1, chunk_len, nfeats_out, nch] nd-arrays.
+      chunk_len: Number of timesteps per generator call.
+      lookahead: Number of future frames each generated frame depends on.
+      context: Number of past frames each generated frame depends on.
+    """
+    if lookahead < 0 or context < 0:
+      raise ValueError('Lookahead and context must be nonnegative')
+    if chunk_len - context - lookahead < 1:
+      raise ValueError('Chunk length must exceed context plus lookahead')
+    self.gen_fn = gen_fn
+    self.chunk_len = chunk_len
+    self.lookahead = lookahead
+    self.context = context
+    self.block_len = chunk_len - context - lookahead
+    self.ncalls = 0
+    self.reset()
+
+  def reset(self):
+    self._buf = None
+    self._buf_start = 0
+    self._nreceived = 0
+    self._nemitted = 0
+
+  def push(self, X):
+    """Appends [n, nfeats, nch] frames and returns newly final generated frames."""
+    if self._buf is None:
+      self._buf = X
+    else:
+      self._buf = np.concatenate([self._buf, X], axis=0)
+    self._nreceived += X.shape[0]
+    return self._generate(self._nreceived - self.lookahead)
+
+  def flush(self):
+    """Generates all remaining frames (future frames are zeros) and resets."""
+    X_gen = self._generate(self._nreceived)
+    self.reset()
+    return X_gen
+
+  def _generate(self, end):
+    blocks = []
+    while self._nemitted < end:
+      a = self._nemitted
+      b = min(end, a + self.block_len)
+      w0 = max(0, a - self.context)
+      w1 = min(self._nreceived, b + self.lookahead)
+      window = self._buf[w0 - self._buf_start:w1 - self._buf_start]
+      window = np.pad(
+          window,
+          [[0, self.chunk_len - window.shape[0]], [0, 0], [0, 0]],
+          'constant')
+      gen_window = self.gen_fn(window[np.newaxis])[0]
+      self.ncalls += 1
+      blocks.append(gen_window[a - w0:b - w0])
+      self._nemitted = b
+
+    # Drop frames which can no longer be context
+    ndrop = max(0, self._nemitted - self.context - self._buf_start)
+    if self._buf is not None and ndrop > 0:
+      self._buf = self._buf[ndrop:]
+      self._buf_start += ndrop
+
+    if len(blocks) == 0:
+      return None
+    return np.concatenate(blocks, axis=0)
+
+
+class StreamingISTFT(object):
+  """Inverts a stream of complex STFT frames with weighted overlap-add.
+
+  Samples are emitted as soon as no later frame overlaps them (nhop samples
+  per frame), i.e. with nfft - nhop samples of latency.
+  """
+
+  def __init__(self, nfft, nhop, window=None):
+    """Creates a streaming ISTFT.
+
+    Args:
+      nfft: FFT size.
+      nhop: Hop size.
+      window: Analysis (and synthesis) window of length nfft. Defaults to a
+        square root periodic Hann window.
+    """
+    if nhop > nfft:
+      raise ValueError('Hop size must not exceed FFT size')
+    if window is None:
+      window = np.sqrt(0.5 - 0.5 * np.cos(2. * np.pi * np.arange(nfft) / nfft))
+    self.nfft = nfft
+    self.nhop = nhop
+    self.window = window
+    self.reset()
+
+  def reset(self):
+    self._acc = np.zeros(self.nfft, dtype=np.float64)
+    self._norm = np.zeros(self.nfft, dtype=np.float64)
+
+  def push(self, X):
+    """Appends [n, nfft // 2 + 1] complex frames and returns n * nhop samples."""
+    frames = np.fft.irfft(X, n=self.nfft, axis=1) * self.window
+    samples = []
+    for frame in frames:
+      self._acc += frame
+      self._norm += np.square(self.window)
+      samples.append(self._pop(self.nhop))
+    if len(samples) == 0:
+      return np.zeros([0], dtype=np.float64)
+    return np.concatenate(samples)
+
+  def flush(self):
+    """Returns the remaining nfft - nhop samples and resets."""
+    samples = self._pop(self.nfft - self.nhop)
+    self.reset()
+    return samples
+
+  def _pop(self, n):
+    samples = self._acc[:n] / np.maximum(self._norm[:n], 1e-8)
+    self._acc = np.concatenate([self._acc[n:], np.zeros(n)])
+    self._norm = np.concatenate([self._norm[n:], np.zeros(n)])
+    return samples
+
+
+class StreamingLWS(object):
+  """Incremental LWS phase reconstruction.
+
+  Phase for each block of new magnitude frames is estimated by running LWS
+  (in its causal online configuration, without batch iterations) on the new
+  frames preceded by context frames. Only the new frames are kept and
+  synthesized with a streaming ISTFT using the LWS analysis window.
+  """
+
+  def __init__(
+      self,
+      nfft=1024,
+      nhop=256,
+      context=8,
+      look_ahead=3,
+      online_iterations=100):
+    """Creates a streaming phase estimator.
+
+    Args:
+      nfft: FFT size.
+      nhop: Hop size.
+      context: Number of previous magnitude frames to include in each LWS call.
+      look_ahead: Online LWS lookahead in frames (within each block).
+      online_iterations: Number of online LWS iterations.
+    """
+    import lws
+
+    self.nfft = nfft
+    self.nhop = nhop
+    self.context = context
+    self.lws_processor = lws.lws(
+        nfft,
+        nhop,
+        perfectrec=False,
+        look_ahead=look_ahead,
+        nofuture_iterations=0,
+        online_iterations=online_iterations,
+        batch_iterations=0)
+    self.istft = StreamingISTFT(nfft, nhop, window=self.lws_processor.awin)
+    self._context = None
+
+  def push(self, X_mag):
+    """Appends [n, nfft // 2 + 1, 1] magnitude frames and returns audio samples."""
+    X_mag = X_mag[:, :, 0].astype(np.float64)
+    if self._context is None:
+      window = X_mag
+    else:
+      window = np.concatenate([self._context, X_mag], axis=0)
+    X = self.lws_processor.run_lws(window)[-X_mag.shape[0]:]
+    self._context = window[-self.context:] if self.context > 0 else None
+    return self.istft.push(X)
+
+  def flush(self):
+    self._context = None
+    return self.istft.flush()
+
+
+class StreamingVocoder(object):
+  """Vocodes a stream of spectrogram frames into a stream of audio blocks.
+
+  The algorithmic latency (from the arrival of a frame until all audio it
+  affects has been emitted) is lookahead * nhop + nfft - nhop samples.
+  """
+
+  def __init__(
+      self,
+      gen_fn,
+      chunk_len,
+      lookahead=16,
+      context=32,
+      nfft=1024,
+      nhop=256,
+      phase=None):
+    """Creates a streaming vocoder.
+
+    Args:
+      gen_fn: Function mapping [1, chunk_len, nfeats, 1] nd-arrays to
+        [1, chunk_len, nfft // 2 + 1, 1] magnitude spectrograms.
+      chunk_len: Number of timesteps per generator call.
+      lookahead: Number of future frames each generated frame depends on.
+      context: Number of past frames each generated frame depends on.
+      nfft: FFT size.
+      nhop: Hop size.
+      phase: Object with push (magnitude frames to audio samples) and flush
+        methods. Defaults to StreamingLWS.
+    """
+    if phase is None:
+      phase = StreamingLWS(nfft, nhop)
+    self.generator = StreamingGenerator(
+        gen_fn, chunk_len, lookahead=lookahead, context=context)
+    self.phase = phase
+    self.nfft = nfft
+    self.nhop = nhop
+
+  @property
+  def latency_samples(self):
+    return self.generator.lookahead * self.nhop + self.nfft - self.nhop
+
+  def push(self, X):
+    """Appends [n, nfeats, 1] frames and returns a float32 [m, 1, 1] audio block."""
+    X_gen = self.generator.push(X)
+    if X_gen is None:
+      return np.zeros([0, 1, 1], dtype=np.float32)
+    return self._to_audio(self.phase.push(X_gen))
+
+  def flush(self):
+    """Returns the final audio block and resets for the next utterance."""
+    X_gen = self.generator.flush()
+    samples = []
+    if X_gen is not None:
+      samples.append(self.phase.push(X_gen))
+    samples.append(self.phase.flush())
+    return self._to_audio(np.concatenate(samples))
+
+  def _to_audio(self, samples):
+    return samples.astype(np.float32)[:, np.newaxis, np.newaxis]
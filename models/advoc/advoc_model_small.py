@@ -1,9 +1,14 @@
+from functools import partial
+
 import tensorflow as tf
 
 from model import Model, Modes
 import advoc.spectral
+from advoc.spectral import magspec_to_waveform_lws
+from advoc.util import best_shape, compute_scope, loss_scale_optimizer
 import lws
 from spectral_util import SpectralUtil
+from util import average_gradients
 import numpy as np
 EPS = 1e-12
 
@@ -21,6 +26,12 @@ class Advoc(Model):
   use_batchnorm = False
   num_enc_layers = 4
   generator_type = "pix2pix" #pix2pix, linear, linear+pix2pix
+  infer_dropout = True
+  train_precision = "float32" #float32, float16 (float32 master weights)
+  train_xla = False
+  train_loss_scale = "dynamic" #dynamic or fixed scale (float16 only)
+  train_accum_steps = 1 #microbatches per replica batch (gradients are averaged)
+  train_sequential_updates = True #update D, then G against the updated D on a second batch (False: simultaneous updates on one batch)
 
 
   def _discrim_conv(self, x, out_channels, stride):
@@ -55,7 +66,7 @@ class Advoc(Model):
     # [batch, in_height, in_width, in_channels] => [batch, out_height, out_width, out_channels]
     initializer = tf.random_normal_initializer(0, 0.02)
     if self.separable_conv:
-        _b, h, w, _c = x.shape
+        _b, h, w, _c = best_shape(x)
         resized_input = tf.image.resize_images(x, [h * strides[0], w * strides[1]], method=tf.image.ResizeMethod.NEAREST_NEIGHBOR)
         return tf.layers.separable_conv2d(resized_input, 
           out_channels, kernel_size=4, 
@@ -73,6 +84,25 @@ class Advoc(Model):
     gen = tf.layers.dense(x[:,:,:,0], 513)
     return tf.expand_dims(gen, -1)
 
+  def generator_time_stride(self):
+    # mirrors n_time bookkeeping in build_generator (encoder_1 always strides)
+    n_time = self.subseq_len / 2
+    stride = 2
+    for _ in range(self.num_enc_layers):
+      if n_time > 1:
+        n_time /= 2
+        stride *= 2
+    return stride
+
+  def build_padded_generator(self, x):
+    # generator for any number of timesteps: pad to a multiple of the time
+    # stride, run the (fully convolutional) generator, then crop
+    stride = self.generator_time_stride()
+    n_time = tf.shape(x)[1]
+    n_pad = (stride - (n_time % stride)) % stride
+    x = tf.pad(x, [[0, 0], [0, n_pad], [0, 0], [0, 0]])
+    return self.build_generator(x)[:, :n_time]
+
   def build_generator(self, x):
     
     if self.use_batchnorm:
@@ -149,7 +179,7 @@ class Advoc(Model):
         if dropout > 0.0:
           if self.mode == Modes.TRAIN:
             output = tf.nn.dropout(output, keep_prob= 1 - dropout)
-          else:
+          elif self.infer_dropout:
             # use dropout in inference as well
             output = tf.nn.dropout(output, keep_prob= 1 - dropout)
         layers.append(output)
@@ -203,21 +233,19 @@ class Advoc(Model):
 
     with tf.variable_scope("layer_{}".format(len(layers) + 1)):
       convolved = self._discrim_conv(rectified, out_channels=1, stride=1)
-      output = tf.sigmoid(convolved)
+      # float32 so that log(1 - output) is well behaved in float16 training
+      output = tf.sigmoid(tf.cast(convolved, tf.float32))
       layers.append(output)
 
     return layers[-1]
 
-  def __call__(self, x, target, x_wav, x_mel_spec):
-    
-    self.spectral = SpectralUtil(n_mels = self.n_mels, fs = self.audio_fs)
-
-    try:
-      batch_size = int(x.get_shape()[0])
-    except:
-      batch_size = tf.shape(x)[0]
+  def _build_tower(self, x, target, x_mel_spec, reuse):
+    compute_dtype = tf.as_dtype(self.train_precision)
+    x = tf.cast(x, compute_dtype)
+    target = tf.cast(target, compute_dtype)
+    x_mel_spec = tf.cast(x_mel_spec, compute_dtype)
 
-    with tf.variable_scope("generator"):
+    with compute_scope("generator", self.train_precision, self.train_xla, reuse=reuse):
       if self.generator_type == "pix2pix":
         gen_mag_spec = self.build_generator(x)
       elif self.generator_type == "linear":
@@ -233,13 +261,17 @@ class Advoc(Model):
         raise NotImplementedError()
 
     with tf.name_scope("real_discriminator"):
-      with tf.variable_scope("discriminator"):
+      with compute_scope("discriminator", self.train_precision, self.train_xla, reuse=reuse):
         predict_real = self.build_discriminator(x, target)
 
     with tf.name_scope("fake_discriminator"):
-      with tf.variable_scope("discriminator", reuse=True):
+      with compute_scope("discriminator", self.train_precision, self.train_xla, reuse=True):
         predict_fake = self.build_discriminator(x, gen_mag_spec)
 
+    # Losses in float32
+    x, target = tf.cast(x, tf.float32), tf.cast(target, tf.float32)
+    gen_mag_spec = tf.cast(gen_mag_spec, tf.float32)
+
     discrim_loss = tf.reduce_mean(-(tf.log(predict_real + EPS) + tf.log(1 - predict_fake + EPS)))
     gen_loss_GAN = tf.reduce_mean(-tf.log(predict_fake + EPS))
     gen_loss_L1 = tf.reduce_mean(tf.abs(target - gen_mag_spec))
@@ -249,48 +281,150 @@ class Advoc(Model):
     else:
       gen_loss = gen_loss_L1 * self.l1_weight
 
-    self.D_vars = D_vars = [var for var in tf.trainable_variables() if var.name.startswith("discriminator")]
-    self.G_vars = G_vars = [var for var in tf.trainable_variables() if var.name.startswith("generator")]
+    return gen_mag_spec, gen_loss, gen_loss_GAN, gen_loss_L1, discrim_loss
+
+  def train_batches_per_step(self):
+    """Number of loader batches consumed by each training step."""
+    return 2 if self.train_sequential_updates and self.gan_weight > 0 else 1
+
+  def _microbatches(self, batches):
+    # Splits (device, x, target, x_mel_spec) batches into train_accum_steps
+    # microbatches each
+    if self.train_accum_steps == 1:
+      return list(batches)
+    microbatches = []
+    for device, _x, _target, _x_mel_spec in batches:
+      splits = [tf.split(t, self.train_accum_steps) for t in [_x, _target, _x_mel_spec]]
+      microbatches.extend([(device,) + split for split in zip(*splits)])
+    return microbatches
+
+  def _build_towers(self, batches, D_opt=None, G_opt=None, reuse=False):
+    # Builds one tower per microbatch and computes the gradients of each
+    # optimizer given. Returns (towers, D_grads, G_grads).
+    microbatches = self._microbatches(batches)
+    towers = []
+    G_grads = []
+    D_grads = []
+    for i, (device, _x, _target, _x_mel_spec) in enumerate(microbatches):
+      # Wait for the previous microbatch on this device to free its activations
+      deps = []
+      if i % self.train_accum_steps > 0:
+        prev_grads = (G_grads[-1] if G_opt is not None else []) + (D_grads[-1] if D_opt is not None else [])
+        deps = [g for g, _ in prev_grads if g is not None]
+
+      tower_scope = 'tower_{}'.format(i) if len(microbatches) > 1 else None
+      with tf.device(device), tf.name_scope(tower_scope), tf.control_dependencies(deps):
+        tower = self._build_tower(_x, _target, _x_mel_spec, reuse=reuse or i > 0)
+        _, _gen_loss, _, _, _discrim_loss = tower
+        towers.append(tower)
+
+        if i == 0 and not reuse:
+          self.D_vars = [var for var in tf.trainable_variables() if var.name.startswith("discriminator")]
+          self.G_vars = [var for var in tf.trainable_variables() if var.name.startswith("generator")]
+
+        if G_opt is not None:
+          G_grads.append(G_opt.compute_gradients(_gen_loss, var_list=self.G_vars))
+        if D_opt is not None:
+          D_grads.append(D_opt.compute_gradients(_discrim_loss, var_list=self.D_vars))
+
+    return towers, D_grads, G_grads
+
+  def __call__(self, x, target, x_wav, x_mel_spec, devices=None):
+    # If devices is specified, x, target and x_mel_spec are lists with one
+    # batch per device (data-parallel replicas with averaged gradients). Each
+    # batch is further split into train_accum_steps microbatches which run one
+    # after another on their device. With sequential updates, each batch holds
+    # train_batches_per_step() training batches.
+    
+    self.spectral = SpectralUtil(n_mels = self.n_mels, fs = self.audio_fs)
+
+    if devices is None:
+      devices = [None]
+      xs, targets, x_mel_specs = [x], [target], [x_mel_spec]
+    else:
+      xs, targets, x_mel_specs = x, target, x_mel_spec
+      x, target, x_mel_spec = xs[0], targets[0], x_mel_specs[0]
 
     D_opt = tf.train.AdamOptimizer(0.0002, 0.5)
     G_opt = tf.train.AdamOptimizer(0.0002, 0.5)
-    
+    if self.train_precision == "float16":
+      with tf.variable_scope("D_loss_scale"):
+        D_opt, D_loss_scale = loss_scale_optimizer(D_opt, self.train_loss_scale)
+      with tf.variable_scope("G_loss_scale"):
+        G_opt, G_loss_scale = loss_scale_optimizer(G_opt, self.train_loss_scale)
+      tf.summary.scalar('D_loss_scale', D_loss_scale)
+      tf.summary.scalar('G_loss_scale', G_loss_scale)
+
+    # With sequential updates, each replica batch holds two batches: D is
+    # updated on the first, then G's losses and gradients are computed on the
+    # second against the updated D. Resource variables make reads ordered by
+    # control dependencies see the update.
+    sequential = self.train_batches_per_step() > 1
+    D_batches = list(zip(devices, xs, targets, x_mel_specs))
+    G_batches = D_batches
+    if sequential:
+      halves = [[tf.split(t, 2) for t in batch[1:]] for batch in D_batches]
+      D_batches = [(batch[0],) + tuple(h[0] for h in half) for batch, half in zip(D_batches, halves)]
+      G_batches = [(batch[0],) + tuple(h[1] for h in half) for batch, half in zip(G_batches, halves)]
+      if x_wav is not None:
+        x_wav = tf.split(x_wav, 2)[1]
+
+    with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+      if sequential:
+        with tf.name_scope('D_update'):
+          D_towers, D_grads, _ = self._build_towers(D_batches, D_opt=D_opt, reuse=False)
+          self.D_train_op = D_opt.apply_gradients(average_gradients(D_grads))
+        with tf.name_scope('G_update'), tf.control_dependencies([self.D_train_op]):
+          G_towers, _, G_grads = self._build_towers(G_batches, G_opt=G_opt, reuse=True)
+      else:
+        # D and G gradients are computed from the same batch and weights
+        G_towers, D_grads, G_grads = self._build_towers(
+            D_batches, D_opt=D_opt, G_opt=G_opt, reuse=False)
+        D_towers = G_towers
+        G_grads = [average_gradients(G_grads)]
+        with tf.control_dependencies([g for g, _ in G_grads[0] if g is not None]):
+          self.D_train_op = D_opt.apply_gradients(average_gradients(D_grads))
+
+    # Summaries show the first replica's G batch
+    _, x, target, x_mel_spec = G_batches[0]
+    gen_mag_spec = G_towers[0][0]
+    gen_loss, gen_loss_GAN, gen_loss_L1 = [
+        tf.add_n(list(losses)) / len(G_towers) for losses in list(zip(*G_towers))[1:4]]
+    discrim_loss = tf.add_n([tower[4] for tower in D_towers]) / len(D_towers)
+    self.gen_loss_L1 = gen_loss_L1
+    self.discrim_loss = discrim_loss
+
+    # One train_op updates D followed by G, so a training step is a single
+    # session call
     self.step = step = tf.train.get_or_create_global_step()
-    self.G_train_op = G_opt.minimize(gen_loss, var_list=G_vars,
-  global_step=self.step)
-
-    self.D_train_op = D_opt.minimize(discrim_loss, var_list=D_vars)
+    with tf.control_dependencies([self.D_train_op] if self.gan_weight > 0 else []):
+      self.G_train_op = G_opt.apply_gradients(average_gradients(G_grads), global_step=self.step)
+    self.train_op = self.G_train_op
 
-    input_audio = tf.py_func( self.spectral.audio_from_mag_spec, [x[0]], tf.float32, stateful=False)
-    target_audio = tf.py_func( self.spectral.audio_from_mag_spec, [target[0]], tf.float32, stateful=False)
-    gen_audio = tf.py_func( self.spectral.audio_from_mag_spec, [gen_mag_spec[0]], tf.float32, stateful=False)
-
-    input_audio = tf.reshape(input_audio, [1, -1, 1, 1] )
-    target_audio = tf.reshape(target_audio, [1, -1, 1, 1] )
-    gen_audio = tf.reshape(gen_audio, [1, -1, 1, 1] )
-    
-    
-    tf.summary.audio('input_audio', input_audio[:, :, 0, :], self.audio_fs)
-    tf.summary.audio('target_audio', target_audio[:, :, 0, :], self.audio_fs)
-    tf.summary.audio('target_x_wav', x_wav[:, :, 0, :], self.audio_fs)
-    tf.summary.audio('gen_audio', gen_audio[:, :, 0, :], self.audio_fs)
     tf.summary.scalar('gen_loss_total', gen_loss)
     tf.summary.scalar('gen_loss_L1', gen_loss_L1)
     tf.summary.scalar('gen_loss_GAN', gen_loss_GAN)
     tf.summary.scalar('disc_loss', discrim_loss)
 
-    #image summaries
-    tf.summary.image('input_melspec', tf.image.rot90(x_mel_spec))
-    tf.summary.image('input_magspec', tf.image.rot90(x))
-    tf.summary.image('generated_magspec', tf.image.rot90(gen_mag_spec))
-    tf.summary.image('target_magspec', tf.image.rot90(target))
-    
+    # Audio and image summaries are written by an AsyncSummaryHook so that
+    # phase estimation runs outside of the training step
+    invert_fn = partial(magspec_to_waveform_lws, nfft=self.spectral.NFFT, nhop=self.spectral.NHOP)
+    self.summary_audio = [
+      ('input_audio', x, invert_fn),
+      ('target_audio', target, invert_fn),
+      ('gen_audio', gen_mag_spec, invert_fn)]
+    if x_wav is not None:
+      self.summary_audio.append(('target_x_wav', x_wav, None))
+    self.summary_images = [
+      ('input_melspec', x_mel_spec),
+      ('input_magspec', x),
+      ('generated_magspec', gen_mag_spec),
+      ('target_magspec', target)]
+
 
 
   def train_loop(self, sess):
-    if self.gan_weight > 0:
-      sess.run(self.D_train_op)
-    _, _step = sess.run([self.G_train_op, self.step])
+    _, _step = sess.run([self.train_op, self.step])
     return _step
     
 
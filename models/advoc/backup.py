@@ -1,38 +1,77 @@
 from __future__ import print_function
 
 if __name__ == '__main__':
-  import glob
+  from argparse import ArgumentParser
   import os
-  import shutil
-  import sys
   import time
 
-  import tensorflow as tf
+  from advoc.backup import CheckpointBackup
+  from advoc.checkpoint import CheckpointWatcher
 
-  train_dir, nmin = sys.argv[1:3]
-  nsec = int(float(nmin) * 60.)
+  parser = ArgumentParser()
 
-  backup_dir = os.path.join(train_dir, 'backup')
+  parser.add_argument('train_dir', type=str)
+  parser.add_argument('nmin', type=float,
+      help='Minutes between backups')
+  parser.add_argument('--backup_dir', type=str,
+      help='Backup directory (defaults to train_dir/backup)')
+  parser.add_argument('--mode', type=str, choices=['link', 'dedup', 'copy'],
+      help='link: reflink or hardlink files, dedup: store content-hashed chunks once, copy: full copies')
+  parser.add_argument('--keep', type=int,
+      help='If set, number of most recent backups to retain')
+  parser.add_argument('--chunk_mb', type=float,
+      help='Chunk size in megabytes for dedup mode')
+  parser.add_argument('--restore', type=str,
+      help='If set, restore this checkpoint (e.g. model.ckpt-1000) to --restore_dir and exit')
+  parser.add_argument('--restore_dir', type=str,
+      help='Directory to restore to')
+  parser.add_argument('--list', action='store_true', dest='list',
+      help='If set, list backed up checkpoints and exit')
 
-  if not os.path.exists(backup_dir):
-    os.makedirs(backup_dir)
+  parser.set_defaults(
+      train_dir=None,
+      nmin=None,
+      backup_dir=None,
+      mode='link',
+      keep=None,
+      chunk_mb=4.,
+      restore=None,
+      restore_dir=None,
+      list=False)
 
-  while tf.train.latest_checkpoint(train_dir) is None:
-    print('Waiting for first checkpoint')
-    time.sleep(1)
+  args = parser.parse_args()
+
+  nsec = int(args.nmin * 60.)
+  backup_dir = args.backup_dir
+  if backup_dir is None:
+    backup_dir = os.path.join(args.train_dir, 'backup')
 
-  while True:
-    latest_ckpt = tf.train.latest_checkpoint(train_dir)
+  store = CheckpointBackup(
+      backup_dir,
+      mode=args.mode,
+      keep=args.keep,
+      chunk_size=int(args.chunk_mb * (1 << 20)))
 
-    # Sleep for two seconds in case file flushing
-    time.sleep(2)
+  if args.list:
+    for name in store.held():
+      print(name)
+  elif args.restore is not None:
+    if args.restore_dir is None:
+      raise ValueError('Must specify --restore_dir')
+    print(store.restore(args.restore, args.restore_dir))
+  else:
+    # Yields the newest checkpoint once all of its files are written
+    watcher = CheckpointWatcher(args.train_dir)
+    print('Waiting for first checkpoint')
 
-    for fp in glob.glob(latest_ckpt + '*'):
-      _, name = os.path.split(fp)
-      backup_fp = os.path.join(backup_dir, name)
-      print('{}->{}'.format(fp, backup_fp))
-      shutil.copyfile(fp, backup_fp)
-    print('-' * 80)
+    for latest_ckpt in watcher.checkpoints():
+      start = time.time()
+      if store.backup(latest_ckpt):
+        print('{}->{} ({:.1f}s)'.format(latest_ckpt, backup_dir, time.time() - start))
+        print(store.summary())
+      else:
+        print('{} already backed up'.format(latest_ckpt))
+      print('-' * 80)
 
-    # Sleep for an hour
-    time.sleep(nsec)
\ No newline at end of file
+      # Sleep for an hour
+      time.sleep(nsec)
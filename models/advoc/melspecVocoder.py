@@ -3,10 +3,11 @@ import tensorflow as tf
 import lws
 from advoc import audioio
 from advoc import spectral
-from model import Modes
-from srezModel import SrezMelSpec
-from util import override_model_attrs
+from advoc import specio
+from advoc.vocoder import BatchedGenerator, generator_accepts_melspec, load_generator
+from advoc.vocoder import VocodingPipeline
 from argparse import ArgumentParser
+from functools import partial
 import spectral_util
 import os
 import glob
@@ -24,6 +25,10 @@ def main():
   parser.add_argument('--n_mels', type=int)
   parser.add_argument('--fs', type=int)
   parser.add_argument('--subseq_len', type=int)
+  parser.add_argument('--batch_size', type=int)
+  parser.add_argument('--overlap', type=int)
+  parser.add_argument('--num_workers', type=int)
+  parser.add_argument('--queue_size', type=int)
 
   parser.set_defaults( 
     input_file=None,
@@ -33,67 +38,79 @@ def main():
     heuristic="lws",
     n_mels=80,
     fs=22050,
-    subseq_len = 256
+    subseq_len = 256,
+    batch_size = 16,
+    overlap = 0,
+    num_workers = 4,
+    queue_size = 8
     )
   args = parser.parse_args()
 
   if not os.path.isdir(args.output_dir):
     os.makedirs(args.output_dir)
 
-  gen_graph = tf.Graph()
-  with gen_graph.as_default():
-    gan_saver = tf.train.import_meta_graph(args.meta_fp)
-
-  gen_sess = tf.Session(graph=gen_graph)
   print("Restoring")
-  gan_saver.restore(gen_sess, args.ckpt_fp)
-  gen_mag_spec = gen_graph.get_tensor_by_name('generator/decoder_1/strided_slice_1:0')
-  x_mag_input = gen_graph.get_tensor_by_name('ExpandDims_1:0')
+  # Exported generators convert mel to magnitude spectrograms in-graph
+  mel_in_graph = generator_accepts_melspec(args.meta_fp)
+  gen_fn, exported = load_generator(
+      args.meta_fp, args.ckpt_fp, chunk_len=args.subseq_len, melspec=mel_in_graph)
 
   su = spectral_util.SpectralUtil(n_mels = args.n_mels, fs = args.fs)
 
   spec_fps = glob.glob(os.path.join(args.input_dir, '*.npy'))
-  subseq_len = args.subseq_len
+  spec_fps += glob.glob(os.path.join(args.input_dir, '*' + specio.SPEC_EXT))
+
+  if exported and args.subseq_len == 0:
+    # Exported generators accept whole utterances
+    gen = BatchedGenerator(
+        lambda _X: np.clip(gen_fn(_X), 0, None).astype(np.float64),
+        chunk_len=None,
+        batch_size=1)
+  else:
+    gen = BatchedGenerator(
+        lambda _X: np.clip(gen_fn(_X), 0, None).astype(np.float64),
+        chunk_len=args.subseq_len,
+        batch_size=args.batch_size,
+        overlap=args.overlap)
+
+  def load_mags():
+    for fp in spec_fps:
+      _mel_spec = specio.read_spectrogram(fp)[:,:,0]
+      if mel_in_graph:
+        yield fp, _mel_spec[:, :, np.newaxis].astype(np.float32)
+        continue
+      X_mag = su.tacotron_mel_to_mag(_mel_spec)
+      yield fp, X_mag[:, :, np.newaxis]
+
+  if args.heuristic == 'lws':
+    invert_fn = partial(spectral.magspec_to_waveform_lws, nfft=1024, nhop=256)
+  elif args.heuristic == 'gl':
+    invert_fn = partial(spectral.magspec_to_waveform_griffin_lim, nfft=1024, nhop=256)
+  else:
+    raise NotImplementedError()
+
+  nwritten = [0]
+  def write_audio(fp, _gen_audio):
+    fn = os.path.splitext(os.path.basename(fp))[0] + ".wav"
+    output_file_name = os.path.join(args.output_dir, fn)
+    print("Writing", nwritten[0], output_file_name)
+    audioio.save_as_wav(output_file_name, args.fs, _gen_audio)
+    nwritten[0] += 1
+
+  # Generation, phase estimation and writing overlap across files
+  pipeline = VocodingPipeline(
+      gen,
+      invert_fn,
+      write_audio,
+      num_workers=args.num_workers,
+      queue_size=args.queue_size)
 
   start = time.time()
-  for fidx, fp in enumerate(spec_fps):
-    _mel_spec = np.load(fp)[:,:,0]
-    X_mag = su.tacotron_mel_to_mag(_mel_spec)
-    x_mag_original_length = X_mag.shape[0]
-    x_mag_target_length = int(X_mag.shape[0] / subseq_len ) * subseq_len + subseq_len
-    X_mag = np.pad(X_mag, ([0,x_mag_target_length - X_mag.shape[0]], [0,0]), 'constant')
-    num_examples = int(x_mag_target_length/subseq_len)
-    X_mag = np.reshape(X_mag, [num_examples, subseq_len, 513, 1])
-    gen_mags = []
-    heuristic_mags = []
-    for n in range(num_examples):
-      _gen, _heur = gen_sess.run([gen_mag_spec, x_mag_input], feed_dict = {
-          x_mag_input : X_mag[n:n+1]
-          })
-      
-      _gen = np.clip(_gen, 0, None)
-
-      gen_mags.append(_gen[0])
-      heuristic_mags.append(_heur[0])
-    gen_mag = np.concatenate(gen_mags, axis = 0)
-    heur_mag = np.concatenate(heuristic_mags, axis = 0)
-
-    _gen_audio = su.audio_from_mag_spec(gen_mag)
-    gen_mag = gen_mag[0:x_mag_original_length]
-
-    if args.heuristic == 'lws':
-      _gen_audio = spectral.magspec_to_waveform_lws(gen_mag.astype('float64'), 1024, 256)
-    elif args.heuristic == 'gl':
-      _gen_audio = spectral.magspec_to_waveform_griffin_lim(gen_mag, 1024, 256)
-    else:
-      raise NotImplementedError()
-
-    fn = fp.split("/")[-1][:-3] + "wav"
-    output_file_name = os.path.join(args.output_dir, fn)
-    print("Writing", fidx, output_file_name)
-    audioio.save_as_wav(output_file_name, args.fs, _gen_audio)  
+  pipeline.run(load_mags())
   end = time.time()
   print("Execution Time in Seconds", end - start)
+  print("{} chunks in {} generator calls".format(gen.nchunks, gen.ncalls))
+  print(pipeline.summary())
 
 if __name__ == '__main__':
   main()
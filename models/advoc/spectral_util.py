@@ -50,11 +50,13 @@ class SpectralUtil(object):
     return magspec_inv
 
   def tacotron_mel_to_mag(self, X_mel_dbnorm):
+    return advoc.spectral.tacotron_mel_to_mag(X_mel_dbnorm, self.invmeltrans_np)
+
+  def tacotron_mel_to_mag_tf(self, X_mel_dbnorm):
+    # in-graph tacotron_mel_to_mag for [batch, time, n_mels, 1] tensors
     norm_min_level_db = -100
     norm_ref_level_db = 20
-    fs = self.fs
-    
+
     X_mel_db = (X_mel_dbnorm * -norm_min_level_db) + norm_min_level_db
-    X_mel = np.power(10, (X_mel_db + norm_ref_level_db) / 20)
-    X_mag = np.dot(X_mel, self.invmeltrans_np.T)
-    return X_mag
+    X_mel = tf.pow(10., (X_mel_db + norm_ref_level_db) / 20)
+    return self.mel_linear_to_mag_spec(X_mel)
@@ -1,7 +1,14 @@
 import tensorflow as tf
+from advoc.cache import ExampleCache
+from advoc.checkpoint import CheckpointWatcher
 from advoc.loader import decode_extract_and_batch
+from advoc.manifest import read_manifest_fps
+from advoc.metrics import log_spectral_distance_tf, mel_cepstral_distortion_tf
+from advoc.metrics import nonsilent_mask_tf, spectral_convergence_tf
+from advoc.summary import AsyncSummaryHook
 from model import Modes
-from util import override_model_attrs
+from util import float16_weights_graph_def, override_model_attrs
+import collections
 import numpy as np
 import time
 import advoc.spectral
@@ -10,6 +17,34 @@ from advoc_model_small import Advoc as AdvocSmall
 from spectral_util import SpectralUtil
 
 
+def _replica_devices(args):
+  # Returns devices for data-parallel replicas, the GPU (if any) each replica
+  # prefetches to and a session config exposing the requested CPU devices
+  from tensorflow.python.client import device_lib
+
+  session_config = tf.ConfigProto(
+    allow_soft_placement=True,
+    device_count={'CPU': args.train_num_cpu_devices})
+  local_devices = device_lib.list_local_devices(session_config=session_config)
+
+  gpus = [d.name for d in local_devices if d.device_type == 'GPU']
+  if len(gpus) > 0:
+    devices = gpus
+    gpu_nums = list(range(len(gpus)))
+  else:
+    devices = [d.name for d in local_devices if d.device_type == 'CPU']
+    gpu_nums = [None] * len(devices)
+
+  num_replicas = args.train_num_replicas
+  if num_replicas is None:
+    num_replicas = len(devices)
+  if num_replicas > len(devices):
+    raise ValueError('Requested {} replicas but found {} devices'.format(
+      num_replicas, len(devices)))
+
+  return devices[:num_replicas], gpu_nums[:num_replicas], session_config
+
+
 def train(fps, args):
   # Initialize model
   if args.model_type == "regular":
@@ -27,48 +62,160 @@ def train(fps, args):
   print('-' * 80)
 
   # Load data
-  with tf.name_scope('loader'):
-    x_magspec, x_wav = decode_extract_and_batch(
-      fps,
-      batch_size=model.train_batch_size,
-      slice_len=model.subseq_len,
-      audio_fs=model.audio_fs,
-      audio_mono=True,
-      audio_normalize=args.data_normalize,
-      decode_fastwav=args.data_fastwav,
-      decode_parallel_calls=4,
-      extract_type='magspec',
-      extract_parallel_calls=8,
-      repeat=True,
-      shuffle=True,
-      shuffle_buffer_size=512,
-      slice_first_only=args.data_slice_first_only,
-      slice_randomize_offset=args.data_slice_randomize_offset,
-      slice_overlap_ratio=args.data_slice_overlap_ratio,
-      slice_pad_end=args.data_slice_pad_end,
-      prefetch_size=model.train_batch_size * 8,
-      prefetch_gpu_num=0)
+  cache = None
+  if args.data_cache_mb is not None:
+    cache = ExampleCache(
+        int(args.data_cache_mb * (1 << 20)),
+        spill_dir=args.data_cache_spill_dir,
+        spill_max_nbytes=None if args.data_cache_spill_mb is None else int(args.data_cache_spill_mb * (1 << 20)))
+
+  stats_aggregator = None
+  if args.data_stats:
+    stats_aggregator = tf.data.experimental.StatsAggregator()
+
+  # Replicas split the global batch and the worker's training files
+  devices, gpu_nums, session_config = _replica_devices(args)
+  num_replicas = len(devices)
+  if args.train_replica_batch_size is not None:
+    replica_batch_size = args.train_replica_batch_size
+    model.train_batch_size = replica_batch_size * num_replicas
+  elif model.train_batch_size % num_replicas != 0:
+    raise ValueError('Batch size {} not divisible by {} replicas'.format(
+      model.train_batch_size, num_replicas))
+  else:
+    replica_batch_size = model.train_batch_size // num_replicas
+  if replica_batch_size % model.train_accum_steps != 0:
+    raise ValueError('Replica batch size {} not divisible by {} accumulation steps'.format(
+      replica_batch_size, model.train_accum_steps))
+  print('Training {} replicas ({}) with batch size {} each ({} total)'.format(
+    num_replicas, ', '.join(devices), replica_batch_size, model.train_batch_size))
+
+  # Sequential D and G updates each take their own batch from one loader batch
+  batches_per_step = model.train_batches_per_step()
+
+  x_magspecs = []
+  x_wav = None
+  for i, gpu_num in enumerate(gpu_nums):
+    with tf.name_scope('loader' if num_replicas == 1 else 'loader_{}'.format(i)):
+      x_magspec, _x_wav = decode_extract_and_batch(
+        fps,
+        batch_size=replica_batch_size * batches_per_step,
+        slice_len=model.subseq_len,
+        audio_fs=model.audio_fs,
+        audio_mono=True,
+        audio_normalize=args.data_normalize,
+        audio_return=args.train_summary_x_wav and i == 0,
+        decode_fastwav=args.data_fastwav,
+        decode_parallel_calls=4,
+        cache=cache,
+        cache_features=args.data_cache_features,
+        extract_type='magspec',
+        extract_parallel_calls=8,
+        repeat=True,
+        shuffle=True,
+        shuffle_buffer_size=args.data_shuffle_buffer_size,
+        shuffle_compact_dtype=args.data_shuffle_compact_dtype,
+        num_shards=args.data_num_shards * num_replicas,
+        shard_index=args.data_shard_index * num_replicas + i,
+        slice_first_only=args.data_slice_first_only,
+        slice_randomize_offset=args.data_slice_randomize_offset,
+        slice_overlap_ratio=args.data_slice_overlap_ratio,
+        slice_pad_end=args.data_slice_pad_end,
+        prefetch_size=replica_batch_size * 8 // batches_per_step,
+        prefetch_gpu_num=gpu_num,
+        stats_aggregator=stats_aggregator)
+      x_magspecs.append(x_magspec)
+      if i > 0:
+        continue
+      x_wav = _x_wav
+
+      # Aggregator and cache are shared by all replicas
+      if stats_aggregator is not None:
+        tf.add_to_collection(tf.GraphKeys.SUMMARIES, stats_aggregator.get_summary())
+      if cache is not None:
+        tf.summary.scalar('cache_hit_rate', tf.py_func(
+          lambda: np.float32(cache.hit_rate), [], tf.float32, stateful=True))
 
   # Create model
   spectral = SpectralUtil(n_mels = model.n_mels, fs = model.audio_fs)
-  
-  x_melspec = spectral.mag_to_mel_linear_spec(x_magspec)
-  x_inverted_magspec = spectral.mel_linear_to_mag_spec(x_melspec, transform = 'inverse')
 
-  model(x_inverted_magspec, x_magspec, x_wav, x_melspec)
+  x_melspecs = []
+  x_inverted_magspecs = []
+  for device, x_magspec in zip(devices, x_magspecs):
+    with tf.device(device):
+      x_melspec = spectral.mag_to_mel_linear_spec(x_magspec)
+      x_inverted_magspec = spectral.mel_linear_to_mag_spec(x_melspec, transform = 'inverse')
+    x_melspecs.append(x_melspec)
+    x_inverted_magspecs.append(x_inverted_magspec)
+
+  if num_replicas == 1:
+    model(x_inverted_magspecs[0], x_magspecs[0], x_wav, x_melspecs[0])
+  else:
+    model(x_inverted_magspecs, x_magspecs, x_wav, x_melspecs, devices=devices)
+
+  summary_hook = AsyncSummaryHook(
+      args.train_dir,
+      audio=model.summary_audio,
+      images=model.summary_images,
+      audio_fs=model.audio_fs,
+      every_n_secs=args.train_summary_every_nsecs)
 
   #Train
   with tf.train.MonitoredTrainingSession(
       checkpoint_dir=args.train_dir,
       save_checkpoint_secs=args.train_ckpt_every_nsecs,
-      save_summaries_secs=args.train_summary_every_nsecs) as sess:
+      save_summaries_secs=args.train_summary_every_nsecs,
+      hooks=[summary_hook],
+      config=session_config) as sess:
     
     _step = 0
     while not sess.should_stop() and _step < args.max_steps:
       _step = model.train_loop(sess)
 
+  if cache is not None:
+    print(cache.summary())
   print("Done!")
 
+def _featurize_valid(fps, model, args):
+  # Decodes and featurizes the validation set once into memory
+  with tf.Graph().as_default():
+    with tf.name_scope('loader'):
+      x_magspec, _ = decode_extract_and_batch(
+        fps,
+        batch_size=64,
+        slice_len=model.subseq_len,
+        audio_fs=model.audio_fs,
+        audio_mono=True,
+        audio_normalize=args.data_normalize,
+        audio_return=False,
+        decode_fastwav=args.data_fastwav,
+        decode_parallel_calls=4,
+        extract_type='magspec',
+        extract_parallel_calls=8,
+        repeat=False,
+        shuffle=False,
+        shuffle_buffer_size=None,
+        slice_first_only=args.data_slice_first_only,
+        slice_randomize_offset=False,
+        slice_overlap_ratio=0.,
+        slice_pad_end=True,
+        drop_remainder=False,
+        prefetch_size=None,
+        prefetch_gpu_num=None)
+
+    _x_magspecs = []
+    with tf.Session() as sess:
+      while True:
+        try:
+          _x_magspecs.append(sess.run(x_magspec))
+        except tf.errors.OutOfRangeError:
+          break
+
+  if len(_x_magspecs) == 0:
+    raise ValueError('Found no validation slices')
+  return np.concatenate(_x_magspecs, axis=0)
+
+
 def eval(fps, args):
   if args.eval_dataset_name is not None:
     eval_dir = os.path.join(args.train_dir,
@@ -92,27 +239,20 @@ def eval(fps, args):
   print(summary)
   print('-' * 80)
 
+  start = time.time()
+  _x_magspecs = _featurize_valid(fps, model, args)
+  print('Featurized {} validation slices in {:.1f}s ({:.1f} MB)'.format(
+    _x_magspecs.shape[0], time.time() - start, _x_magspecs.nbytes / float(1 << 20)))
+
+  # The validation set is fed once per checkpoint through a re-initializable
+  # iterator
   with tf.name_scope('loader'):
-    x_magspec, x_wav = decode_extract_and_batch(
-      fps,
-      batch_size=model.eval_batch_size,
-      slice_len=model.subseq_len,
-      audio_fs=model.audio_fs,
-      audio_mono=True,
-      audio_normalize=args.data_normalize,
-      decode_fastwav=args.data_fastwav,
-      decode_parallel_calls=4,
-      extract_type='magspec',
-      extract_parallel_calls=8,
-      repeat=False,
-      shuffle=False,
-      shuffle_buffer_size=None,
-      slice_first_only=args.data_slice_first_only,
-      slice_randomize_offset=False,
-      slice_overlap_ratio=0.,
-      slice_pad_end=True,
-      prefetch_size=None,
-      prefetch_gpu_num=None)
+    x_magspecs = tf.placeholder(tf.float32, [None] + list(_x_magspecs.shape[1:]))
+    dataset = tf.data.Dataset.from_tensor_slices(x_magspecs)
+    dataset = dataset.batch(model.eval_batch_size)
+    dataset = dataset.prefetch(1)
+    iterator = dataset.make_initializable_iterator()
+    x_magspec = iterator.get_next()
   
   spectral = SpectralUtil(n_mels = model.n_mels, fs = model.audio_fs)
   x_melspec = spectral.mag_to_mel_linear_spec(x_magspec)
@@ -135,57 +275,67 @@ def eval(fps, args):
 
     G_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=vs.name)
 
-  gen_loss_L1 = tf.reduce_mean(tf.abs(x_magspec - gen_magspec))
+  # Only running means leave the session. Spectral metrics are per example
+  # and ignore zero-padded frames.
+  X = x_magspec[:, :, :, 0]
+  Y = tf.maximum(gen_magspec[:, :, :, 0], 0.)
+  mask = nonsilent_mask_tf(X)
+  weights = tf.cast(tf.reduce_sum(mask, axis=1) > 0, tf.float32)
+  metrics = collections.OrderedDict([
+    ('gen_loss_L1', tf.metrics.mean(tf.abs(x_magspec - gen_magspec))),
+    ('spectral_convergence', tf.metrics.mean(
+      spectral_convergence_tf(X, Y, mask=mask), weights=weights)),
+    ('log_spectral_distance', tf.metrics.mean(
+      log_spectral_distance_tf(X, Y, mask=mask), weights=weights)),
+    ('mel_cepstral_distortion', tf.metrics.mean(
+      mel_cepstral_distortion_tf(X, Y, spectral.meltrans_np, mask=mask), weights=weights)),
+  ])
+  metric_updates = tf.group(*[update for _, update in metrics.values()])
+  metric_values = dict([(k, value) for k, (value, _) in metrics.items()])
+  reset_op = tf.group(iterator.initializer, tf.local_variables_initializer())
   gan_step = tf.train.get_or_create_global_step()
   gan_saver = tf.train.Saver(var_list=G_vars + [gan_step], max_to_keep=1)
 
-
-  all_gen_loss_L1 = tf.placeholder(tf.float32, [None])
-
-  summaries = [
-    tf.summary.scalar('gen_loss_L1', tf.reduce_mean(all_gen_loss_L1)),
-  ]
-  summaries = tf.summary.merge(summaries)
-
   # Create summary writer
   summary_writer = tf.summary.FileWriter(eval_dir)
-  ckpt_fp = None
-  _best_gen_loss_l1 = np.inf
+  best_gen_loss_l1 = [np.inf]
 
-  while True:
-    latest_ckpt_fp = tf.train.latest_checkpoint(args.train_dir)
-    if latest_ckpt_fp != ckpt_fp:
-      ckpt_fp = latest_ckpt_fp
-      print('Evaluating {}'.format(ckpt_fp))
+  sess = tf.Session()
 
-      with tf.Session() as sess:
-        gan_saver.restore(sess, latest_ckpt_fp)
-        _step = sess.run(gan_step)
-        _all_gen_loss_L1 = []
+  def evaluate(ckpt_fp):
+    print('Evaluating {}'.format(ckpt_fp))
+    start = time.time()
 
-        while True:
-          try:
-            _gen_loss_L1, _gen_magspec, _x_magspec = sess.run([gen_loss_L1, gen_magspec, x_magspec])
-          except tf.errors.OutOfRangeError:
-            break
+    gan_saver.restore(sess, ckpt_fp)
+    _step = sess.run(gan_step)
+    sess.run(reset_op, {x_magspecs: _x_magspecs})
 
-          _all_gen_loss_L1.append(_gen_loss_L1)
-
-        _all_gen_loss_L1 = np.array(_all_gen_loss_L1)
-        
-        _summaries = sess.run(summaries, 
-          {
-            all_gen_loss_L1: _all_gen_loss_L1, 
-          }
-        )
-        summary_writer.add_summary(_summaries, _step)
-        _gen_loss_L1_np = np.mean(_all_gen_loss_L1)
-
-        if _gen_loss_L1_np < _best_gen_loss_l1:
-          gan_saver.save(sess, os.path.join(eval_dir, 'best_gen_loss_l1'), _step)
-          print("Saved best gen loss l1!")
-      print('Done!')
-    time.sleep(1)
+    while True:
+      try:
+        sess.run(metric_updates)
+      except tf.errors.OutOfRangeError:
+        break
+    _metrics = sess.run(metric_values)
+    _gen_loss_L1_np = _metrics['gen_loss_L1']
+
+    summary_writer.add_summary(tf.Summary(value=[
+      tf.Summary.Value(tag=k, simple_value=_metrics[k]) for k in metrics]), _step)
+    summary_writer.flush()
+
+    if _gen_loss_L1_np < best_gen_loss_l1[0]:
+      gan_saver.save(sess, os.path.join(eval_dir, 'best_gen_loss_l1'), _step)
+      best_gen_loss_l1[0] = _gen_loss_L1_np
+      print("Saved best gen loss l1!")
+    print('Done in {:.1f}s ({})'.format(
+      time.time() - start, ', '.join(['{} {:.6f}'.format(k, _metrics[k]) for k in metrics])))
+
+  watcher = CheckpointWatcher(args.train_dir, backlog=args.eval_backlog)
+  watcher.add_handler(evaluate)
+  try:
+    watcher.run()
+  finally:
+    watcher.close()
+    sess.close()
 
 def infer(fps, args):
   if args.infer_dataset_name is not None:
@@ -300,78 +450,456 @@ def infer(fps, args):
 
   else:
     # Continuous Inference
-    ckpt_fp = None
-    while True:
+    def infer_ckpt(ckpt_fp):
+      # A new session restarts the (one-shot) loader
       with tf.Session() as sess:
-        latest_ckpt_fp = tf.train.latest_checkpoint(args.train_dir)
-        if latest_ckpt_fp != ckpt_fp:
-          ckpt_fp = latest_ckpt_fp
-          print('Infereing From {}'.format(ckpt_fp))
-          gan_saver.restore(sess, ckpt_fp)
-          _step = sess.run(step)
-          
-          while True:
-            try:
-              _summaries, mel_np, est_np, act_np, gen_np = sess.run([
-                summaries,
-                x_melspec,
-                x_inverted_magspec,
-                x_magspec,
-                gen_magspec
-              ])
-              summary_writer.add_summary(_summaries, _step)
-
-            except tf.errors.OutOfRangeError:
-              break
-          print("Done!")
-        time.sleep(1)
+        print('Infereing From {}'.format(ckpt_fp))
+        gan_saver.restore(sess, ckpt_fp)
+        _step = sess.run(step)
+
+        while True:
+          try:
+            _summaries, mel_np, est_np, act_np, gen_np = sess.run([
+              summaries,
+              x_melspec,
+              x_inverted_magspec,
+              x_magspec,
+              gen_magspec
+            ])
+            summary_writer.add_summary(_summaries, _step)
+
+          except tf.errors.OutOfRangeError:
+            break
+        print("Done!")
+
+    watcher = CheckpointWatcher(args.train_dir)
+    watcher.add_handler(infer_ckpt)
+    try:
+      watcher.run()
+    finally:
+      watcher.close()
 
   raise NotImplementedError()
 
-    
+
+def _freeze_generator(sess, input_names, output_names):
+  from tensorflow.tools.graph_transforms import TransformGraph
+
+  graph_def = tf.graph_util.convert_variables_to_constants(
+    sess,
+    sess.graph.as_graph_def(),
+    output_names)
+
+  # Drops everything but the generator (e.g. global step) and precomputes
+  # subgraphs which only depend on weights
+  return TransformGraph(
+    graph_def,
+    input_names,
+    output_names,
+    [
+      'strip_unused_nodes(type=float)',
+      'remove_nodes(op=Identity, op=CheckNumerics)',
+      'fold_constants(ignore_errors=true)',
+      'fold_batch_norms',
+      'sort_by_execution_order'
+    ])
+
+
+def export(args):
+  if args.model_type == "regular":
+    model = Advoc(Modes.INFER)
+  elif args.model_type == "small":
+    model = AdvocSmall(Modes.INFER)
+  else:
+    raise NotImplementedError()
+
+  model, summary = override_model_attrs(model, args.model_overrides)
+  model.audio_fs = args.data_sample_rate
+
+  print('-' * 80)
+  print(summary)
+  print('-' * 80)
+
+  if model.generator_type != "pix2pix":
+    raise NotImplementedError('Can only export fully convolutional generator')
+
+  # Accepts any batch size and number of timesteps. Normalized mel
+  # spectrograms are converted in-graph unless x_magspec is fed directly.
+  spectral = SpectralUtil(n_mels = model.n_mels, fs = model.audio_fs)
+  x_melspec = tf.placeholder(tf.float32, [None, None, model.n_mels, 1], name='x_melspec')
+  x_magspec = tf.placeholder_with_default(
+    spectral.tacotron_mel_to_mag_tf(x_melspec),
+    [None, None, 513, 1],
+    name='x_magspec')
+
+  with tf.variable_scope("generator") as vs:
+    gen_magspec = model.build_padded_generator(x_magspec)
+    G_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=vs.name)
+  gen_magspec = tf.identity(gen_magspec, name='gen_magspec')
+
+  step = tf.train.get_or_create_global_step()
+  saver = tf.train.Saver(var_list=G_vars + [step])
+
+  if not os.path.isdir(args.train_dir):
+    os.makedirs(args.train_dir)
+  export_fp = os.path.join(args.train_dir, 'infer.meta')
+  tf.train.export_meta_graph(
+    filename=export_fp,
+    clear_devices=True,
+    saver_def=saver.as_saver_def())
+  print('Exported generator (time stride {}) to {}'.format(
+    model.generator_time_stride(), export_fp))
+
+  # Freeze generator weights from a checkpoint into a standalone graph
+  ckpt_fp = args.export_ckpt_fp
+  if ckpt_fp is None:
+    ckpt_fp = tf.train.latest_checkpoint(args.train_dir)
+  if ckpt_fp is None:
+    print('No checkpoint found, skipping frozen graph')
+    return
+
+  with tf.Session() as sess:
+    saver.restore(sess, ckpt_fp)
+    _step = sess.run(step)
+    # x_magspec remains feedable
+    graph_def = _freeze_generator(sess, ['x_melspec'], ['gen_magspec'])
+
+  frozen_fp = os.path.join(args.train_dir, 'infer.pb')
+  with tf.gfile.GFile(frozen_fp, 'wb') as f:
+    f.write(graph_def.SerializeToString())
+  print('Froze generator from {} (step {}, {} ops) to {}'.format(
+    ckpt_fp, _step, len(graph_def.node), frozen_fp))
+
+
+def _calibration_examples(fps, model, args, n):
+  # [n, subseq_len, 513, 1] generator inputs (inverted mel) and targets
+  from advoc.audioio import decode_audio
+  from advoc.vocoder import chunk_spectrogram
+
+  spectral = SpectralUtil(n_mels = model.n_mels, fs = model.audio_fs)
+
+  fps = list(fps)
+  np.random.RandomState(0).shuffle(fps)
+  xs, targets = [], []
+  for fp in fps:
+    if len(xs) >= n:
+      break
+    _, wave = decode_audio(
+      fp,
+      fs=model.audio_fs,
+      mono=True,
+      normalize=args.data_normalize,
+      fastwav=args.data_fastwav)
+    X_mag = np.abs(advoc.spectral.stft(wave, 1024, 256))[:, :, 0].astype(np.float32)
+    X_mel = np.dot(X_mag, spectral.meltrans_np.T)
+    X_inv = np.dot(X_mel, spectral.invmeltrans_np.T).astype(np.float32)
+    xs.extend(chunk_spectrogram(X_inv[:, :, np.newaxis], model.subseq_len))
+    targets.extend(chunk_spectrogram(X_mag[:, :, np.newaxis], model.subseq_len))
+
+  if len(xs) == 0:
+    raise ValueError('Found no audio to calibrate on')
+  return np.stack(xs[:n])[:, np.newaxis], np.stack(targets[:n])[:, np.newaxis]
+
+
+def quantize(fps, args):
+  if args.model_type == "regular":
+    model = Advoc(Modes.INFER)
+  elif args.model_type == "small":
+    model = AdvocSmall(Modes.INFER)
+  else:
+    raise NotImplementedError()
+
+  model, summary = override_model_attrs(model, args.model_overrides)
+  model.audio_fs = args.data_sample_rate
+  # Quantized outputs are compared to float32 outputs
+  model.infer_dropout = False
+
+  print('-' * 80)
+  print(summary)
+  print('-' * 80)
+
+  if model.generator_type != "pix2pix":
+    raise NotImplementedError('Can only quantize fully convolutional generator')
+
+  ckpt_fp = args.export_ckpt_fp
+  if ckpt_fp is None:
+    ckpt_fp = tf.train.latest_checkpoint(args.train_dir)
+  if ckpt_fp is None:
+    raise ValueError('No checkpoint found')
+
+  # Converters require a static input shape (one chunk)
+  input_shape = [1, model.subseq_len, 513, 1]
+  x_magspec = tf.placeholder(tf.float32, input_shape, name='x_magspec')
+  with tf.variable_scope("generator") as vs:
+    gen_magspec = model.build_generator(x_magspec)
+    G_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=vs.name)
+  gen_magspec = tf.identity(gen_magspec, name='gen_magspec')
+  saver = tf.train.Saver(var_list=G_vars)
+
+  with tf.Session() as sess:
+    saver.restore(sess, ckpt_fp)
+    graph_def = _freeze_generator(sess, ['x_magspec'], ['gen_magspec'])
+
+  # Half of the examples calibrate activation ranges, half measure error
+  xs, targets = _calibration_examples(fps, model, args, 2 * args.quantize_nexamples)
+  calib_xs = xs[:args.quantize_nexamples]
+  eval_xs, eval_targets = xs[args.quantize_nexamples:], targets[args.quantize_nexamples:]
+  if len(eval_xs) == 0:
+    raise ValueError('Only {} chunks found, none left to evaluate on after calibrating (lower --quantize_nexamples)'.format(len(xs)))
+  print('Calibrating on {} and evaluating on {} chunks'.format(len(calib_xs), len(eval_xs)))
+
+  out_dir = os.path.join(args.train_dir, 'quantized')
+  if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+  float32_fp = os.path.join(out_dir, 'infer_float32.pb')
+  with tf.gfile.GFile(float32_fp, 'wb') as f:
+    f.write(graph_def.SerializeToString())
+
+  def converter():
+    return tf.lite.TFLiteConverter.from_frozen_graph(
+      float32_fp, ['x_magspec'], ['gen_magspec'], {'x_magspec': input_shape})
+
+  # Conversion options vary across TensorFlow versions
+  variants = [('float32', float32_fp)]
+
+  c = converter()
+  if hasattr(c, 'target_spec') and hasattr(tf.lite, 'constants') and hasattr(tf.lite.constants, 'FLOAT16'):
+    c.optimizations = [tf.lite.Optimize.DEFAULT]
+    c.target_spec.supported_types = [tf.lite.constants.FLOAT16]
+    float16_fp = os.path.join(out_dir, 'infer_float16.tflite')
+    with open(float16_fp, 'wb') as f:
+      f.write(c.convert())
+  else:
+    print('TFLite float16 conversion unavailable, storing float16 weights in GraphDef')
+    float16_fp = os.path.join(out_dir, 'infer_float16.pb')
+    with tf.gfile.GFile(float16_fp, 'wb') as f:
+      f.write(float16_weights_graph_def(graph_def).SerializeToString())
+  variants.append(('float16', float16_fp))
+
+  c = converter()
+  if hasattr(c, 'representative_dataset'):
+    def calibration_gen():
+      for x in calib_xs:
+        yield [x]
+    c.optimizations = [tf.lite.Optimize.DEFAULT]
+    if hasattr(tf.lite, 'RepresentativeDataset'):
+      c.representative_dataset = tf.lite.RepresentativeDataset(calibration_gen)
+    else:
+      c.representative_dataset = calibration_gen
+  elif hasattr(c, 'post_training_quantize'):
+    print('TFLite activation calibration unavailable, quantizing weights only')
+    c.post_training_quantize = True
+  else:
+    raise NotImplementedError('TFLite quantization unavailable')
+  int8_fp = os.path.join(out_dir, 'infer_int8.tflite')
+  with open(int8_fp, 'wb') as f:
+    f.write(c.convert())
+  variants.append(('int8', int8_fp))
+
+  def run_graph_def(fp):
+    _graph_def = tf.GraphDef()
+    with tf.gfile.GFile(fp, 'rb') as f:
+      _graph_def.ParseFromString(f.read())
+    with tf.Graph().as_default() as graph:
+      tf.import_graph_def(_graph_def, name='')
+      with tf.Session(graph=graph) as sess:
+        x = graph.get_tensor_by_name('x_magspec:0')
+        y = graph.get_tensor_by_name('gen_magspec:0')
+        sess.run(y, {x: eval_xs[0]})
+        start = time.time()
+        ys = [sess.run(y, {x: _x}) for _x in eval_xs]
+        return ys, (time.time() - start) / len(eval_xs)
+
+  def run_tflite(fp):
+    interpreter = tf.lite.Interpreter(model_path=fp)
+    interpreter.allocate_tensors()
+    x = interpreter.get_input_details()[0]['index']
+    y = interpreter.get_output_details()[0]['index']
+    ys = []
+    start = time.time()
+    for _x in eval_xs:
+      interpreter.set_tensor(x, _x)
+      interpreter.invoke()
+      ys.append(np.copy(interpreter.get_tensor(y)))
+    return ys, (time.time() - start) / len(eval_xs)
+
+  float32_ys = None
+  print(','.join(['variant', 'size_mb', 'latency_ms', 'l1_vs_float32', 'l1_vs_target']))
+  for name, fp in variants:
+    if fp.endswith('.tflite'):
+      ys, latency = run_tflite(fp)
+    else:
+      ys, latency = run_graph_def(fp)
+    if float32_ys is None:
+      float32_ys = ys
+    l1_float32 = np.mean([np.mean(np.abs(y - y_ref)) for y, y_ref in zip(ys, float32_ys)])
+    l1_target = np.mean([np.mean(np.abs(y - t)) for y, t in zip(ys, eval_targets)])
+    print('{},{:.2f},{:.2f},{:.6f},{:.6f}'.format(
+      name,
+      os.path.getsize(fp) / float(1 << 20),
+      latency * 1000.,
+      l1_float32,
+      l1_target))
+
+
+def benchmark(args):
+  # Compares training step time (on CPU) and short-run convergence on a
+  # fixed synthetic batch across precision/XLA modes
+  np.random.seed(0)
+  modes = args.benchmark_modes.split(';')
+
+  print(','.join(['mode', 'ms_per_step', 'gen_loss_L1_first', 'gen_loss_L1_last', 'disc_loss_last']))
+  for mode in modes:
+    precision, _, xla = mode.partition('+')
+    if xla not in ['', 'xla']:
+      raise ValueError('Unknown mode {}'.format(mode))
+
+    with tf.Graph().as_default():
+      tf.set_random_seed(0)
+      if args.model_type == "regular":
+        model = Advoc(Modes.TRAIN)
+      elif args.model_type == "small":
+        model = AdvocSmall(Modes.TRAIN)
+      else:
+        raise NotImplementedError()
+      model, _ = override_model_attrs(model, args.model_overrides)
+      model.train_precision = precision
+      model.train_xla = xla == 'xla'
+
+      x_magspec = tf.constant(np.random.uniform(
+        0., 1., size=[model.train_batch_size * model.train_batches_per_step(), model.subseq_len, 513, 1]).astype(np.float32))
+      spectral = SpectralUtil(n_mels = model.n_mels, fs = model.audio_fs)
+      x_melspec = spectral.mag_to_mel_linear_spec(x_magspec)
+      x_inverted_magspec = spectral.mel_linear_to_mag_spec(x_melspec, transform = 'inverse')
+      model(x_inverted_magspec, x_magspec, None, x_melspec)
+
+      config = tf.ConfigProto(device_count={'GPU': 0})
+      with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        losses = []
+        # First step includes compilation
+        for i in range(args.benchmark_nsteps + 1):
+          if i == 1:
+            start = time.time()
+          # Losses are fetched with the step (they depend on the D update)
+          _, _gen_loss_L1, _discrim_loss = sess.run(
+              [model.train_op, model.gen_loss_L1, model.discrim_loss])
+          losses.append((_gen_loss_L1, _discrim_loss))
+        elapsed = time.time() - start
+
+    print('{},{:.1f},{:.6f},{:.6f},{:.6f}'.format(
+      mode,
+      1000. * elapsed / args.benchmark_nsteps,
+      losses[0][0],
+      losses[-1][0],
+      losses[-1][1]))
+
 
 if __name__ == '__main__':
   from argparse import ArgumentParser
   import glob
   import os
+  import sys
 
   parser = ArgumentParser()
 
-  parser.add_argument('mode', type=str, choices=['train', 'eval', 'infer'])
+  parser.add_argument('mode', type=str, choices=['train', 'eval', 'infer', 'export', 'quantize', 'benchmark'])
   parser.add_argument('train_dir', type=str)
   parser.add_argument('--data_cfg', type=str, help='Path to dataset configuration')
   parser.add_argument('--model_type', type=str, choices=['regular', 'small'])
-  parser.add_argument('--data_dir', type=str, required=True)
+  parser.add_argument('--data_dir', type=str)
+  parser.add_argument('--data_manifest', type=str,
+      help='If set, read audio file paths from this manifest (from scripts/data_split.py) instead of scanning --data_dir')
+  parser.add_argument('--data_shuffle_buffer_size', type=int)
+  parser.add_argument('--data_shuffle_compact_dtype', type=str, choices=['int16', 'float16'],
+      help='If set, shuffle compact audio slices and extract features after shuffling')
+  parser.add_argument('--data_num_shards', type=int,
+      help='Number of data-parallel workers splitting the training files')
+  parser.add_argument('--data_shard_index', type=int,
+      help='Index of this worker in [0, data_num_shards)')
+  parser.add_argument('--data_cache_mb', type=float,
+      help='If set, cache decoded audio in RAM up to this many megabytes')
+  parser.add_argument('--data_cache_spill_dir', type=str,
+      help='If set, spill examples evicted from the RAM cache to this local directory')
+  parser.add_argument('--data_cache_spill_mb', type=float,
+      help='Maximum size of the spill directory in megabytes')
+  parser.add_argument('--data_cache_features', action='store_true', dest='data_cache_features',
+      help='If set, cache extracted features alongside decoded audio')
+  parser.add_argument('--data_stats', action='store_true', dest='data_stats',
+      help='If set, summarize per-stage loader latency, throughput and queue depth')
   parser.add_argument('--model_overrides', type=str)
   parser.add_argument('--train_ckpt_every_nsecs', type=int)
+  parser.add_argument('--train_num_replicas', type=int,
+      help='Number of data-parallel replicas (defaults to all GPUs, or all CPU devices if none)')
+  parser.add_argument('--train_num_cpu_devices', type=int,
+      help='Number of CPU devices to expose to the session (for CPU replicas)')
+  parser.add_argument('--train_replica_batch_size', type=int,
+      help='If set, per-replica batch size (global batch size is this times replicas)')
   parser.add_argument('--max_steps', type=int)
   parser.add_argument('--infer_batch_size', type=int)
   parser.add_argument('--train_summary_every_nsecs', type=int)
+  parser.add_argument('--train_summary_x_wav', action='store_true', dest='train_summary_x_wav',
+      help='If set, loads target waveforms alongside features to summarize them')
   parser.add_argument('--eval_dataset_name', type=str)
+  parser.add_argument('--eval_backlog', type=int,
+      help='Maximum number of pending checkpoints to evaluate (older ones are skipped)')
   parser.add_argument('--eval_wavenet_meta_fp', type=str)
   parser.add_argument('--eval_wavenet_ckpt_fp', type=str)
   parser.add_argument('--infer_dataset_name', type=str)
   parser.add_argument('--infer_ckpt_path', type=str)
+  parser.add_argument('--export_ckpt_fp', type=str,
+      help='Checkpoint to freeze into the exported graph (defaults to latest)')
+  parser.add_argument('--quantize_nexamples', type=int,
+      help='Number of chunks to calibrate on (and as many to measure error on)')
+  parser.add_argument('--benchmark_modes', type=str,
+      help='Semicolon-separated list of training modes to benchmark (precision[+xla])')
+  parser.add_argument('--benchmark_nsteps', type=int,
+      help='Number of timed training steps per mode')
 
   parser.set_defaults(
       mode=None,
       train_dir=None,
       model_type="regular",
       data_dir=None,
+      data_manifest=None,
+      data_shuffle_buffer_size=512,
+      data_shuffle_compact_dtype=None,
+      data_num_shards=1,
+      data_shard_index=0,
+      data_cache_mb=None,
+      data_cache_spill_dir=None,
+      data_cache_spill_mb=None,
+      data_cache_features=False,
+      data_stats=False,
       model_overrides=None,
       train_ckpt_every_nsecs=360,
+      train_num_replicas=None,
+      train_num_cpu_devices=1,
+      train_replica_batch_size=None,
       train_summary_every_nsecs=60,
+      train_summary_x_wav=False,
       max_steps=100000,
       infer_batch_size=1,
       eval_dataset_name=None,
+      eval_backlog=1,
       eval_wavenet_meta_fp=None,
       eval_wavenet_ckpt_fp=None,
       infer_dataset_name=None,
-      infer_ckpt_path=None
+      infer_ckpt_path=None,
+      export_ckpt_fp=None,
+      quantize_nexamples=64,
+      benchmark_modes='float32;float32+xla;float16;float16+xla',
+      benchmark_nsteps=10
       )
 
   args = parser.parse_args()
 
+  if args.mode == 'benchmark':
+    benchmark(args)
+    sys.exit()
+
+  if args.data_cfg is None:
+    parser.error('--data_cfg is required for {}'.format(args.mode))
   with open(args.data_cfg, 'r') as f:
     for l in f.read().strip().splitlines():
       k, v = l.split(',')
@@ -381,11 +909,24 @@ if __name__ == '__main__':
         v = float(v)
       setattr(args, 'data_' + k, v)
 
+  if args.mode == 'export':
+    export(args)
+    sys.exit()
+
+  if args.data_dir is None and args.data_manifest is None:
+    parser.error('--data_dir or --data_manifest is required for {}'.format(args.mode))
+  if args.mode == 'quantize' and args.quantize_nexamples < 1:
+    parser.error('--quantize_nexamples must be positive')
+
   if not os.path.isdir(args.train_dir):
     os.makedirs(args.train_dir)
 
-  fps = glob.glob(os.path.join(args.data_dir, '*'))
-  print('Found {} audio files'.format(len(fps)))
+  if args.data_manifest is not None:
+    fps = read_manifest_fps(args.data_manifest)
+    print('Read {} audio files from {}'.format(len(fps), args.data_manifest))
+  else:
+    fps = glob.glob(os.path.join(args.data_dir, '*'))
+    print('Found {} audio files'.format(len(fps)))
 
   if args.mode == 'train':
     train(fps, args)
@@ -393,6 +934,8 @@ if __name__ == '__main__':
     eval(fps, args)
   elif args.mode == 'infer':
     infer(fps, args)
+  elif args.mode == 'quantize':
+    quantize(fps, args)
   else:
     raise NotImplementedError()
 
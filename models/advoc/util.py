@@ -18,3 +18,59 @@ def override_model_attrs(model, overrides):
   ])
 
   return model, summary
+
+
+def float16_weights_graph_def(graph_def, min_nelements=1024):
+  """Stores large float32 constants of a frozen graph as float16.
+
+  Each such constant is replaced by a float16 constant of the same value and a
+  cast back to float32 under the original name, so the graph interface and
+  computation precision are unchanged while the weights take half the space.
+  """
+  import numpy as np
+  import tensorflow as tf
+
+  float16_graph_def = tf.GraphDef()
+  float16_graph_def.versions.CopyFrom(graph_def.versions)
+  float16_graph_def.library.CopyFrom(graph_def.library)
+
+  for node in graph_def.node:
+    if node.op == 'Const' and node.attr['dtype'].type == tf.float32.as_datatype_enum:
+      value = tf.make_ndarray(node.attr['value'].tensor)
+      if value.size >= min_nelements:
+        weights = float16_graph_def.node.add()
+        weights.op = 'Const'
+        weights.name = node.name + '_float16'
+        weights.attr['dtype'].type = tf.float16.as_datatype_enum
+        weights.attr['value'].tensor.CopyFrom(
+          tf.make_tensor_proto(value.astype(np.float16)))
+
+        cast = float16_graph_def.node.add()
+        cast.op = 'Cast'
+        cast.name = node.name
+        cast.input.append(weights.name)
+        cast.attr['SrcT'].type = tf.float16.as_datatype_enum
+        cast.attr['DstT'].type = tf.float32.as_datatype_enum
+        continue
+
+    float16_graph_def.node.add().CopyFrom(node)
+
+  return float16_graph_def
+
+
+def average_gradients(tower_grads):
+  """Averages (grad, var) lists computed by each data-parallel replica."""
+  import tensorflow as tf
+
+  if len(tower_grads) == 1:
+    return tower_grads[0]
+
+  averaged = []
+  for grads_and_vars in zip(*tower_grads):
+    var = grads_and_vars[0][1]
+    grads = [g for g, _ in grads_and_vars if g is not None]
+    if len(grads) == 0:
+      averaged.append((None, var))
+    else:
+      averaged.append((tf.add_n(grads) / len(grads), var))
+  return averaged
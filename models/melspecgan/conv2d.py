@@ -1,7 +1,9 @@
 import tensorflow as tf
 
 
-def dense_layer(x, out_dim, stddev=0.02, dtype=tf.float32):
+def dense_layer(x, out_dim, stddev=0.02, dtype=None):
+  # Variables default to the input dtype (e.g. float16 with a custom getter)
+  dtype = x.dtype.base_dtype if dtype is None else dtype
   _, in_dim = x.get_shape().as_list()
 
   W = tf.get_variable('W', [in_dim, out_dim], dtype=dtype,
@@ -22,7 +24,8 @@ def conv2d_transpose_layer(
     stride_h=2,
     stride_w=2,
     stddev=0.02,
-    dtype=tf.float32):
+    dtype=None):
+  dtype = x.dtype.base_dtype if dtype is None else dtype
   try:
     batch_size = int(x.get_shape()[0])
   except:
@@ -60,7 +63,8 @@ def conv2d_layer(
     stride_h=2,
     stride_w=2,
     stddev=0.02,
-    dtype=tf.float32):
+    dtype=None):
+  dtype = x.dtype.base_dtype if dtype is None else dtype
   try:
     batch_size = int(x.get_shape()[0])
   except:
@@ -143,7 +147,8 @@ class MelspecGANGenerator(object):
     if training and self.batchnorm:
       update_ops = tf.get_collection(
           tf.GraphKeys.UPDATE_OPS, scope=tf.get_variable_scope().name)
-      assert len(update_ops) == 8
+      # Includes the update ops of earlier calls when G is reused
+      assert len(update_ops) % 8 == 0
       with tf.control_dependencies(update_ops):
         x = tf.identity(x)
 
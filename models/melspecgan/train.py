@@ -1,3 +1,4 @@
+from functools import partial
 import pickle
 import time
 
@@ -5,153 +6,281 @@ import numpy as np
 import tensorflow as tf
 
 from advoc.audioio import save_as_wav
+from advoc.cache import ExampleCache
+from advoc.checkpoint import CheckpointWatcher
 from advoc.loader import decode_extract_and_batch
+from advoc.manifest import read_manifest_fps
 from advoc.spectral import r9y9_melspec_to_waveform
+from advoc.summary import AsyncSummaryHook
+from advoc.util import compute_scope, loss_scale_optimizer
 from conv2d import MelspecGANGenerator, MelspecGANDiscriminator
-from util import feats_to_uint8_img, feats_to_approx_audio, feats_norm, feats_denorm
+from util import feats_to_uint8_img, feats_to_approx_waveform, feats_norm, feats_denorm
 
 TRAIN_BATCH_SIZE = 64
 TRAIN_LOSS = 'wgangp'
+TRAIN_DISC_UPDATES_PER_GENR = {'dcgan': 1, 'wgangp': 5}[TRAIN_LOSS]
 Z_DIM = 100
 
+def _create_train_ops(xs, args):
+  # Returns a single op running one D update per real batch in xs followed by
+  # a G update, and the G update's generated features. Updates are chained with control dependencies and variables
+  # are resource variables, so each update reads the weights written by the
+  # previous one.
+  compute_dtype = tf.as_dtype(args.train_precision)
+  G = MelspecGANGenerator()
+  D = MelspecGANDiscriminator()
+
+  def generate():
+    z = tf.random.normal([TRAIN_BATCH_SIZE, Z_DIM], dtype=tf.float32)
+    with compute_scope('G', args.train_precision, args.train_xla, reuse=tf.AUTO_REUSE):
+      G_z = G(tf.cast(z, compute_dtype), training=True)
+    return tf.cast(G_z, tf.float32)
+
+  def discriminate(x):
+    with compute_scope('D', args.train_precision, args.train_xla, reuse=tf.AUTO_REUSE):
+      D_x = D(tf.cast(x, compute_dtype), training=True)
+    return tf.cast(D_x, tf.float32)
+
+  def create_D_loss(x, G_z, summarize):
+    with tf.name_scope('D_x'):
+      D_x = discriminate(x)
+    with tf.name_scope('D_G_z'):
+      D_G_z = discriminate(G_z)
+
+    if TRAIN_LOSS == 'dcgan':
+      fake = tf.zeros([TRAIN_BATCH_SIZE], dtype=tf.float32)
+      real = tf.ones([TRAIN_BATCH_SIZE], dtype=tf.float32)
+
+      D_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
+        logits=D_G_z,
+        labels=fake
+      ))
+      D_loss += tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
+        logits=D_x,
+        labels=real
+      ))
+
+      D_loss /= 2.
+      return D_loss
+    elif TRAIN_LOSS == 'wgangp':
+      D_loss = tf.reduce_mean(D_G_z) - tf.reduce_mean(D_x)
+
+      alpha = tf.random_uniform(shape=[TRAIN_BATCH_SIZE, 1, 1, 1], minval=0., maxval=1.)
+      differences = G_z - x
+      interpolates = x + (alpha * differences)
+      with tf.name_scope('D_interp'):
+        D_interp = discriminate(interpolates)
+
+      LAMBDA = 10
+      # Input gradients are scaled to stay representable in float16
+      gp_scale = args.train_gp_loss_scale if args.train_precision == 'float16' else 1.
+      gradients = tf.gradients(D_interp * gp_scale, [interpolates])[0] / gp_scale
+      slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1, 2, 3]))
+      gradient_penalty = tf.reduce_mean((slopes - 1.) ** 2.)
+      D_loss += LAMBDA * gradient_penalty
+
+      if summarize:
+        tf.summary.scalar('gradient_penalty', gradient_penalty)
+        tf.summary.scalar('slopes_mean', tf.reduce_mean(slopes))
+      return D_loss
+    else:
+      raise ValueError()
+
+  def create_G_loss(G_z):
+    with tf.name_scope('D_G_z'):
+      D_G_z = discriminate(G_z)
+
+    if TRAIN_LOSS == 'dcgan':
+      real = tf.ones([TRAIN_BATCH_SIZE], dtype=tf.float32)
+
+      G_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
+        logits=D_G_z,
+        labels=real
+      ))
+    elif TRAIN_LOSS == 'wgangp':
+      G_loss = -tf.reduce_mean(D_G_z)
+    else:
+      raise ValueError()
+
+    return G_loss
+
+  # Create opt
+  if TRAIN_LOSS == 'dcgan':
+    G_opt = tf.train.AdamOptimizer(
+        learning_rate=2e-4,
+        beta1=0.5)
+    D_opt = tf.train.AdamOptimizer(
+        learning_rate=2e-4,
+        beta1=0.5)
+  elif TRAIN_LOSS == 'wgangp':
+    # TODO: some igul code uses beta1=0.
+    G_opt = tf.train.AdamOptimizer(
+        learning_rate=1e-4,
+        beta1=0.5,
+        beta2=0.9)
+    D_opt = tf.train.AdamOptimizer(
+        learning_rate=1e-4,
+        beta1=0.5,
+        beta2=0.9)
+  else:
+    raise ValueError()
+
+  with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+    if args.train_precision == 'float16':
+      loss_scale = None if args.train_loss_scale == 'none' else args.train_loss_scale
+      with tf.variable_scope('G_loss_scale'):
+        G_opt, G_loss_scale = loss_scale_optimizer(G_opt, loss_scale)
+      with tf.variable_scope('D_loss_scale'):
+        D_opt, D_loss_scale = loss_scale_optimizer(D_opt, loss_scale)
+      if loss_scale is not None:
+        tf.summary.scalar('G_loss_scale', G_loss_scale)
+        tf.summary.scalar('D_loss_scale', D_loss_scale)
+
+    # D updates
+    train_op = tf.no_op()
+    for i, x in enumerate(xs):
+      # G is built outside of name scopes so that its batchnorm update ops
+      # stay in the G scope
+      G_z = generate()
+      with tf.control_dependencies([train_op]), tf.name_scope('D_update_{}'.format(i)):
+        D_loss = create_D_loss(x, G_z, summarize=i == len(xs) - 1)
+        D_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='D')
+        train_op = D_opt.minimize(D_loss, var_list=D_vars)
+
+    # G update
+    G_z = generate()
+    with tf.control_dependencies([train_op]), tf.name_scope('G_update'):
+      G_loss = create_G_loss(G_z)
+      G_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='G')
+      train_op = G_opt.minimize(G_loss, var_list=G_vars,
+          global_step=tf.train.get_or_create_global_step())
+
+  # Summarize G_z (inverted audio is summarized asynchronously)
+  tf.summary.image('G_z', feats_to_uint8_img(feats_denorm(G_z)))
+
+  tf.summary.scalar('G_loss', G_loss)
+  tf.summary.scalar('D_loss', D_loss)
+
+  return train_op, G_z, G_loss, D_loss
+
+
 def train(fps, args):
   # Load data
+  cache = None
+  if args.data_cache_mb is not None:
+    cache = ExampleCache(
+        int(args.data_cache_mb * (1 << 20)),
+        spill_dir=args.data_cache_spill_dir,
+        spill_max_nbytes=None if args.data_cache_spill_mb is None else int(args.data_cache_spill_mb * (1 << 20)))
+
+  stats_aggregator = None
+  if args.data_stats:
+    stats_aggregator = tf.data.experimental.StatsAggregator()
+
+  # Each loader batch holds the batches of a whole training iteration.
+  # Prefetch is counted in batches, so it is scaled down to buffer as many
+  # slices as one batch per D update would
   with tf.name_scope('loader'):
     x, x_audio = decode_extract_and_batch(
         fps=fps,
-        batch_size=TRAIN_BATCH_SIZE,
+        batch_size=TRAIN_BATCH_SIZE * TRAIN_DISC_UPDATES_PER_GENR,
         slice_len=64,
         audio_fs=args.data_sample_rate,
         audio_mono=True,
         audio_normalize=args.data_normalize,
         decode_fastwav=args.data_fastwav,
         decode_parallel_calls=8,
+        cache=cache,
+        cache_features=args.data_cache_features,
         extract_type='melspec',
         extract_nfft=1024,
         extract_nhop=256,
         extract_parallel_calls=8,
         repeat=True,
         shuffle=True,
-        shuffle_buffer_size=512,
+        shuffle_buffer_size=args.data_shuffle_buffer_size,
+        shuffle_compact_dtype=args.data_shuffle_compact_dtype,
+        num_shards=args.data_num_shards,
+        shard_index=args.data_shard_index,
         slice_first_only=args.data_slice_first_only,
         slice_randomize_offset=args.data_slice_randomize_offset,
         slice_overlap_ratio=args.data_slice_overlap_ratio,
         slice_pad_end=args.data_slice_pad_end,
-        prefetch_size=TRAIN_BATCH_SIZE * 8,
-        prefetch_gpu_num=args.data_prefetch_gpu_num)
+        prefetch_size=TRAIN_BATCH_SIZE * 8 // TRAIN_DISC_UPDATES_PER_GENR,
+        prefetch_gpu_num=args.data_prefetch_gpu_num,
+        stats_aggregator=stats_aggregator)
     x = feats_norm(x)
 
+    if stats_aggregator is not None:
+      tf.add_to_collection(tf.GraphKeys.SUMMARIES, stats_aggregator.get_summary())
+
+    if cache is not None:
+      tf.summary.scalar('cache_hit_rate', tf.py_func(
+        lambda: np.float32(cache.hit_rate), [], tf.float32, stateful=True))
+
   # Data summaries
   tf.summary.audio('x_audio', x_audio[:, :, 0], args.data_sample_rate)
   tf.summary.image('x', feats_to_uint8_img(feats_denorm(x)))
-  tf.summary.audio('x_inv_audio',
-      feats_to_approx_audio(feats_denorm(x), args.data_sample_rate, 16384, n=3)[:, :, 0], args.data_sample_rate)
 
-  # Make z vector
-  z = tf.random.normal([TRAIN_BATCH_SIZE, Z_DIM], dtype=tf.float32)
+  # One real batch per D update
+  train_op, G_z, _, _ = _create_train_ops(tf.split(x, TRAIN_DISC_UPDATES_PER_GENR), args)
 
-  # Make generator
-  with tf.variable_scope('G'):
-    G = MelspecGANGenerator()
-    G_z = G(z, training=True)
-  G_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='G')
-
-  # Summarize G_z
-  tf.summary.image('G_z', feats_to_uint8_img(feats_denorm(G_z)))
-  tf.summary.audio('G_z_inv_audio',
-      feats_to_approx_audio(feats_denorm(G_z), args.data_sample_rate, 16384, n=3)[:, :, 0], args.data_sample_rate)
-
-  # Make real discriminator
-  D = MelspecGANDiscriminator()
-  with tf.name_scope('D_x'), tf.variable_scope('D'):
-    D_x = D(x, training=True)
-  D_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='D')
-
-  # Make fake discriminator
-  with tf.name_scope('D_G_z'), tf.variable_scope('D', reuse=True):
-    D_G_z = D(G_z, training=True)
-
-  # Create loss
-  num_disc_updates_per_genr = 1
-  if TRAIN_LOSS == 'dcgan':
-    fake = tf.zeros([TRAIN_BATCH_SIZE], dtype=tf.float32)
-    real = tf.ones([TRAIN_BATCH_SIZE], dtype=tf.float32)
-
-    G_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
-      logits=D_G_z,
-      labels=real
-    ))
-
-    D_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
-      logits=D_G_z,
-      labels=fake
-    ))
-    D_loss += tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(
-      logits=D_x,
-      labels=real
-    ))
-
-    D_loss /= 2.
-  elif TRAIN_LOSS == 'wgangp':
-    G_loss = -tf.reduce_mean(D_G_z)
-    D_loss = tf.reduce_mean(D_G_z) - tf.reduce_mean(D_x)
-
-    alpha = tf.random_uniform(shape=[TRAIN_BATCH_SIZE, 1, 1, 1], minval=0., maxval=1.)
-    differences = G_z - x
-    interpolates = x + (alpha * differences)
-    with tf.name_scope('D_interp'), tf.variable_scope('D', reuse=True):
-      D_interp = D(interpolates, training=True)
-
-    LAMBDA = 10
-    gradients = tf.gradients(D_interp, [interpolates])[0]
-    slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1, 2, 3]))
-    gradient_penalty = tf.reduce_mean((slopes - 1.) ** 2.)
-    D_loss += LAMBDA * gradient_penalty
-
-    num_disc_updates_per_genr = 5
-  else:
-    raise ValueError()
-
-  tf.summary.scalar('G_loss', G_loss)
-  tf.summary.scalar('D_loss', D_loss)
-
-  # Create opt
-  if TRAIN_LOSS == 'dcgan':
-    G_opt = tf.train.AdamOptimizer(
-        learning_rate=2e-4,
-        beta1=0.5)
-    D_opt = tf.train.AdamOptimizer(
-        learning_rate=2e-4,
-        beta1=0.5)
-  elif TRAIN_LOSS == 'wgangp':
-    # TODO: some igul code uses beta1=0.
-    G_opt = tf.train.AdamOptimizer(
-        learning_rate=1e-4,
-        beta1=0.5,
-        beta2=0.9)
-    D_opt = tf.train.AdamOptimizer(
-        learning_rate=1e-4,
-        beta1=0.5,
-        beta2=0.9)
-  else:
-    raise ValueError()
-
-  # Create training ops
-  G_train_op = G_opt.minimize(G_loss, var_list=G_vars,
-      global_step=tf.train.get_or_create_global_step())
-  D_train_op = D_opt.minimize(D_loss, var_list=D_vars)
+  # Approximate inversion runs in a background process
+  invert_fn = partial(feats_to_approx_waveform, fs=args.data_sample_rate, waveform_len=16384)
+  summary_hook = AsyncSummaryHook(
+      args.train_dir,
+      audio=[('x_inv_audio', x, invert_fn), ('G_z_inv_audio', G_z, invert_fn)],
+      audio_fs=args.data_sample_rate,
+      every_n_secs=args.train_summary_every_nsecs)
 
   # Train
   with tf.train.MonitoredTrainingSession(
       checkpoint_dir=args.train_dir,
       save_checkpoint_secs=args.train_ckpt_every_nsecs,
-      save_summaries_secs=args.train_summary_every_nsecs) as sess:
+      save_summaries_secs=args.train_summary_every_nsecs,
+      hooks=[summary_hook]) as sess:
     while not sess.should_stop():
-      for i in range(num_disc_updates_per_genr):
-        sess.run(D_train_op)
-
-      sess.run(G_train_op)
-
+      sess.run(train_op)
+
+
+def benchmark(args):
+  # Compares training step time (on CPU) across precision/XLA modes on
+  # random normalized features
+  np.random.seed(0)
+  modes = args.benchmark_modes.split(';')
+
+  print(','.join(['mode', 'ms_per_step', 'G_loss_first', 'G_loss_last', 'D_loss_last']))
+  for mode in modes:
+    precision, _, xla = mode.partition('+')
+    if xla not in ['', 'xla']:
+      raise ValueError('Unknown mode {}'.format(mode))
+    args.train_precision = precision
+    args.train_xla = xla == 'xla'
+
+    with tf.Graph().as_default():
+      tf.set_random_seed(0)
+      x = tf.constant(np.random.uniform(
+        -1., 1., size=[TRAIN_BATCH_SIZE * TRAIN_DISC_UPDATES_PER_GENR, 64, 80, 1]).astype(np.float32))
+      train_op, _, G_loss, D_loss = _create_train_ops(tf.split(x, TRAIN_DISC_UPDATES_PER_GENR), args)
+
+      config = tf.ConfigProto(device_count={'GPU': 0})
+      with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        losses = []
+        # First step includes compilation
+        for i in range(args.benchmark_nsteps + 1):
+          if i == 1:
+            start = time.time()
+          _, _G_loss, _D_loss = sess.run([train_op, G_loss, D_loss])
+          losses.append((_G_loss, _D_loss))
+        elapsed = time.time() - start
+
+    print('{},{:.1f},{:.6f},{:.6f},{:.6f}'.format(
+      mode,
+      1000. * elapsed / args.benchmark_nsteps,
+      losses[0][0],
+      losses[-1][0],
+      losses[-1][1]))
 
 def infer(args):
   zgen_n = tf.placeholder(tf.int32, [], name='samp_z_n')
@@ -227,68 +356,68 @@ def incept(args):
     summaries = tf.summary.merge(summaries)
   summary_writer = tf.summary.FileWriter(incept_dir)
 
-  # Loop, waiting for checkpoints
-  ckpt_fp = None
-  _best_score = 0.
-  while True:
-    latest_ckpt_fp = tf.train.latest_checkpoint(args.train_dir)
-    if latest_ckpt_fp != ckpt_fp:
-      print('Incept: {}'.format(latest_ckpt_fp))
-
-      sess = tf.Session()
+  # Score each new checkpoint
+  best_score = [0.]
 
-      gan_saver.restore(sess, latest_ckpt_fp)
+  def score(ckpt_fp):
+    print('Incept: {}'.format(ckpt_fp))
 
-      _step = sess.run(step)
+    sess = tf.Session()
 
-      _G_z_feats = []
-      for i in range(0, args.incept_n, 100):
-        _G_z_feats.append(sess.run(G_z, {z: _zs[i:i+100]}))
-      _G_z_feats = np.concatenate(_G_z_feats, axis=0)
-      _G_zs = []
-      for i, _G_z in enumerate(_G_z_feats):
-        _G_z = feats_denorm(_G_z).astype(np.float64)
-        _audio = r9y9_melspec_to_waveform(_G_z, fs=args.data_sample_rate, waveform_len=16384)
-        if i == 0:
-          out_fp = os.path.join(incept_dir, '{}.wav'.format(str(_step).zfill(9)))
-          save_as_wav(out_fp, args.data_sample_rate, _audio)
-        _G_zs.append(_audio[:, 0, 0])
+    gan_saver.restore(sess, ckpt_fp)
 
-      _preds = []
-      for i in range(0, args.incept_n, 100):
-        _preds.append(incept_sess.run(incept_preds, {incept_x: _G_zs[i:i+100]}))
-      _preds = np.concatenate(_preds, axis=0)
+    _step = sess.run(step)
 
-      # Split into k groups
-      _incept_scores = []
-      split_size = args.incept_n // args.incept_k
-      for i in range(args.incept_k):
-        _split = _preds[i * split_size:(i + 1) * split_size]
-        _kl = _split * (np.log(_split) - np.log(np.expand_dims(np.mean(_split, 0), 0)))
-        _kl = np.mean(np.sum(_kl, 1))
-        _incept_scores.append(np.exp(_kl))
+    _G_z_feats = []
+    for i in range(0, args.incept_n, 100):
+      _G_z_feats.append(sess.run(G_z, {z: _zs[i:i+100]}))
+    _G_z_feats = np.concatenate(_G_z_feats, axis=0)
+    _G_zs = []
+    for i, _G_z in enumerate(_G_z_feats):
+      _G_z = feats_denorm(_G_z).astype(np.float64)
+      _audio = r9y9_melspec_to_waveform(_G_z, fs=args.data_sample_rate, waveform_len=16384)
+      if i == 0:
+        out_fp = os.path.join(incept_dir, '{}.wav'.format(str(_step).zfill(9)))
+        save_as_wav(out_fp, args.data_sample_rate, _audio)
+      _G_zs.append(_audio[:, 0, 0])
 
-      _incept_mean, _incept_std = np.mean(_incept_scores), np.std(_incept_scores)
+    _preds = []
+    for i in range(0, args.incept_n, 100):
+      _preds.append(incept_sess.run(incept_preds, {incept_x: _G_zs[i:i+100]}))
+    _preds = np.concatenate(_preds, axis=0)
 
-      # Summarize
-      with tf.Session(graph=summary_graph) as summary_sess:
-        _summaries = summary_sess.run(summaries, {incept_mean: _incept_mean, incept_std: _incept_std})
-      summary_writer.add_summary(_summaries, _step)
+    # Split into k groups
+    _incept_scores = []
+    split_size = args.incept_n // args.incept_k
+    for i in range(args.incept_k):
+      _split = _preds[i * split_size:(i + 1) * split_size]
+      _kl = _split * (np.log(_split) - np.log(np.expand_dims(np.mean(_split, 0), 0)))
+      _kl = np.mean(np.sum(_kl, 1))
+      _incept_scores.append(np.exp(_kl))
 
-      # Save
-      if _incept_mean > _best_score:
-        gan_saver.save(sess, os.path.join(incept_dir, 'best_score'), _step)
-        _best_score = _incept_mean
+    _incept_mean, _incept_std = np.mean(_incept_scores), np.std(_incept_scores)
 
-      sess.close()
+    # Summarize
+    with tf.Session(graph=summary_graph) as summary_sess:
+      _summaries = summary_sess.run(summaries, {incept_mean: _incept_mean, incept_std: _incept_std})
+    summary_writer.add_summary(_summaries, _step)
 
-      print('Done')
+    # Save
+    if _incept_mean > best_score[0]:
+      gan_saver.save(sess, os.path.join(incept_dir, 'best_score'), _step)
+      best_score[0] = _incept_mean
 
-      ckpt_fp = latest_ckpt_fp
+    sess.close()
 
-    time.sleep(1)
+    print('Done')
 
-  incept_sess.close()
+  watcher = CheckpointWatcher(args.train_dir)
+  watcher.add_handler(score)
+  try:
+    watcher.run()
+  finally:
+    watcher.close()
+    incept_sess.close()
 
 
 if __name__ == '__main__':
@@ -298,7 +427,7 @@ if __name__ == '__main__':
 
   parser = ArgumentParser()
 
-  parser.add_argument('mode', type=str, choices=['train', 'incept'])
+  parser.add_argument('mode', type=str, choices=['train', 'incept', 'benchmark'])
   parser.add_argument('train_dir', type=str)
 
   data_args = parser.add_argument_group('Data')
@@ -306,12 +435,49 @@ if __name__ == '__main__':
           help='Path to dataset configuration')
   data_args.add_argument('--data_dir', type=str,
           help='Data directory containing *only* audio files to load')
+  data_args.add_argument('--data_manifest', type=str,
+          help='If set, read audio file paths from this manifest (from scripts/data_split.py) instead of scanning --data_dir')
   data_args.add_argument('--data_prefetch_gpu_num', type=int,
 	  help='If nonnegative, prefetch examples to this GPU (Tensorflow device num)')
+  data_args.add_argument('--data_shuffle_buffer_size', type=int,
+      help='Number of slices to buffer for shuffling')
+  data_args.add_argument('--data_shuffle_compact_dtype', type=str,
+      choices=['int16', 'float16'],
+      help='If set, shuffle compact audio slices and extract features after shuffling')
+  data_args.add_argument('--data_num_shards', type=int,
+      help='Number of data-parallel workers splitting the training files')
+  data_args.add_argument('--data_shard_index', type=int,
+      help='Index of this worker in [0, data_num_shards)')
+  data_args.add_argument('--data_cache_mb', type=float,
+      help='If set, cache decoded audio in RAM up to this many megabytes')
+  data_args.add_argument('--data_cache_spill_dir', type=str,
+      help='If set, spill examples evicted from the RAM cache to this local directory')
+  data_args.add_argument('--data_cache_spill_mb', type=float,
+      help='Maximum size of the spill directory in megabytes')
+  data_args.add_argument('--data_cache_features', action='store_true',
+      dest='data_cache_features',
+      help='If set, cache extracted features alongside decoded audio')
+  data_args.add_argument('--data_stats', action='store_true',
+      dest='data_stats',
+      help='If set, summarize per-stage loader latency, throughput and queue depth')
 
   train_args = parser.add_argument_group('Train')
   train_args.add_argument('--train_ckpt_every_nsecs', type=int)
   train_args.add_argument('--train_summary_every_nsecs', type=int)
+  train_args.add_argument('--train_precision', type=str, choices=['float32', 'float16'],
+      help='Compute dtype of G and D (variables are kept in float32)')
+  train_args.add_argument('--train_xla', action='store_true', dest='train_xla',
+      help='If set, compile G and D with XLA')
+  train_args.add_argument('--train_loss_scale', type=str,
+      help='Loss scale for float16 training ("dynamic", "none" or a number)')
+  train_args.add_argument('--train_gp_loss_scale', type=float,
+      help='Scale applied to D before computing the gradient penalty in float16')
+
+  benchmark_args = parser.add_argument_group('Benchmark')
+  benchmark_args.add_argument('--benchmark_modes', type=str,
+      help='Semicolon-separated list of training modes to benchmark (precision[+xla])')
+  benchmark_args.add_argument('--benchmark_nsteps', type=int,
+      help='Number of timed training steps per mode')
 
   incept_args = parser.add_argument_group('Incept')
   incept_args.add_argument('--incept_metagraph_fp', type=str,
@@ -328,9 +494,25 @@ if __name__ == '__main__':
       train_dir=None,
       data_cfg='../../datacfg/sc09.txt',
       data_dir=None,
+      data_manifest=None,
       data_prefetch_gpu_num=0,
+      data_shuffle_buffer_size=512,
+      data_shuffle_compact_dtype=None,
+      data_num_shards=1,
+      data_shard_index=0,
+      data_cache_mb=None,
+      data_cache_spill_dir=None,
+      data_cache_spill_mb=None,
+      data_cache_features=False,
+      data_stats=False,
       train_ckpt_every_nsecs=600,
       train_summary_every_nsecs=300,
+      train_precision='float32',
+      train_xla=False,
+      train_loss_scale='dynamic',
+      train_gp_loss_scale=1024.,
+      benchmark_modes='float32;float32+xla;float16;float16+xla',
+      benchmark_nsteps=10,
       incept_metagraph_fp='./eval/inception/infer.meta',
       incept_ckpt_fp='./eval/inception/best_acc-103005',
       incept_n=5000,
@@ -351,11 +533,18 @@ if __name__ == '__main__':
     os.makedirs(args.train_dir)
 
   if args.mode == 'train':
-    fps = glob.glob(os.path.join(args.data_dir, '*'))
+    if args.data_manifest is not None:
+      fps = read_manifest_fps(args.data_manifest)
+      data_source = args.data_manifest
+    else:
+      fps = glob.glob(os.path.join(args.data_dir, '*'))
+      data_source = args.data_dir
     if len(fps) == 0:
-      raise ValueError('Found no audio files in {}'.format(args.data_dir))
+      raise ValueError('Found no audio files in {}'.format(data_source))
     print('Found {} audio files'.format(len(fps)))
     infer(args)
     train(fps, args)
   elif args.mode == 'incept':
     incept(args)
+  elif args.mode == 'benchmark':
+    benchmark(args)
@@ -20,6 +20,12 @@ def feats_to_uint8_img(x):
   return x
 
 
+def feats_to_approx_waveform(x, fs, waveform_len):
+  # x is a single normalized example as an nd-array
+  return spectral.r9y9_melspec_to_waveform(
+      feats_denorm(x).astype(np.float64), fs=fs, waveform_len=waveform_len)
+
+
 def feats_to_approx_audio(x, fs, waveform_len, n=None):
   if n is not None:
     x = x[:n]
@@ -1,48 +1,217 @@
 # This script takes a directory of waveforms and creates a directory of spectrograms.
 
 if __name__ == '__main__':
+  import os
+  # Each worker is single-threaded so that num_workers processes use num_workers cores
+  for _var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+    os.environ.setdefault(_var, '1')
+
   from argparse import ArgumentParser
   import glob
+  import multiprocessing
+  import time
+
   import numpy as np
-  import os
   from tqdm import tqdm
 
   from advoc.audioio import decode_audio
+  from advoc.manifest import read_manifest_fps
   from advoc.spectral import waveform_to_r9y9_melspec
+  from advoc import specio
+
+  # Extraction parameters recorded in .spec headers
+  SPEC_PARAMS = {
+    'type': 'r9y9_melspec',
+    'fs': 22050,
+    'nfft': 1024,
+    'nhop': 256,
+    'mel_min': 125,
+    'mel_max': 7600,
+    'mel_num_bins': 80,
+    'norm_min_level_db': -100,
+    'norm_ref_level_db': 20
+  }
+
+  def utterance_name(wave_fp):
+    return os.path.splitext(os.path.split(wave_fp)[1])[0]
+
+  def is_valid_npy(fp):
+    # Complete .npy files are exactly as large as their header says
+    try:
+      with open(fp, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+          shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+          shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        nbytes = f.tell() + int(np.prod(shape)) * dtype.itemsize
+      return os.path.getsize(fp) == nbytes
+    except (IOError, OSError, ValueError):
+      return False
+
+  def atomic_save(fp, save_fn, *args, **kwargs):
+    tmp_fp = fp + '.tmp'
+    with open(tmp_fp, 'wb') as f:
+      save_fn(f, *args, **kwargs)
+    os.rename(tmp_fp, fp)
+
+  def featurize(wave_fp):
+    _, wave = decode_audio(
+        wave_fp,
+        fs=SPEC_PARAMS['fs'],
+        fastwav=args.data_fast_wav,
+        mono=True,
+        normalize=True)
+    return waveform_to_r9y9_melspec(wave, fs=SPEC_PARAMS['fs'])
+
+  def featurize_worker(wave_fp):
+    # Returns (name, nframes, shard entry, error). In file mode, the worker
+    # writes the spectrogram itself.
+    name = utterance_name(wave_fp)
+    try:
+      spec = featurize(wave_fp)
+    except Exception as e:
+      return name, 0, None, '{}: {}'.format(type(e).__name__, e)
+    if args.out_format == 'npy':
+      entry = spec
+      save_fn = np.save
+    else:
+      # Spectrograms are clipped to [0, 1]
+      entry = np.frombuffer(
+          specio.encode_spec(spec, args.out_format, params=SPEC_PARAMS), dtype=np.uint8)
+      save_fn = lambda f, buf: f.write(buf.tobytes())
+    if args.shard_size > 0:
+      return name, spec.shape[0], entry, None
+    atomic_save(os.path.join(args.out_dir, name + out_ext), save_fn, entry)
+    return name, spec.shape[0], None, None
 
   parser = ArgumentParser()
 
-  parser.add_argument('--wave_dir', type=str, required=True,
+  parser.add_argument('--wave_dir', type=str,
       help='Directory of audio files')
+  parser.add_argument('--wave_manifest', type=str,
+      help='If set, featurize the audio files in this manifest (from scripts/data_split.py) instead of --wave_dir')
   parser.add_argument('--out_dir', type=str, required=True,
       help='Directory for spectrograms')
   parser.add_argument('--data_fast_wav',
       action='store_true', dest='data_fast_wav',
       help='If set, provides faster loading of standard WAV files via scipy')
+  parser.add_argument('--out_format', type=str, choices=['npy'] + specio.STORAGE_DTYPES,
+      help='npy: float64 .npy files, else compact .spec files storing frames as this dtype (see advoc.specio)')
+  parser.add_argument('--num_workers', type=int,
+      help='Number of featurization processes (0 featurizes in this process)')
+  parser.add_argument('--chunksize', type=int,
+      help='Number of files sent to a worker at a time')
+  parser.add_argument('--shard_size', type=int,
+      help='If positive, write shard-NNNNN.npz files of this many spectrograms (keyed by name) instead of one file per utterance')
+  parser.add_argument('--progress_fp', type=str,
+      help='Log of completed files (defaults to out_dir/progress.txt)')
 
   parser.set_defaults(
       wave_dir=None,
+      wave_manifest=None,
       out_dir=None,
-      data_fast_wav=False)
+      data_fast_wav=False,
+      out_format='npy',
+      num_workers=multiprocessing.cpu_count(),
+      chunksize=4,
+      shard_size=0,
+      progress_fp=None)
 
   args = parser.parse_args()
+  if args.wave_dir is None and args.wave_manifest is None:
+    parser.error('--wave_dir or --wave_manifest is required')
+  out_ext = '.npy' if args.out_format == 'npy' else specio.SPEC_EXT
+  is_valid = is_valid_npy if args.out_format == 'npy' else specio.is_spec_complete
 
   if not os.path.isdir(args.out_dir):
     os.makedirs(args.out_dir)
+  progress_fp = args.progress_fp
+  if progress_fp is None:
+    progress_fp = os.path.join(args.out_dir, 'progress.txt')
 
-  wave_fps = glob.glob(os.path.join(args.wave_dir, '*'))
-  for i, wave_fp in tqdm(enumerate(wave_fps)):
-    wave_fn = os.path.splitext(os.path.split(wave_fp)[1])[0]
-    spec_fn = wave_fn + '.npy'
-    spec_fp = os.path.join(args.out_dir, spec_fn)
+  # Outputs are renamed into place once complete, so leftovers are partial
+  for fp in glob.glob(os.path.join(glob.escape(args.out_dir), '*.tmp')):
+    os.remove(fp)
 
-    _, wave = decode_audio(
-        wave_fp,
-        fs=22050,
-        fastwav=args.data_fast_wav,
-        mono=True,
-        normalize=True)
+  # Progress log lines are "<name>\t<output filename>"
+  completed = {}
+  if os.path.exists(progress_fp):
+    with open(progress_fp, 'r') as f:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) == 2:
+          completed[fields[0]] = fields[1]
+
+  if args.wave_manifest is not None:
+    wave_fps = read_manifest_fps(args.wave_manifest)
+  else:
+    wave_fps = sorted(glob.glob(os.path.join(args.wave_dir, '*')))
+  shard_idx = 0
+  if args.shard_size > 0:
+    # Shards written but not logged before an interruption are redone
+    logged_shards = set([fn for fn in completed.values() if fn.startswith('shard-')])
+    for fp in glob.glob(os.path.join(glob.escape(args.out_dir), 'shard-*.npz')):
+      if os.path.basename(fp) not in logged_shards:
+        os.remove(fp)
+    todo = [fp for fp in wave_fps
+        if utterance_name(fp) not in completed
+        or not os.path.exists(os.path.join(args.out_dir, completed[utterance_name(fp)]))]
+    shard_idx = max([int(fn[6:11]) + 1 for fn in logged_shards] + [0])
+  else:
+    todo = [fp for fp in wave_fps
+        if not is_valid(os.path.join(args.out_dir, utterance_name(fp) + out_ext))]
+  nskipped = len(wave_fps) - len(todo)
+  print('{} files, {} already featurized'.format(len(wave_fps), nskipped))
+
+  progress_f = open(progress_fp, 'a')
+  def log_completed(names, out_fn):
+    for name in names:
+      progress_f.write('{}\t{}\n'.format(name, out_fn))
+    progress_f.flush()
+
+  shard = {}
+  def write_shard():
+    global shard_idx
+    shard_fn = 'shard-{:05d}.npz'.format(shard_idx)
+    atomic_save(os.path.join(args.out_dir, shard_fn), np.savez, **shard)
+    log_completed(sorted(shard.keys()), shard_fn)
+    shard.clear()
+    shard_idx += 1
+
+  if args.num_workers > 0:
+    # Workers inherit args and the featurization functions
+    pool = multiprocessing.get_context('fork').Pool(args.num_workers)
+    results = pool.imap_unordered(featurize_worker, todo, chunksize=args.chunksize)
+  else:
+    pool = None
+    results = map(featurize_worker, todo)
+
+  start = time.time()
+  nframes = 0
+  failed = []
+  for name, nspec_frames, entry, error in tqdm(results, total=len(todo), unit='file'):
+    if error is not None:
+      failed.append((name, error))
+      continue
+    nframes += nspec_frames
+    if args.shard_size > 0:
+      shard[name] = entry
+      if len(shard) == args.shard_size:
+        write_shard()
+    else:
+      log_completed([name], name + out_ext)
+  if len(shard) > 0:
+    write_shard()
+  elapsed = time.time() - start
 
-    spec = waveform_to_r9y9_melspec(wave)
+  if pool is not None:
+    pool.close()
+    pool.join()
+  progress_f.close()
 
-    np.save(spec_fp, spec)
+  nprocessed = len(todo) - len(failed)
+  print('Featurized {} files ({} frames) in {:.1f}s ({:.1f} files/s), skipped {}, failed {}'.format(
+      nprocessed, nframes, elapsed, nprocessed / max(elapsed, 1e-6), nskipped, len(failed)))
+  for name, error in failed:
+    print('Failed {}: {}'.format(name, error))
@@ -0,0 +1,129 @@
+# This script measures loader throughput on synthetic WAV files across configurations.
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  import itertools
+  import os
+  import shutil
+  import tempfile
+  import time
+
+  import numpy as np
+  import tensorflow as tf
+
+  from advoc.audioio import save_as_wav
+  from advoc.loader import decode_extract_and_batch
+
+  parser = ArgumentParser()
+
+  parser.add_argument('--wave_dir', type=str,
+      help='Directory of WAV files (if unspecified, synthesizes fixtures)')
+  parser.add_argument('--nfiles', type=int,
+      help='Number of synthetic WAV files')
+  parser.add_argument('--duration', type=float,
+      help='Duration of synthetic WAV files in seconds')
+  parser.add_argument('--fs', type=int,
+      help='Sample rate')
+  parser.add_argument('--batch_size', type=int,
+      help='Number of slices per batch')
+  parser.add_argument('--slice_len', type=int,
+      help='Slice length (in feature timesteps)')
+  parser.add_argument('--fastwav', type=str,
+      help='Semicolon-separated list of fastwav settings to test')
+  parser.add_argument('--extract_types', type=str,
+      help='Semicolon-separated list of feature types to test')
+  parser.add_argument('--parallel_calls', type=str,
+      help='Semicolon-separated list of decode/extract thread counts to test')
+  parser.add_argument('--overlap_ratios', type=str,
+      help='Semicolon-separated list of slice overlap ratios to test')
+  parser.add_argument('--compact_dtype', type=str,
+      help='If set, shuffle compact audio of this dtype (int16 or float16)')
+
+  parser.set_defaults(
+      wave_dir=None,
+      nfiles=64,
+      duration=4.,
+      fs=22050,
+      batch_size=8,
+      slice_len=64,
+      fastwav='1;0',
+      extract_types='magspec;melspec;none',
+      parallel_calls='1;4',
+      overlap_ratios='0;0.5',
+      compact_dtype=None)
+
+  args = parser.parse_args()
+
+  tmp_dir = None
+  if args.wave_dir is None:
+    tmp_dir = tempfile.mkdtemp()
+    nsamps = int(args.duration * args.fs)
+    t = np.arange(nsamps, dtype=np.float32) / args.fs
+    for i in range(args.nfiles):
+      f0 = 100. + 10. * i
+      x = 0.5 * np.sin(2. * np.pi * f0 * t) + 0.05 * np.random.randn(nsamps)
+      x = x.astype(np.float32)[:, np.newaxis, np.newaxis]
+      save_as_wav(os.path.join(tmp_dir, '{}.wav'.format(str(i).zfill(6))), args.fs, x)
+    fps = sorted(tf.gfile.Glob(os.path.join(tmp_dir, '*.wav')))
+  else:
+    fps = sorted(tf.gfile.Glob(os.path.join(args.wave_dir, '*')))
+  print('Benchmarking on {} audio files'.format(len(fps)))
+
+  fastwavs = [bool(int(v)) for v in args.fastwav.split(';')]
+  extract_types = [None if v == 'none' else v for v in args.extract_types.split(';')]
+  parallel_calls = [int(v) for v in args.parallel_calls.split(';')]
+  overlap_ratios = [float(v) for v in args.overlap_ratios.split(';')]
+
+  print(','.join(['fastwav', 'extract_type', 'parallel_calls', 'overlap_ratio',
+    'files_per_sec', 'slices_per_sec', 'mbytes_per_sec']))
+  try:
+    for fastwav, extract_type, ncalls, overlap_ratio in itertools.product(
+        fastwavs, extract_types, parallel_calls, overlap_ratios):
+      slice_len = args.slice_len
+      if extract_type is None:
+        slice_len *= 256
+
+      with tf.Graph().as_default():
+        x_feats, x_audio = decode_extract_and_batch(
+            fps,
+            batch_size=args.batch_size,
+            slice_len=slice_len,
+            audio_fs=args.fs,
+            audio_mono=True,
+            decode_fastwav=fastwav,
+            decode_parallel_calls=ncalls,
+            extract_type=extract_type,
+            extract_parallel_calls=ncalls,
+            repeat=False,
+            shuffle=args.compact_dtype is not None,
+            shuffle_buffer_size=args.batch_size * 8,
+            shuffle_compact_dtype=args.compact_dtype,
+            slice_overlap_ratio=overlap_ratio,
+            slice_pad_end=True,
+            prefetch_size=4)
+
+        config = tf.ConfigProto(device_count={'GPU': 0})
+        with tf.Session(config=config) as sess:
+          nslices = 0
+          nbytes = 0
+          start = time.time()
+          while True:
+            try:
+              _x_feats, _x_audio = sess.run([x_feats, x_audio])
+            except tf.errors.OutOfRangeError:
+              break
+            nslices += _x_feats.shape[0]
+            nbytes += _x_feats.nbytes + _x_audio.nbytes
+          elapsed = time.time() - start
+
+      print('{},{},{},{},{:.2f},{:.2f},{:.2f}'.format(
+        int(fastwav),
+        extract_type,
+        ncalls,
+        overlap_ratio,
+        len(fps) / elapsed,
+        nslices / elapsed,
+        nbytes / elapsed / float(1 << 20)))
+  finally:
+    if tmp_dir is not None:
+      shutil.rmtree(tmp_dir)
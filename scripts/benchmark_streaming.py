@@ -0,0 +1,113 @@
+# This script measures the real-time factor and latency of streaming vocoding.
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  import time
+
+  import numpy as np
+
+  from advoc.audioio import save_as_wav
+  from advoc.spectral import create_inverse_mel_filterbank, tacotron_mel_to_mag
+  from advoc import specio
+  from advoc.vocoder import generator_accepts_melspec, load_generator, StreamingVocoder
+
+  parser = ArgumentParser()
+
+  parser.add_argument('--spec_fp', type=str,
+      help='Mel spectrogram (.npy or .spec) to stream (if unspecified, uses random frames)')
+  parser.add_argument('--out_fp', type=str,
+      help='If set, save streamed audio to this WAV file')
+  parser.add_argument('--model_ckpt', type=str,
+      help='Adversarial vocoder checkpoint')
+  parser.add_argument('--meta_fp', type=str,
+      help='Meta graph filepath (if unspecified, uses the pseudoinverse heuristic)')
+  parser.add_argument('--fs', type=int,
+      help='sampling rate')
+  parser.add_argument('--nframes', type=int,
+      help='Number of random frames to stream')
+  parser.add_argument('--subseq_len', type=int,
+      help='Number of frames per generator call')
+  parser.add_argument('--lookahead', type=int,
+      help='Number of future frames each generated frame depends on')
+  parser.add_argument('--context', type=int,
+      help='Number of past frames each generated frame depends on')
+  parser.add_argument('--frames_per_push', type=int,
+      help='Number of frames arriving at once')
+
+  parser.set_defaults(
+      spec_fp=None,
+      out_fp=None,
+      model_ckpt=None,
+      meta_fp=None,
+      fs=22050,
+      nframes=860,
+      subseq_len=256,
+      lookahead=8,
+      context=16,
+      frames_per_push=4)
+
+  args = parser.parse_args()
+
+  nfft, nhop = 1024, 256
+  inv_mel_filterbank = create_inverse_mel_filterbank(
+      args.fs, nfft, fmin=125, fmax=7600, n_mels=80)
+
+  if args.spec_fp is None:
+    X_mel = np.random.uniform(0.2, 0.8, size=[args.nframes, 80, 1]).astype(np.float32)
+  else:
+    X_mel = specio.read_spectrogram(args.spec_fp)
+
+  mel_in_graph = False
+  if args.meta_fp is None:
+    print('Warning: Model not specified, streaming pseudoinverse magnitudes')
+    gen_fn = lambda _X: _X
+  else:
+    mel_in_graph = generator_accepts_melspec(args.meta_fp)
+    _gen_fn, _ = load_generator(
+        args.meta_fp, args.model_ckpt, chunk_len=args.subseq_len, melspec=mel_in_graph)
+    gen_fn = lambda _X: np.clip(_gen_fn(_X), 0, None)
+
+  if mel_in_graph:
+    X = X_mel[:, :, :1].astype(np.float32)
+  else:
+    X = tacotron_mel_to_mag(X_mel[:, :, 0], inv_mel_filterbank)[:, :, np.newaxis]
+
+  vocoder = StreamingVocoder(
+      gen_fn,
+      args.subseq_len,
+      lookahead=args.lookahead,
+      context=args.context,
+      nfft=nfft,
+      nhop=nhop)
+
+  # Warm up
+  vocoder.push(X[:args.subseq_len])
+  vocoder.flush()
+  warmup_ncalls = vocoder.generator.ncalls
+
+  push_times = []
+  blocks = []
+  for i in range(0, X.shape[0], args.frames_per_push):
+    start = time.time()
+    blocks.append(vocoder.push(X[i:i + args.frames_per_push]))
+    push_times.append(time.time() - start)
+  start = time.time()
+  blocks.append(vocoder.flush())
+  push_times.append(time.time() - start)
+
+  audio = np.concatenate(blocks, axis=0)
+  duration = audio.shape[0] / float(args.fs)
+  push_duration = args.frames_per_push * nhop / float(args.fs)
+
+  print('Streamed {:.2f}s of audio in {} pushes of {} frames'.format(
+    duration, len(push_times), args.frames_per_push))
+  print('Real-time factor: {:.3f} (compute / audio duration)'.format(
+    sum(push_times) / duration))
+  print('Push compute: mean {:.1f}ms, max {:.1f}ms, budget {:.1f}ms per push'.format(
+    1000. * np.mean(push_times), 1000. * np.max(push_times), 1000. * push_duration))
+  print('Algorithmic latency: {:.1f}ms (+{:.1f}ms waiting for a full push)'.format(
+    1000. * vocoder.latency_samples / args.fs, 1000. * push_duration))
+  print('{} generator calls'.format(vocoder.generator.ncalls - warmup_ncalls))
+
+  if args.out_fp is not None:
+    save_as_wav(args.out_fp, args.fs, np.clip(audio, -1., 1.))
@@ -1,43 +1,77 @@
 from argparse import ArgumentParser
+import errno
 import glob
 import os
 import shutil
 
 if __name__ == '__main__':
+  from advoc.manifest import probe_manifest_entry, write_manifest
 
   parser = ArgumentParser()
   parser.add_argument('--source_dir', type=str)
   parser.add_argument('--out_dir', type=str)
-  
+  parser.add_argument('--mode', type=str, choices=['manifest', 'link', 'copy'],
+      help='manifest: only write <split>.tsv manifests, link: also hardlink files into split directories, copy: also copy them')
+  parser.add_argument('--relative', action='store_true', dest='relative',
+      help='If set, write paths relative to out_dir (so the corpus and manifests can be moved together)')
+
   parser.set_defaults(
     out_dir=None,
-    source_dir=None
+    source_dir=None,
+    mode='manifest',
+    relative=False
   )
   args = parser.parse_args()
-  
+
   OUT_DIR = args.out_dir
-  if os.path.isdir(OUT_DIR):
-    shutil.rmtree(OUT_DIR)
+  if not os.path.isdir(OUT_DIR):
+    os.makedirs(OUT_DIR)
 
   splits = [('valid', 0.05), ('test', 0.05)]
   wavs = sorted(glob.glob(os.path.join(args.source_dir, "*.wav")))
-  
+
   split_to_len = {}
   for split_name, split_proportion in splits:
     split_len = int(split_proportion * len(wavs))
     split_to_len[split_name] = split_len
   split_to_len['train'] = len(wavs) - sum(split_to_len.values())
 
+  def link_or_copy(fp, split_dir):
+    out_fp = os.path.join(split_dir, os.path.basename(fp))
+    if args.mode == 'link':
+      try:
+        os.link(fp, out_fp)
+        return out_fp
+      except OSError as e:
+        if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+          raise
+    shutil.copy(fp, out_fp)
+    return out_fp
+
   idx = 0
   for split_name in ['train'] + [s[0] for s in splits]:
-    split_dir = os.path.join(OUT_DIR, split_name)
-    os.makedirs(split_dir)
-
     split_len = split_to_len[split_name]
 
     split_fps = wavs[idx:idx+split_len]
 
+    if args.mode != 'manifest':
+      split_dir = os.path.join(OUT_DIR, split_name)
+      if os.path.isdir(split_dir):
+        shutil.rmtree(split_dir)
+      os.makedirs(split_dir)
+      split_fps = [link_or_copy(fp, split_dir) for fp in split_fps]
+
+    # Durations, sample rates and channels are read from WAV headers
+    entries = []
     for fp in split_fps:
-      shutil.copy(fp, split_dir)
+      entry = probe_manifest_entry(os.path.abspath(fp))
+      if args.relative:
+        entry['path'] = os.path.relpath(entry['path'], os.path.abspath(OUT_DIR))
+      entries.append(entry)
+    manifest_fp = os.path.join(OUT_DIR, split_name + '.tsv')
+    write_manifest(manifest_fp, entries)
+
+    print('{}: {} files, {:.2f} hours -> {}'.format(
+      split_name, len(entries), sum([e['duration'] for e in entries]) / 3600., manifest_fp))
 
-    idx += split_len
\ No newline at end of file
+    idx += split_len
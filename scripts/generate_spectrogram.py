@@ -9,6 +9,8 @@ if __name__ == '__main__':
   import tensorflow as tf
   from tqdm import tqdm
 
+  from advoc import specio
+
   parser = ArgumentParser()
 
   parser.add_argument('--out_dir', type=str, required=True,
@@ -21,13 +23,16 @@ if __name__ == '__main__':
       help='Total number of spectrograms to generate')
   parser.add_argument('--b', type=int,
       help='Number of spectrograms to generate per batch')
+  parser.add_argument('--out_format', type=str, choices=['npy'] + specio.STORAGE_DTYPES,
+      help='npy: float32 .npy files, else compact .spec files storing frames as this dtype (see advoc.specio)')
 
   parser.set_defaults(
       out_dir=None,
       ckpt_fp=None,
       meta_fp='../models/melspecgan/infer.meta',
       n=1000,
-      b=10)
+      b=10,
+      out_format='npy')
 
   args = parser.parse_args()
 
@@ -52,5 +57,15 @@ if __name__ == '__main__':
       _G_z = sess.run(G_z, {z: _z})
       for j, _s in enumerate(_G_z):
         _s = _s.astype(np.float32)
-        out_fp = os.path.join(args.out_dir, '{}.npy'.format(str(j+i).zfill(9)))
-        np.save(out_fp, _s)
+        out_fn = str(j+i).zfill(9)
+        if args.out_format == 'npy':
+          np.save(os.path.join(args.out_dir, out_fn + '.npy'), _s)
+        else:
+          # Generator output is in [-1, 1] (tanh)
+          specio.save_spec(
+              os.path.join(args.out_dir, out_fn + specio.SPEC_EXT),
+              _s,
+              args.out_format,
+              vmin=-1.,
+              vmax=1.,
+              params={'type': 'melspecgan', 'meta_fp': args.meta_fp, 'ckpt_fp': args.ckpt_fp})
@@ -2,6 +2,7 @@
 
 if __name__ == '__main__':
   from argparse import ArgumentParser
+  from functools import partial
   import glob
   import numpy as np
   import os
@@ -9,17 +10,10 @@ if __name__ == '__main__':
   import tensorflow as tf
   from advoc.audioio import save_as_wav
   from advoc.spectral import r9y9_melspec_to_waveform, magspec_to_waveform_lws
-  from advoc.spectral import create_inverse_mel_filterbank
-
-  #TODO: move to advoc.spectral
-  def tacotron_mel_to_mag(X_mel_dbnorm, invmeltrans):
-    norm_min_level_db = -100
-    norm_ref_level_db = 20
-    
-    X_mel_db = (X_mel_dbnorm * -norm_min_level_db) + norm_min_level_db
-    X_mel = np.power(10, (X_mel_db + norm_ref_level_db) / 20)
-    X_mag = np.dot(X_mel, invmeltrans.T)
-    return X_mag
+  from advoc.spectral import create_inverse_mel_filterbank, tacotron_mel_to_mag
+  from advoc import specio
+  from advoc.vocoder import BatchedGenerator, generator_accepts_melspec, is_frozen_graph
+  from advoc.vocoder import load_generator, VocodingPipeline
 
   parser = ArgumentParser()
 
@@ -30,11 +24,19 @@ if __name__ == '__main__':
   parser.add_argument('--model_ckpt', type=str,
       help='Adversarial vocoder checkpoint')
   parser.add_argument('--meta_fp', type=str,
-      help='Met graph filepath')
+      help='Meta graph filepath (or frozen .pb graph, which needs no checkpoint)')
   parser.add_argument('--fs', type=int,
       help='sampling rate')
   parser.add_argument('--subseq_len', type=int,
-      help="model subseq length")
+      help="model subseq length (0 vocodes whole utterances with exported graphs)")
+  parser.add_argument('--batch_size', type=int,
+      help='Number of chunks (pooled across files) per generator call')
+  parser.add_argument('--overlap', type=int,
+      help='Number of frames shared (and crossfaded) by adjacent chunks')
+  parser.add_argument('--num_workers', type=int,
+      help='Number of LWS processes (0 runs LWS in the writer thread)')
+  parser.add_argument('--queue_size', type=int,
+      help='Capacity of the queues between pipeline stages')
 
   parser.set_defaults(
       spec_dir=None,
@@ -42,7 +44,11 @@ if __name__ == '__main__':
       model_ckpt=None,
       meta_fp=None,
       fs=22050,
-      subseq_len=256
+      subseq_len=256,
+      batch_size=16,
+      overlap=0,
+      num_workers=4,
+      queue_size=8
       )
 
   args = parser.parse_args()
@@ -51,48 +57,80 @@ if __name__ == '__main__':
     os.makedirs(args.out_dir)
 
   heuristic = False
-  if args.model_ckpt is None:
+  if args.model_ckpt is None and not is_frozen_graph(args.meta_fp):
     print('Warning: Model checkpoint not specified, using pseudoinverse+LWS heuristic to vocode')
     heuristic = True
   else:
-    gen_graph = tf.Graph()
-    with gen_graph.as_default():
-      gan_saver = tf.train.import_meta_graph(args.meta_fp)
-    gen_sess = tf.Session(graph=gen_graph)
     print("Restoring")
-    gan_saver.restore(gen_sess, args.model_ckpt)
-    gen_mag_spec = gen_graph.get_tensor_by_name('generator/decoder_1/strided_slice_1:0')
-    x_mag_input = gen_graph.get_tensor_by_name('ExpandDims_1:0')
+    # Exported generators convert mel to magnitude spectrograms in-graph
+    mel_in_graph = generator_accepts_melspec(args.meta_fp)
+    _gen_fn, exported = load_generator(
+        args.meta_fp, args.model_ckpt, chunk_len=args.subseq_len, melspec=mel_in_graph)
+    gen_fn = lambda _X: _gen_fn(_X).astype(np.float64)
+
+    if exported and args.subseq_len == 0:
+      # Exported generators accept whole utterances
+      gen = BatchedGenerator(gen_fn, chunk_len=None, batch_size=1)
+    else:
+      gen = BatchedGenerator(
+          gen_fn,
+          chunk_len=args.subseq_len,
+          batch_size=args.batch_size,
+          overlap=args.overlap)
 
   inv_mel_filterbank = create_inverse_mel_filterbank(
       args.fs, 1024, fmin=125, fmax=7600, n_mels=80)
 
+  def spec_name_to_wave_fp(spec_name):
+    return os.path.join(args.out_dir, spec_name + '.wav')
+
+  # Spectrograms are either .npy or .spec files, or shard-NNNNN.npz files keyed by name
   spec_fps = glob.glob(os.path.join(args.spec_dir, '*.npy'))
-  for i, spec_fp in tqdm(enumerate(spec_fps)):
-    spec_fn = os.path.splitext(os.path.split(spec_fp)[1])[0]
-    wave_fn = spec_fn + '.wav'
-    wave_fp = os.path.join(args.out_dir, wave_fn)
+  spec_fps += glob.glob(os.path.join(args.spec_dir, '*' + specio.SPEC_EXT))
+  shard_fps = sorted(glob.glob(os.path.join(args.spec_dir, 'shard-*.npz')))
+  nspecs = len(spec_fps)
+  for shard_fp in shard_fps:
+    with np.load(shard_fp) as shard:
+      nspecs += len(shard.files)
 
-    spec = np.load(spec_fp)
+  def load_specs():
+    for spec_fp in spec_fps:
+      yield os.path.splitext(os.path.split(spec_fp)[1])[0], specio.read_spectrogram(spec_fp)
+    for shard_fp in shard_fps:
+      with np.load(shard_fp) as shard:
+        for spec_name in shard.files:
+          spec = shard[spec_name]
+          # Shards of .spec files hold their encoded bytes
+          if spec.ndim == 1 and spec.dtype == np.uint8:
+            spec = specio.decode_spec(spec)
+          yield spec_name, spec
 
-    if heuristic:
+  if heuristic:
+    for spec_name, spec in tqdm(load_specs(), total=nspecs):
       wave = r9y9_melspec_to_waveform(spec)
-    else:
-      subseq_len = args.subseq_len
-      X_mag = tacotron_mel_to_mag(spec[:,:,0], inv_mel_filterbank)
-      x_mag_original_length = X_mag.shape[0]
-      x_mag_target_length = int(X_mag.shape[0] / subseq_len ) * subseq_len + subseq_len
-      X_mag = np.pad(X_mag, ([0,x_mag_target_length - X_mag.shape[0]], [0,0]), 'constant')
-      num_examples = int(x_mag_target_length/subseq_len)
-      X_mag = np.reshape(X_mag, [num_examples, subseq_len, 513, 1])
-      gen_mags = []
-      for n in range(num_examples):
-        _gen = gen_sess.run([gen_mag_spec], feed_dict = {
-            x_mag_input : X_mag[n:n+1]
-            })[0]
-        gen_mags.append(_gen[0])
-      gen_mag = np.concatenate(gen_mags, axis = 0)
-      gen_mag = gen_mag[0:x_mag_original_length]
-      wave = magspec_to_waveform_lws(gen_mag.astype('float64'), 1024, 256)
-    
-    save_as_wav(wave_fp, args.fs, wave)
+      save_as_wav(spec_name_to_wave_fp(spec_name), args.fs, wave)
+  else:
+    def load_mags():
+      for spec_name, spec in load_specs():
+        if mel_in_graph:
+          yield spec_name, spec[:, :, :1].astype(np.float32)
+          continue
+        X_mag = tacotron_mel_to_mag(spec[:,:,0], inv_mel_filterbank)
+        yield spec_name, X_mag[:, :, np.newaxis]
+
+    progress = tqdm(total=nspecs)
+    def write_wave(spec_name, wave):
+      save_as_wav(spec_name_to_wave_fp(spec_name), args.fs, wave)
+      progress.update(1)
+
+    pipeline = VocodingPipeline(
+        gen,
+        partial(magspec_to_waveform_lws, nfft=1024, nhop=256),
+        write_wave,
+        num_workers=args.num_workers,
+        queue_size=args.queue_size)
+    pipeline.run(load_mags())
+    progress.close()
+
+    print('{} chunks in {} generator calls'.format(gen.nchunks, gen.ncalls))
+    print(pipeline.summary())
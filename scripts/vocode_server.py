@@ -0,0 +1,186 @@
+# This script serves adversarial vocoding over HTTP, batching concurrent requests.
+#
+# POST /vocode with a .npy or .spec normalized mel spectrogram ([ntsteps, n_mels] or
+# [ntsteps, n_mels, 1]) as the body to receive a 16-bit WAV file. GET /stats
+# for queue depth, batch counts and latency percentiles (in seconds) as JSON.
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  from collections import deque
+  from functools import partial
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  import io
+  import json
+  import multiprocessing
+  import os
+  import socketserver
+  import threading
+  import time
+
+  import numpy as np
+
+  from advoc.audioio import save_as_wav
+  from advoc import specio
+  from advoc.spectral import create_inverse_mel_filterbank, magspec_to_waveform_lws
+  from advoc.spectral import tacotron_mel_to_mag
+  from advoc.vocoder import DynamicBatcher, generator_accepts_melspec, load_generator
+
+  parser = ArgumentParser()
+
+  parser.add_argument('--model_ckpt', type=str,
+      help='Adversarial vocoder checkpoint')
+  parser.add_argument('--meta_fp', type=str, required=True,
+      help='Meta graph filepath (or frozen .pb graph, which needs no checkpoint)')
+  parser.add_argument('--host', type=str,
+      help='Host to listen on')
+  parser.add_argument('--port', type=int,
+      help='Port to listen on')
+  parser.add_argument('--unix_socket', type=str,
+      help='If set, listen on this Unix socket path instead of host/port')
+  parser.add_argument('--fs', type=int,
+      help='sampling rate')
+  parser.add_argument('--n_mels', type=int,
+      help='Number of mel bins')
+  parser.add_argument('--subseq_len', type=int,
+      help='model subseq length')
+  parser.add_argument('--batch_size', type=int,
+      help='Maximum number of chunks (pooled across requests) per generator call')
+  parser.add_argument('--overlap', type=int,
+      help='Number of frames shared (and crossfaded) by adjacent chunks')
+  parser.add_argument('--max_latency_ms', type=float,
+      help='Maximum time to wait for concurrent requests to fill a batch')
+  parser.add_argument('--num_workers', type=int,
+      help='Number of LWS processes')
+
+  parser.set_defaults(
+      model_ckpt=None,
+      meta_fp=None,
+      host='127.0.0.1',
+      port=8000,
+      unix_socket=None,
+      fs=22050,
+      n_mels=80,
+      subseq_len=256,
+      batch_size=16,
+      overlap=0,
+      max_latency_ms=10.,
+      num_workers=4)
+
+  args = parser.parse_args()
+
+  print('Restoring')
+  mel_in_graph = generator_accepts_melspec(args.meta_fp)
+  gen_fn, _ = load_generator(
+      args.meta_fp, args.model_ckpt, chunk_len=args.subseq_len, melspec=mel_in_graph)
+  inv_mel_filterbank = create_inverse_mel_filterbank(
+      args.fs, 1024, fmin=125, fmax=7600, n_mels=args.n_mels)
+
+  batcher = DynamicBatcher(
+      lambda _X: np.clip(gen_fn(_X), 0, None).astype(np.float64),
+      chunk_len=args.subseq_len,
+      batch_size=args.batch_size,
+      overlap=args.overlap,
+      max_latency=args.max_latency_ms / 1000.)
+
+  print('Warming up')
+  batcher.warmup(args.n_mels if mel_in_graph else 513)
+  lws_pool = multiprocessing.get_context('spawn').Pool(args.num_workers)
+  invert_fn = partial(magspec_to_waveform_lws, nfft=1024, nhop=256)
+  lws_pool.map(invert_fn, [np.zeros([args.subseq_len, 513, 1])] * args.num_workers)
+
+  latencies = deque(maxlen=1000)
+  latencies_lock = threading.Lock()
+
+  def vocode(body):
+    if specio.is_spec(body):
+      spec = specio.decode_spec(body)
+    else:
+      spec = np.load(io.BytesIO(body))
+    if spec.ndim == 2:
+      spec = spec[:, :, np.newaxis]
+    if spec.ndim != 3 or spec.shape[1] != args.n_mels or spec.shape[2] != 1:
+      raise ValueError('Expected spectrogram of shape [ntsteps, {}, 1]'.format(args.n_mels))
+    if mel_in_graph:
+      X = spec.astype(np.float32)
+    else:
+      X = tacotron_mel_to_mag(spec[:, :, 0], inv_mel_filterbank)[:, :, np.newaxis]
+
+    gen_mag = batcher(X)
+    wave = lws_pool.apply(invert_fn, (gen_mag,))
+
+    wav = io.BytesIO()
+    save_as_wav(wav, args.fs, wave)
+    return wav.getvalue()
+
+  def stats():
+    stats = batcher.stats()
+    with latencies_lock:
+      _latencies = list(latencies)
+    if len(_latencies) > 0:
+      p50, p90, p99 = np.percentile(_latencies, [50, 90, 99])
+    else:
+      p50, p90, p99 = 0., 0., 0.
+    stats['end_to_end_p50'] = float(p50)
+    stats['end_to_end_p90'] = float(p90)
+    stats['end_to_end_p99'] = float(p99)
+    return stats
+
+  class VocodeHandler(BaseHTTPRequestHandler):
+
+    def _respond(self, code, content_type, body):
+      self.send_response(code)
+      self.send_header('Content-Type', content_type)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self):
+      if self.path != '/stats':
+        self._respond(404, 'text/plain', b'Not found')
+        return
+      self._respond(200, 'application/json', json.dumps(stats()).encode('utf-8'))
+
+    def do_POST(self):
+      if self.path != '/vocode':
+        self._respond(404, 'text/plain', b'Not found')
+        return
+      start = time.time()
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+      try:
+        wav = vocode(body)
+      except ValueError as e:
+        self._respond(400, 'text/plain', str(e).encode('utf-8'))
+        return
+      self._respond(200, 'audio/wav', wav)
+      with latencies_lock:
+        latencies.append(time.time() - start)
+
+    def log_message(self, format, *args):
+      # Unix socket clients have no address
+      pass
+
+  if args.unix_socket is not None:
+    if os.path.exists(args.unix_socket):
+      os.remove(args.unix_socket)
+
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+      daemon_threads = True
+
+    server = ThreadingUnixHTTPServer(args.unix_socket, VocodeHandler)
+    print('Listening on {}'.format(args.unix_socket))
+  else:
+    class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+      daemon_threads = True
+
+    server = ThreadingHTTPServer((args.host, args.port), VocodeHandler)
+    print('Listening on http://{}:{}'.format(args.host, args.port))
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    batcher.close()
+    lws_pool.close()
+    lws_pool.join()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from advoc.backup import CheckpointBackup
+
+
+def _write_checkpoint(train_dir, step, data):
+  prefix = os.path.join(train_dir, 'model.ckpt-{}'.format(step))
+  with open(prefix + '.data-00000-of-00001', 'wb') as f:
+    f.write(data)
+  with open(prefix + '.index', 'wb') as f:
+    f.write('index-{}'.format(step).encode('utf-8'))
+  return prefix
+
+
+class TestBackupModule(unittest.TestCase):
+
+  def setUp(self):
+    self.train_dir = tempfile.mkdtemp()
+    self.backup_dir = os.path.join(self.train_dir, 'backup')
+    self.restore_dir = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.train_dir)
+    shutil.rmtree(self.restore_dir)
+
+
+  def _check_restore(self, store, prefix):
+    name = os.path.basename(prefix)
+    restored = store.restore(name, self.restore_dir)
+    self.assertEqual(restored, os.path.join(self.restore_dir, name), 'incorrect prefix')
+    for ext in ['.index', '.data-00000-of-00001']:
+      with open(prefix + ext, 'rb') as f:
+        expected = f.read()
+      with open(restored + ext, 'rb') as f:
+        self.assertEqual(f.read(), expected, 'restored file differs')
+    self.assertTrue(os.path.exists(os.path.join(self.restore_dir, 'checkpoint')),
+        'no checkpoint state')
+
+
+  def test_skips_held(self):
+    for mode in ['link', 'dedup', 'copy']:
+      backup_dir = os.path.join(self.backup_dir, mode)
+      store = CheckpointBackup(backup_dir, mode=mode)
+      prefix = _write_checkpoint(self.train_dir, 10, b'\x01' * 100)
+
+      self.assertTrue(store.backup(prefix), 'checkpoint not backed up')
+      nbytes = store.nbytes_written + store.nbytes_linked
+      self.assertFalse(store.backup(prefix), 'held checkpoint backed up again')
+      self.assertEqual(store.nbytes_written + store.nbytes_linked, nbytes,
+          'held checkpoint rewritten')
+      self.assertEqual(store.held(), ['model.ckpt-10'], 'incorrect held checkpoints')
+
+      self._check_restore(store, prefix)
+
+      # Backups survive the deletion of the originals
+      os.remove(prefix + '.data-00000-of-00001')
+      restored = store.restore('model.ckpt-10', self.restore_dir)
+      with open(restored + '.data-00000-of-00001', 'rb') as f:
+        self.assertEqual(f.read(), b'\x01' * 100, 'original not restored')
+
+
+  def test_dedup(self):
+    store = CheckpointBackup(self.backup_dir, mode='dedup', chunk_size=10)
+
+    prefix_10 = _write_checkpoint(self.train_dir, 10, b'\x00' * 40 + b'\x01' * 10)
+    store.backup(prefix_10)
+    # Two unique 10 byte chunks plus the index
+    self.assertEqual(store.nbytes_written, 20 + 8, 'chunks not deduplicated')
+
+    prefix_20 = _write_checkpoint(self.train_dir, 20, b'\x00' * 40 + b'\x02' * 10)
+    store.backup(prefix_20)
+    self.assertEqual(store.nbytes_written, 20 + 8 + 10 + 8, 'unchanged chunks rewritten')
+
+    self._check_restore(store, prefix_20)
+
+
+  def test_retention(self):
+    store = CheckpointBackup(self.backup_dir, mode='dedup', keep=2, chunk_size=10)
+
+    for step, fill in [(10, b'\x01'), (20, b'\x02'), (30, b'\x02')]:
+      store.backup(_write_checkpoint(self.train_dir, step, fill * 10))
+
+    self.assertEqual(store.held(), ['model.ckpt-20', 'model.ckpt-30'], 'oldest not pruned')
+
+    nchunks = sum([len(fns) for _, _, fns in os.walk(store.chunks_dir)])
+    # Shared data chunk plus two index chunks
+    self.assertEqual(nchunks, 3, 'unreferenced chunks not collected')
+
+
+if __name__ == '__main__':
+  unittest.main()
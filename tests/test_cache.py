@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from advoc.cache import ExampleCache
+
+
+def _example(n, fill):
+  return (np.full([n, 1, 1], fill, dtype=np.float32),)
+
+
+class TestCacheModule(unittest.TestCase):
+
+  def setUp(self):
+    self.spill_dir = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.spill_dir)
+
+
+  def test_lru_eviction(self):
+    cache = ExampleCache(1000)
+
+    cache.put('a', _example(100, 0.))
+    cache.put('b', _example(100, 1.))
+    self.assertEqual(cache.nbytes, 800, 'incorrect byte count')
+
+    # Touch a so b is least recently used
+    self.assertEqual(cache.get('a')[0][0, 0, 0], 0., 'incorrect value')
+    cache.put('c', _example(100, 2.))
+    self.assertEqual(cache.nbytes, 800, 'incorrect byte count')
+    self.assertTrue('a' in cache, 'evicted most recently used')
+    self.assertFalse('b' in cache, 'did not evict least recently used')
+    self.assertIsNone(cache.get('b'), 'evicted item returned')
+
+    # Larger than budget is never held
+    cache.put('d', _example(1000, 3.))
+    self.assertFalse('d' in cache, 'held item larger than budget')
+    self.assertLessEqual(cache.nbytes, 1000, 'exceeded budget')
+
+
+  def test_hit_rate(self):
+    cache = ExampleCache(1 << 20)
+    self.assertEqual(cache.hit_rate, 0., 'incorrect empty hit rate')
+
+    ncalls = [0]
+    def _compute():
+      ncalls[0] += 1
+      return _example(10, 0.)
+
+    for _ in range(4):
+      cache.get_or_compute(b'fp', _compute)
+
+    self.assertEqual(ncalls[0], 1, 'recomputed cached example')
+    self.assertEqual(cache.misses, 1, 'incorrect misses')
+    self.assertEqual(cache.hits, 3, 'incorrect hits')
+    self.assertAlmostEqual(cache.hit_rate, 0.75, 8, 'incorrect hit rate')
+
+
+  def test_spill(self):
+    cache = ExampleCache(500, spill_dir=self.spill_dir, spill_max_nbytes=800)
+
+    cache.put('a', _example(100, 0.))
+    cache.put('b', _example(100, 1.))
+    self.assertEqual(cache.nbytes, 400, 'incorrect byte count')
+    self.assertEqual(cache.spill_nbytes, 400, 'incorrect spill byte count')
+
+    b = cache.get('b')
+    self.assertEqual(b[0].shape, (100, 1, 1), 'incorrect shape')
+    a = cache.get('a')
+    self.assertTrue(np.array_equal(a[0], _example(100, 0.)[0]), 'spill not lossless')
+    self.assertEqual(cache.spill_hits, 1, 'incorrect spill hits')
+
+    cache.put('c', _example(100, 2.))
+    cache.put('d', _example(100, 3.))
+    cache.put('e', _example(100, 4.))
+    self.assertLessEqual(cache.spill_nbytes, 800, 'exceeded spill budget')
+    self.assertEqual(len(cache), 3, 'incorrect number of examples')
+
+
+if __name__ == '__main__':
+  unittest.main()
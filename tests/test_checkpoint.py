@@ -0,0 +1,110 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from advoc.checkpoint import CheckpointWatcher, is_checkpoint_complete, read_checkpoint_paths
+
+
+def _write_checkpoint(train_dir, step, nshards=1, complete=True):
+  prefix = os.path.join(train_dir, 'model.ckpt-{}'.format(step))
+  for i in range(nshards):
+    with open('{}.data-{:05d}-of-{:05d}'.format(prefix, i, nshards), 'wb') as f:
+      f.write(b'\x00' * 16)
+  with open(prefix + '.index', 'wb') as f:
+    f.write(b'\x00' * 40)
+    if complete:
+      f.write(struct.pack('<Q', 0xdb4775248b80fb57))
+  return prefix
+
+
+def _write_state(train_dir, steps):
+  names = ['model.ckpt-{}'.format(step) for step in steps]
+  with open(os.path.join(train_dir, 'checkpoint'), 'w') as f:
+    f.write('model_checkpoint_path: "{}"\n'.format(names[-1]))
+    for name in names:
+      f.write('all_model_checkpoint_paths: "{}"\n'.format(name))
+
+
+class TestCheckpointModule(unittest.TestCase):
+
+  def setUp(self):
+    self.train_dir = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.train_dir)
+
+
+  def test_read_checkpoint_paths(self):
+    self.assertEqual(read_checkpoint_paths(self.train_dir), [], 'expected no checkpoints')
+
+    _write_state(self.train_dir, [10, 20])
+    self.assertEqual(read_checkpoint_paths(self.train_dir), [
+      os.path.join(self.train_dir, 'model.ckpt-10'),
+      os.path.join(self.train_dir, 'model.ckpt-20')], 'incorrect paths')
+
+
+  def test_is_checkpoint_complete(self):
+    prefix = _write_checkpoint(self.train_dir, 10, nshards=2)
+    self.assertTrue(is_checkpoint_complete(prefix), 'complete checkpoint rejected')
+
+    os.remove(prefix + '.data-00001-of-00002')
+    self.assertFalse(is_checkpoint_complete(prefix), 'missing shard accepted')
+
+    prefix = _write_checkpoint(self.train_dir, 20, complete=False)
+    self.assertFalse(is_checkpoint_complete(prefix), 'truncated index accepted')
+
+    self.assertFalse(is_checkpoint_complete(os.path.join(self.train_dir, 'model.ckpt-30')),
+        'missing checkpoint accepted')
+
+
+  def test_backlog(self):
+    for step in [10, 20, 30, 40]:
+      _write_checkpoint(self.train_dir, step)
+    _write_state(self.train_dir, [10, 20, 30, 40])
+
+    watcher = CheckpointWatcher(self.train_dir, backlog=2, poll_interval=0.01, use_inotify=False)
+    ckpt_fps = list(watcher.checkpoints(timeout=0.05))
+    self.assertEqual([os.path.split(fp)[1] for fp in ckpt_fps],
+        ['model.ckpt-30', 'model.ckpt-40'], 'backlog not skipped to newest')
+    self.assertEqual(watcher.nskipped, 2, 'incorrect skip count')
+
+
+  def _handle_delayed(self, use_inotify):
+    _write_checkpoint(self.train_dir, 10, complete=False)
+    _write_state(self.train_dir, [10])
+
+    def finish():
+      time.sleep(0.1)
+      _write_checkpoint(self.train_dir, 10)
+      _write_checkpoint(self.train_dir, 20)
+      _write_state(self.train_dir, [10, 20])
+    thread = threading.Thread(target=finish)
+    thread.start()
+
+    handled = []
+    watcher = CheckpointWatcher(self.train_dir, backlog=2, poll_interval=0.01, use_inotify=use_inotify)
+    watcher.add_handler(handled.append)
+    watcher.run(timeout=0.5)
+    watcher.close()
+    thread.join()
+
+    return [os.path.split(fp)[1] for fp in handled]
+
+
+  def test_polling(self):
+    self.assertEqual(self._handle_delayed(False), ['model.ckpt-10', 'model.ckpt-20'],
+        'incorrect checkpoints handled')
+
+
+  def test_inotify(self):
+    self.assertEqual(self._handle_delayed(True), ['model.ckpt-10', 'model.ckpt-20'],
+        'incorrect checkpoints handled')
+
+
+if __name__ == '__main__':
+  unittest.main()
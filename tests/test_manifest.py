@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from advoc.audioio import probe_audio, save_as_wav
+from advoc.manifest import probe_manifest_entry, read_manifest, read_manifest_fps
+from advoc.manifest import write_manifest
+
+
+AUDIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio')
+WAV_MONO = os.path.join(AUDIO_DIR, 'mono.wav')
+WAV_STEREO = os.path.join(AUDIO_DIR, 'stereo.wav')
+
+
+class TestManifestModule(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+
+  def test_probe_audio(self):
+    self.assertEqual(probe_audio(WAV_MONO), (44100, 164864, 1), 'incorrect mono header')
+    self.assertEqual(probe_audio(WAV_STEREO), (44100, 164864, 2), 'incorrect stereo header')
+
+    fp = os.path.join(self.tmp_dir, 'x.wav')
+    save_as_wav(fp, 22050, np.zeros([1001, 1, 1], dtype=np.float32))
+    self.assertEqual(probe_audio(fp), (22050, 1001, 1), 'incorrect written header')
+
+    # Truncated files report the samples present
+    with open(fp, 'rb') as f:
+      buf = f.read()
+    with open(fp, 'wb') as f:
+      f.write(buf[:-200])
+    self.assertEqual(probe_audio(fp), (22050, 901, 1), 'truncated data not detected')
+
+
+  def test_roundtrip(self):
+    manifest_fp = os.path.join(self.tmp_dir, 'train.tsv')
+    stereo = probe_manifest_entry(WAV_STEREO)
+    self.assertAlmostEqual(stereo['duration'], 164864 / 44100., 6, 'incorrect duration')
+
+    # Relative paths are resolved against the manifest's directory
+    stereo['path'] = os.path.relpath(WAV_STEREO, self.tmp_dir)
+    write_manifest(manifest_fp, [probe_manifest_entry(WAV_MONO), stereo])
+
+    entries = read_manifest(manifest_fp)
+    self.assertEqual([e['nch'] for e in entries], [1, 2], 'incorrect channels')
+    self.assertEqual([e['fs'] for e in entries], [44100, 44100], 'incorrect sample rates')
+    self.assertEqual([os.path.normpath(fp) for fp in read_manifest_fps(manifest_fp)],
+        [WAV_MONO, WAV_STEREO], 'incorrect paths')
+
+    with open(manifest_fp, 'w') as f:
+      f.write(WAV_MONO + '\n')
+    with self.assertRaises(ValueError, msg='headerless manifest accepted'):
+      read_manifest(manifest_fp)
+
+
+if __name__ == '__main__':
+  unittest.main()
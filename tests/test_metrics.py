@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from advoc.metrics import dct_matrix, lengths_to_mask, log_spectral_distance
+from advoc.metrics import mel_cepstral_distortion, nonsilent_mask, spectral_convergence
+
+
+def _filterbank(n_mels, nbins):
+  # Triangular filters (stand-in for a mel filterbank)
+  centers = np.linspace(0, nbins - 1, n_mels + 2)
+  bins = np.arange(nbins)[np.newaxis]
+  left, center, right = centers[:-2, np.newaxis], centers[1:-1, np.newaxis], centers[2:, np.newaxis]
+  up = (bins - left) / (center - left)
+  down = (right - bins) / (right - center)
+  return np.maximum(0., np.minimum(up, down))
+
+
+class TestMetricsModule(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    self.X = np.random.uniform(0.1, 1., size=[4, 20, 65])
+    self.W = _filterbank(16, 65)
+
+
+  def test_dct_matrix(self):
+    D = dct_matrix(16)
+    self.assertTrue(np.allclose(np.dot(D.T, D), np.eye(16)), 'DCT not orthonormal')
+    self.assertEqual(dct_matrix(16, 13).shape, (16, 13), 'incorrect shape')
+
+
+  def test_identical(self):
+    for metric in [spectral_convergence, log_spectral_distance]:
+      self.assertTrue(np.allclose(metric(self.X, self.X), 0.), 'nonzero distance')
+    self.assertTrue(np.allclose(mel_cepstral_distortion(self.X, self.X, self.W), 0.),
+        'nonzero distance')
+
+
+  def test_known_values(self):
+    sc = spectral_convergence(self.X, np.zeros_like(self.X))
+    self.assertTrue(np.allclose(sc, 1.), 'incorrect spectral convergence')
+
+    # 10x amplitude is +20dB
+    lsd = log_spectral_distance(self.X, 10. * self.X)
+    self.assertTrue(np.allclose(lsd, 20., atol=1e-4), 'incorrect log-spectral distance')
+
+    # Gain only affects the excluded energy coefficient
+    mcd = mel_cepstral_distortion(self.X, 10. * self.X, self.W)
+    self.assertTrue(np.allclose(mcd, 0., atol=1e-4), 'gain changed mel-cepstral distortion')
+
+    Y = self.X * np.random.uniform(0.5, 2., size=self.X.shape)
+    mcd = mel_cepstral_distortion(self.X, Y, self.W)
+    self.assertTrue(np.all(mcd > 0), 'distortion not detected')
+
+
+  def test_batched(self):
+    Y = self.X * np.random.uniform(0.5, 2., size=self.X.shape)
+    for metric in [
+        spectral_convergence,
+        log_spectral_distance,
+        lambda X, Y, mask=None: mel_cepstral_distortion(X, Y, self.W, mask=mask)]:
+      batched = metric(self.X, Y)
+      single = [metric(self.X[i:i+1], Y[i:i+1])[0] for i in range(self.X.shape[0])]
+      self.assertTrue(np.allclose(batched, single), 'batched differs from single')
+
+
+  def test_mask(self):
+    lengths = np.array([20, 15, 10, 0])
+    mask = lengths_to_mask(lengths, 20)
+    self.assertEqual(mask.shape, (4, 20), 'incorrect mask shape')
+    self.assertEqual(list(np.sum(mask, axis=1)), list(lengths), 'incorrect mask')
+
+    X = self.X * mask[:, :, np.newaxis]
+    self.assertTrue(np.array_equal(nonsilent_mask(X), mask), 'incorrect nonsilent mask')
+
+    # Padded frames are ignored
+    Y = self.X * np.random.uniform(0.5, 2., size=self.X.shape)
+    Y_padded = np.where(mask[:, :, np.newaxis] > 0, Y, 100.)
+    for metric in [
+        spectral_convergence,
+        log_spectral_distance,
+        lambda X, Y, mask=None: mel_cepstral_distortion(X, Y, self.W, mask=mask)]:
+      masked = metric(self.X, Y_padded, mask=mask)
+      for i, length in enumerate(lengths[:-1]):
+        unpadded = metric(self.X[i:i+1, :length], Y[i:i+1, :length])[0]
+        self.assertAlmostEqual(masked[i], unpadded, 8, 'padded frames not ignored')
+      self.assertEqual(masked[-1], 0., 'empty example not zero')
+
+
+if __name__ == '__main__':
+  unittest.main()
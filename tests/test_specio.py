@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from advoc import specio
+
+
+class TestSpecioModule(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.X = np.random.RandomState(0).uniform(size=[100, 80, 1])
+    self.X[:10] = 0.
+    self.X[10:20] = 1.
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+
+  def test_reconstruction_error(self):
+    for dtype, max_error, itemsize in [
+        ('uint8', 1. / 510, 1),
+        ('uint16', 1. / 131070, 2),
+        ('float16', 2. ** -12, 2),
+        ('float32', 1e-7, 4)]:
+      buf = specio.encode_spec(self.X, dtype)
+      X_hat = specio.decode_spec(buf)
+
+      self.assertEqual(X_hat.shape, self.X.shape, 'incorrect shape')
+      self.assertEqual(X_hat.dtype, np.float32, 'incorrect dtype')
+      self.assertLessEqual(np.max(np.abs(X_hat - self.X)), max_error + 1e-7,
+          '{} error too large'.format(dtype))
+      self.assertLess(len(buf), self.X.size * itemsize + 256, '{} file too large'.format(dtype))
+
+    for dtype in specio.QUANTIZED_DTYPES:
+      X_hat = specio.decode_spec(specio.encode_spec(self.X, dtype))
+      self.assertTrue(np.all(X_hat[:10] == 0.) and np.all(X_hat[10:20] == 1.),
+          'range endpoints not exact')
+
+
+  def test_quantization_range(self):
+    X = self.X * 40. - 20.
+    X_hat = specio.decode_spec(specio.encode_spec(X, 'uint16', vmin=None, vmax=None))
+    self.assertLessEqual(np.max(np.abs(X_hat - X)), 40. / 131070 + 1e-5,
+        'data range not used')
+
+    X_hat = specio.decode_spec(specio.encode_spec(X, 'uint8'))
+    self.assertTrue(np.min(X_hat) >= 0. and np.max(X_hat) <= 1., 'values not clipped')
+
+
+  def test_file(self):
+    fp = os.path.join(self.tmp_dir, 'x' + specio.SPEC_EXT)
+    params = {'fs': 22050, 'nfft': 1024, 'nhop': 256}
+    specio.save_spec(fp, self.X, 'uint8', params=params)
+
+    header = specio.load_spec_header(fp)
+    self.assertEqual(header['params'], params, 'parameters not recorded')
+    self.assertEqual(header['shape'], [100, 80, 1], 'shape not recorded')
+    self.assertTrue(specio.is_spec_complete(fp), 'complete file rejected')
+
+    with open(fp, 'rb') as f:
+      buf = f.read()
+    np.testing.assert_array_equal(specio.read_spectrogram(fp), specio.decode_spec(buf))
+    # Encoded spectrograms can be stored in npz shards as uint8 arrays
+    np.testing.assert_array_equal(
+        specio.decode_spec(np.frombuffer(buf, dtype=np.uint8)), specio.decode_spec(buf))
+
+    with open(fp, 'wb') as f:
+      f.write(buf[:-1])
+    self.assertFalse(specio.is_spec_complete(fp), 'truncated file accepted')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -175,6 +175,18 @@ class TestSpectralModule(unittest.TestCase):
     self.assertAlmostEqual(env_l1, 0.01686, 4, 'bad envelope after gl10 inverse')
 
 
+  def test_tacotron_mel_to_mag(self):
+    invmeltrans = spectral.create_inverse_mel_filterbank(22050, 1024, fmin=125, fmax=7600, n_mels=80)
+    X_mel_dbnorm = np.random.RandomState(0).uniform(size=[10, 80])
+
+    X_mag = spectral.tacotron_mel_to_mag(X_mel_dbnorm, invmeltrans)
+    self.assertEqual(X_mag.shape, (10, 513), 'invalid shape')
+
+    # Full scale (1) is norm_ref_level_db = 20dB above unity
+    X_mag = spectral.tacotron_mel_to_mag(np.ones([1, 80]), invmeltrans)
+    np.testing.assert_allclose(X_mag[0], 10. * np.sum(invmeltrans, axis=1), rtol=1e-10)
+
+
   def test_magspec_to_waveform(self):
     x = self.wav_mono_22
     self.assertEqual(x.shape, (82432, 1, 1), 'invalid shape')
@@ -0,0 +1,66 @@
+import io
+import struct
+import unittest
+import zlib
+
+import numpy as np
+from scipy.io.wavfile import read as spwavread
+
+from advoc.summary import encode_png, encode_wav, image_to_uint8
+
+
+class TestSummaryModule(unittest.TestCase):
+
+  def test_image_to_uint8(self):
+    x = np.array([[0., 0.5], [1., 2.]])
+    self.assertEqual(image_to_uint8(x).tolist(), [[0, 64], [128, 255]],
+        'bad nonnegative scaling')
+
+    x = np.array([[-1., 0.], [0.5, 1.]])
+    self.assertEqual(image_to_uint8(x).tolist(), [[1, 128], [192, 255]],
+        'bad signed scaling')
+
+    x = np.zeros([2, 2])
+    self.assertEqual(image_to_uint8(x).tolist(), [[0, 0], [0, 0]],
+        'bad scaling of blank image')
+
+
+  def test_encode_png(self):
+    x = np.arange(12, dtype=np.uint8).reshape([3, 4])
+    png = encode_png(x)
+
+    self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n', 'bad signature')
+
+    chunks = {}
+    i = 8
+    while i < len(png):
+      length, = struct.unpack('>I', png[i:i + 4])
+      tag = png[i + 4:i + 8]
+      data = png[i + 8:i + 8 + length]
+      crc, = struct.unpack('>I', png[i + 8 + length:i + 12 + length])
+      self.assertEqual(crc, zlib.crc32(tag + data) & 0xffffffff, 'bad crc')
+      chunks[tag] = data
+      i += 12 + length
+
+    width, height, depth, color = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+    self.assertEqual((width, height, depth, color), (4, 3, 8, 0), 'bad header')
+
+    raw = np.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=np.uint8)
+    raw = raw.reshape([3, 5])
+    self.assertTrue(np.all(raw[:, 0] == 0), 'bad filter types')
+    self.assertTrue(np.array_equal(raw[:, 1:], x), 'bad pixels')
+
+
+  def test_encode_wav(self):
+    x = np.linspace(-2., 2., 100, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    fs, x_decoded = spwavread(io.BytesIO(encode_wav(x, 16000)))
+
+    self.assertEqual(fs, 16000, 'bad sample rate')
+    self.assertEqual(x_decoded.dtype, np.int16, 'bad dtype')
+    self.assertEqual(x_decoded.shape, (100,), 'bad length')
+    self.assertEqual(x_decoded[0], -32768, 'waveform not clipped')
+    self.assertEqual(x_decoded[-1], 32767, 'waveform not clipped')
+
+
+if __name__ == '__main__':
+  unittest.main()
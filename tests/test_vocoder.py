@@ -0,0 +1,255 @@
+import threading
+import unittest
+
+import numpy as np
+try:
+  import lws
+except ImportError:
+  lws = None
+
+from advoc.vocoder import BatchedGenerator, chunk_spectrogram, unchunk_spectrogram
+from advoc.vocoder import crossfade_window, DynamicBatcher, VocodingPipeline
+from advoc.vocoder import StreamingGenerator, StreamingISTFT, StreamingLWS, StreamingVocoder
+
+
+def _sum_bins(X):
+  return X.sum(axis=1)
+
+
+class TestVocoderModule(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    self.Xs = [np.random.rand(n, 513, 1).astype(np.float32) for n in [10, 256, 300, 1, 700]]
+
+
+  def test_chunk_spectrogram(self):
+    X = self.Xs[2]
+    chunks = chunk_spectrogram(X, 64)
+    self.assertEqual(chunks.shape, (5, 64, 513, 1), 'invalid shape')
+    self.assertTrue(np.array_equal(unchunk_spectrogram(chunks, 300), X), 'not invertible')
+
+    chunks = chunk_spectrogram(self.Xs[1], 64)
+    self.assertEqual(chunks.shape[0], 4, 'padded divisible length')
+
+    chunks = chunk_spectrogram(self.Xs[3], 64, overlap=16)
+    self.assertEqual(chunks.shape[0], 1, 'invalid number of chunks')
+
+    chunks = chunk_spectrogram(X, 64, overlap=16)
+    self.assertEqual(chunks.shape, (6, 64, 513, 1), 'invalid shape')
+    self.assertTrue(np.array_equal(chunks[1, :16], chunks[0, -16:]), 'chunks not overlapping')
+    self.assertTrue(np.allclose(unchunk_spectrogram(chunks, 300, overlap=16), X), 'not invertible')
+
+    with self.assertRaises(ValueError, msg='overlap must be less than chunk length'):
+      chunk_spectrogram(X, 64, overlap=64)
+
+
+  def test_crossfade_window(self):
+    window = crossfade_window(64, 16)
+    self.assertEqual(window.shape, (64,), 'invalid shape')
+    self.assertTrue(np.all(window > 0), 'window reaches zero')
+    self.assertTrue(np.allclose(window[-16:] + window[:16], 1.), 'crossfade not complementary')
+
+
+  def test_batched_generator(self):
+    batch_sizes = []
+    def gen_fn(X):
+      batch_sizes.append(X.shape[0])
+      return X * 2.
+
+    gen = BatchedGenerator(gen_fn, chunk_len=64, batch_size=8)
+    X_gens = gen(self.Xs)
+
+    self.assertEqual(len(X_gens), len(self.Xs), 'incorrect number of outputs')
+    for X, X_gen in zip(self.Xs, X_gens):
+      self.assertEqual(X_gen.shape, X.shape, 'invalid shape')
+      self.assertTrue(np.allclose(X_gen, X * 2.), 'outputs scattered incorrectly')
+
+    self.assertTrue(all([b == 8 for b in batch_sizes]), 'batches not fixed size')
+    self.assertEqual(gen.ncalls, len(batch_sizes), 'incorrect number of calls')
+    self.assertLess(gen.ncalls, gen.nchunks, 'chunks not pooled across files')
+
+
+  def test_batched_generator_overlap(self):
+    gen = BatchedGenerator(lambda X: X + 1., chunk_len=64, batch_size=4, overlap=16)
+    for X, X_gen in zip(self.Xs, gen(self.Xs)):
+      self.assertEqual(X_gen.shape, X.shape, 'invalid shape')
+      self.assertTrue(np.allclose(X_gen, X + 1., atol=1e-6), 'overlap-add incorrect')
+
+
+  def test_batched_generator_iter(self):
+    gen = BatchedGenerator(lambda X: X, chunk_len=32, batch_size=3)
+    keys = [k for k, _ in gen.iter(zip('abcde', self.Xs))]
+    self.assertEqual(keys, list('abcde'), 'outputs out of order')
+
+
+  def test_batched_generator_whole(self):
+    ntsteps = []
+    def gen_fn(X):
+      ntsteps.append(X.shape[1])
+      return X
+    gen = BatchedGenerator(gen_fn, chunk_len=None, batch_size=1)
+    for X, X_gen in zip(self.Xs, gen(self.Xs)):
+      self.assertTrue(np.array_equal(X_gen, X), 'whole utterance altered')
+    self.assertEqual(ntsteps, [X.shape[0] for X in self.Xs], 'utterances chunked')
+
+    with self.assertRaises(ValueError):
+      BatchedGenerator(gen_fn, chunk_len=None, batch_size=4)
+
+
+  def test_vocoding_pipeline(self):
+    for num_workers in [0, 2]:
+      written = []
+      pipeline = VocodingPipeline(
+          BatchedGenerator(lambda X: X * 2., chunk_len=64, batch_size=4),
+          _sum_bins,
+          lambda key, x: written.append((key, x)),
+          num_workers=num_workers,
+          queue_size=2)
+      nwritten = pipeline.run(zip('abcde', self.Xs))
+
+      self.assertEqual(nwritten, len(self.Xs), 'incorrect number written')
+      self.assertEqual([k for k, _ in written], list('abcde'), 'outputs out of order')
+      for X, (_, x) in zip(self.Xs, written):
+        self.assertTrue(np.allclose(x, _sum_bins(X * 2.), atol=1e-3), 'incorrect output')
+      self.assertEqual(set(pipeline.utilization().keys()),
+          set(['load', 'generate', 'invert', 'write']), 'missing stages')
+
+  def test_vocoding_pipeline_error(self):
+    def write_fn(key, x):
+      raise IOError()
+    pipeline = VocodingPipeline(
+        BatchedGenerator(lambda X: X, chunk_len=64, batch_size=1),
+        _sum_bins,
+        write_fn,
+        num_workers=0,
+        queue_size=1)
+    with self.assertRaises(IOError):
+      pipeline.run(zip(range(100), self.Xs * 20))
+
+
+  def test_dynamic_batcher(self):
+    batcher = DynamicBatcher(lambda X: X * 2., chunk_len=64, batch_size=16, max_latency=0.5)
+    batcher.warmup(513)
+
+    results = {}
+    def request(i):
+      results[i] = batcher(self.Xs[i])
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(self.Xs))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    batcher.close()
+
+    for i, X in enumerate(self.Xs):
+      self.assertTrue(np.allclose(results[i], X * 2.), 'results returned to wrong caller')
+    stats = batcher.stats()
+    self.assertEqual(stats['requests'], len(self.Xs), 'incorrect request count')
+    self.assertLess(stats['batches'], len(self.Xs), 'concurrent requests not batched')
+    self.assertLessEqual(stats['latency_p50'], stats['latency_p99'], 'invalid percentiles')
+
+  def test_dynamic_batcher_error(self):
+    def gen_fn(X):
+      raise RuntimeError()
+    batcher = DynamicBatcher(gen_fn, chunk_len=64, max_latency=0.)
+    with self.assertRaises(RuntimeError):
+      batcher(self.Xs[0])
+    batcher.close()
+
+
+  def test_streaming_generator(self):
+    X = self.Xs[4]
+    windows = []
+    def gen_fn(X):
+      windows.append(X)
+      return X + 1.
+    gen = StreamingGenerator(gen_fn, chunk_len=64, lookahead=8, context=16)
+
+    X_gens = []
+    nreceived = 0
+    for n in [1, 5, 100, 7, 300, 287]:
+      X_gen = gen.push(X[nreceived:nreceived + n])
+      nreceived += n
+      if X_gen is not None:
+        X_gens.append(X_gen)
+      self.assertEqual(sum([x.shape[0] for x in X_gens]), max(0, nreceived - 8),
+          'lookahead not bounded')
+    X_gens.append(gen.flush())
+
+    self.assertTrue(np.allclose(np.concatenate(X_gens), X + 1.), 'incorrect output')
+    self.assertTrue(all([w.shape == (1, 64, 513, 1) for w in windows]), 'invalid window')
+
+    with self.assertRaises(ValueError):
+      StreamingGenerator(gen_fn, chunk_len=24, lookahead=8, context=16)
+
+  def test_streaming_istft(self):
+    nfft, nhop = 64, 16
+    x = np.random.randn(nhop * 40)
+    istft = StreamingISTFT(nfft, nhop)
+    frames = np.stack([x[i:i + nfft] for i in range(0, len(x) - nfft + 1, nhop)])
+    X = np.fft.rfft(frames * istft.window, axis=1)
+
+    samples = np.concatenate([istft.push(X[:3]), istft.push(X[3:4]), istft.push(X[4:]), istft.flush()])
+    self.assertEqual(samples.shape[0], (X.shape[0] - 1) * nhop + nfft, 'invalid length')
+    # Interior samples are covered by nfft / nhop frames
+    self.assertTrue(np.allclose(samples[nfft:-nfft], x[nfft:len(samples) - nfft]),
+        'not invertible')
+
+  @unittest.skipIf(lws is None, 'lws not installed')
+  def test_streaming_lws(self):
+    nfft, nhop = 256, 64
+    t = np.arange(nhop * 48) / 8000.
+    x = np.sin(2. * np.pi * 440. * t) * np.exp(-3. * t)
+    analysis = lws.lws(nfft, nhop, perfectrec=False)
+    X_mag = np.abs(analysis.stft(x))[:, :, np.newaxis]
+    nframes = X_mag.shape[0]
+
+    def inconsistency(_x):
+      _X_mag = np.abs(analysis.stft(_x))[:nframes]
+      return np.linalg.norm(_X_mag - X_mag[:, :, 0]) / np.linalg.norm(X_mag)
+
+    # Offline online-only LWS (the configuration StreamingLWS runs per block)
+    offline = lws.lws(nfft, nhop, perfectrec=False,
+        look_ahead=3, online_iterations=100, batch_iterations=0)
+    istft = StreamingISTFT(nfft, nhop, window=offline.awin)
+    x_offline = np.concatenate([istft.push(offline.run_lws(X_mag[:, :, 0])), istft.flush()])
+    self.assertLess(inconsistency(x_offline), 0.1, 'offline LWS did not converge')
+
+    # A single push matches offline LWS
+    phase = StreamingLWS(nfft, nhop, context=8)
+    x_stream = np.concatenate([phase.push(X_mag), phase.flush()])
+    self.assertEqual(x_stream.shape[0], (nframes - 1) * nhop + nfft, 'invalid length')
+    self.assertTrue(np.allclose(x_stream, x_offline), 'differs from offline LWS')
+    self.assertLess(inconsistency(x_stream), 0.1, 'phase inconsistent')
+
+    # Blocks emit nhop samples per frame, then nfft - nhop on flush
+    blocks = [phase.push(X_mag[i:i + 16]) for i in range(0, nframes, 16)]
+    self.assertEqual([b.shape[0] for b in blocks],
+        [min(16, nframes - i) * nhop for i in range(0, nframes, 16)], 'invalid block length')
+    blocks.append(phase.flush())
+    self.assertEqual(blocks[-1].shape[0], nfft - nhop, 'invalid flush length')
+    x_blocks = np.concatenate(blocks)
+    self.assertEqual(x_blocks.shape[0], x_offline.shape[0], 'invalid length')
+    self.assertLess(inconsistency(x_blocks), 0.2, 'block-wise phase inconsistent')
+
+
+  def test_streaming_vocoder(self):
+    class Phase(object):
+      def push(self, X_mag):
+        return np.ones(X_mag.shape[0] * 4)
+      def flush(self):
+        return np.ones(12)
+
+    vocoder = StreamingVocoder(lambda X: X, chunk_len=32, lookahead=4, context=8,
+        nfft=16, nhop=4, phase=Phase())
+    self.assertEqual(vocoder.latency_samples, 4 * 4 + 12, 'incorrect latency')
+    blocks = [vocoder.push(self.Xs[2][i:i + 10]) for i in range(0, 300, 10)]
+    blocks.append(vocoder.flush())
+    self.assertEqual(sum([b.shape[0] for b in blocks]), 300 * 4 + 12, 'incorrect length')
+    self.assertTrue(all([b.dtype == np.float32 and b.shape[1:] == (1, 1) for b in blocks]),
+        'invalid audio block')
+
+
+if __name__ == '__main__':
+  unittest.main()